@@ -3,36 +3,77 @@ import re
 import sys
 import json
 import argparse
+import contextlib
+import time
+import hashlib
+import io
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from copy import deepcopy
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, BinaryIO, Callable
 from datetime import datetime
 import textwrap
 
 import cv2  # type: ignore
-from bs4 import BeautifulSoup, NavigableString, Tag  # type: ignore
-from markdown import markdown  # type: ignore
+import numpy as np  # type: ignore
+from bs4 import BeautifulSoup, Tag  # type: ignore
+from markdown import Markdown, markdown  # type: ignore
+from markdown import util as md_util  # type: ignore
+from markdown.extensions.footnotes import (  # type: ignore
+    FN_BACKLINK_TEXT,
+    NBSP_PLACEHOLDER as FN_NBSP_PLACEHOLDER,
+    FootnoteExtension,
+)
 import unicodedata
 import shutil
-from html import escape
+from html import escape, unescape
+from html.parser import HTMLParser
 import requests  # type: ignore
 
+# Raiz do repositório no path para os utilitários compartilhados com o app
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Captura.utils.file_index import build_file_index
+from Captura.utils.video_hash import video_content_hash as _sampled_video_hash
+
+try:
+    from PIL import Image as PILImage  # type: ignore
+except ImportError:  # Pillow é opcional aqui: sem ele os prints ficam sempre em JPEG
+    PILImage = None
+
+# Caracteres de controle removidos por clean_text() (mantém \n \t \r)
+_CONTROL_CHARS_PATTERN = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
 def clean_text(text: str) -> str:
     """Limpa texto removendo caracteres de controle e normalizando Unicode."""
     # Remove caracteres nulos e de controle (exceto \n \t \r)
-    text = ''.join(c for c in text if ord(c) >= 32 or c in '\n\t\r')
+    text = _CONTROL_CHARS_PATTERN.sub('', text)
     # Normaliza Unicode
-    text = unicodedata.normalize('NFC', text)
+    if not unicodedata.is_normalized('NFC', text):
+        text = unicodedata.normalize('NFC', text)
     # Remove surrogates e caracteres inválidos
-    text = text.encode('utf-8', errors='replace').decode('utf-8')
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        text = text.encode('utf-8', errors='replace').decode('utf-8')
     return text
 
 from docx import Document  # type: ignore
-from docx.shared import Pt, Inches, Mm, RGBColor  # type: ignore
+from docx.shared import Emu, Pt, Inches, Mm, RGBColor  # type: ignore
+from docx.enum.style import WD_STYLE_TYPE  # type: ignore
 from docx.enum.text import WD_ALIGN_PARAGRAPH  # type: ignore
 from docx.enum.table import WD_TABLE_ALIGNMENT, WD_ROW_HEIGHT_RULE, WD_ALIGN_VERTICAL  # type: ignore
-from docx.oxml import OxmlElement  # type: ignore
-from docx.oxml.ns import qn  # type: ignore
+from docx.oxml import OxmlElement, parse_xml  # type: ignore
+from docx.oxml.ns import nsdecls, qn  # type: ignore
+from docx.text.paragraph import Paragraph  # type: ignore
+from lxml import etree  # type: ignore
 
 
 ROOT = Path(__file__).resolve().parent
@@ -56,15 +97,109 @@ META_FILES = [
 ]
 MODEL_ASSETS_DIR = WORKDIR / "Documento_exemplo" / "1760722885_it.fin.xx.-conciliao-contas-a-receber"
 
+# Cache persistente (frames etc.), compartilhado entre a geração inicial e as revisões
+CACHE_DIR = Path(os.environ.get("CAPTURA_CACHE_DIR") or str(Path(tempfile.gettempdir()) / "captura_cache"))
+FRAME_CACHE_DIR = CACHE_DIR / "frames"
+FRAME_CACHE_MAX_MB = 512
+VIDEO_INDEX_DIR = CACHE_DIR / "index"
+FINGERPRINT_DIR = CACHE_DIR / "fingerprints"
+VIDEO_PROXY_DIR = CACHE_DIR / "proxy"
+VIDEO_PROXY_MAX_MB = 4096
+DOCX_CACHE_DIR = CACHE_DIR / "docx"
+DOCX_CACHE_MAX_MB = 256
+# Entra na chave do cache de seções do DOCX: incrementar ao mudar a saída do renderizador
+DOCX_RENDER_VERSION = "4"
+DIAGRAM_CACHE_DIR = CACHE_DIR / "diagrams"
+DIAGRAM_CACHE_MAX_MB = 64
+# Entra na chave do cache de diagramas: incrementar ao mudar a saída do Kroki ou do renderizador local
+MERMAID_RENDER_VERSION = "1"
+# Tamanho máximo (px) do diagrama desenhado pelo renderizador local
+MERMAID_LOCAL_MAX_WIDTH = 1550
+MERMAID_LOCAL_MAX_HEIGHT = 1000
+
+# Geometria da página do DOCX (A4); usada também para dimensionar os prints na extração
+PAGE_WIDTH_MM = 210
+PAGE_HEIGHT_MM = 297
+PAGE_MARGIN_LEFT_MM = 20
+PAGE_MARGIN_RIGHT_MM = 20
+PAGE_MARGIN_TOP_MM = 18
+PAGE_MARGIN_BOTTOM_MM = 18
+FIGURE_SIDE_MARGIN_INCHES = 0.4
+# Listas: recuo do primeiro nível, passo por nível e quantos níveis ganham estilo próprio
+LIST_BASE_INDENT_PT = 22
+LIST_INDENT_STEP_PT = 16
+LIST_STYLE_LEVELS = 6
+
 MAX_DIAGRAM_WIDTH_INCHES = 5.2
 MAX_DIAGRAM_HEIGHT_INCHES = 8.5
 PRINT_IMAGE_SCALE = 0.75
-
-# Área útil do vídeo (remove barras pretas e overlays do Teams)
+# Resolução dos prints na largura em que aparecem no DOCX; 0 mantém o limite PRINT_MAX_WIDTH
+PRINT_DPI = 0
+# Codec dos prints: 'auto' escolhe entre PNG-8 (telas com cores chapadas e texto) e JPEG
+PRINT_CODEC = "auto"
+PNG_CANDIDATE_MAX_COLORS = 1024  # cores distintas (4 bits por canal) para tentar PNG-8
+PNG_CANDIDATE_MIN_EDGE_DENSITY = 0.002
+PNG_MAX_QUANT_ERROR = 3.0  # erro médio (0-255) tolerado na paleta de 256 cores
+# Print recortado em torno do clique {x=..,y=..}: fração da área útil mantida; 0 usa o frame inteiro
+PRINT_ROI_SCALE = 0.0
+PRINT_ROI_HIGHLIGHT = True
+PRINT_ROI_MARKER_COLOR = (0, 0, 230)  # BGR
+# Extração em lote: lacunas até este tamanho (em segundos) são percorridas com grab() em vez de seek
+FRAME_BATCH_MAX_GRAB_GAP_SECONDS = 4.0
+# Extração paralela: mínimo de prints por trecho da linha do tempo e threads de compressão por processo
+FRAME_PARALLEL_MIN_SHARD_SIZE = 8
+# Cada processo abre o vídeo e decodifica em paralelo: acima disso o disco e a memória
+# limitam antes da CPU. Vale só para o padrão; --frame-workers/FRAME_EXTRACTION_WORKERS podem passar
+FRAME_PARALLEL_DEFAULT_MAX_WORKERS = 4
+# Abaixo deste total de prints o custo de iniciar os processos (spawn) supera o ganho
+FRAME_PARALLEL_MIN_PRINTS = 24
+FRAME_ENCODE_THREADS = 2
+PRINT_MAX_WIDTH = 1400
+JPEG_QUALITY = 90
+# Modo "melhor frame": janela (segundos) em torno do timestamp; 0 desativa
+BEST_FRAME_WINDOW_SECONDS = 0.0
+BEST_FRAME_SAMPLES = 7
+BEST_FRAME_SCORE_WIDTH = 320
+# Impressões digitais perceptuais (uma por amostra) para análise de cenas
+FINGERPRINT_INTERVAL_SECONDS = 1.0
+FINGERPRINT_THUMB_SIZE = (64, 36)  # miniatura em tons de cinza (largura, altura)
+FINGERPRINT_HASH_SIZE = 16  # dHash 16x16 = 256 bits
+FINGERPRINT_HIST_BINS = 16
+FINGERPRINT_PIXEL_DELTA = 8  # diferença mínima (0-255) para um pixel da miniatura contar como alterado
+FINGERPRINT_SAME_RATIO = 0.001  # ~2 pixels da miniatura (cursor), abaixo de um caractere
+SCENE_CHANGE_PIXEL_RATIO = 0.01
+SCENE_CHANGE_HASH_DISTANCE = 24
+SCENE_CHANGE_HIST_DISTANCE = 0.3
+# Deduplicação de prints, comparados em resolução total: com 0 (padrão) só prints
+# sem nenhum pixel alterado (além do ruído de compressão, FINGERPRINT_PIXEL_DELTA)
+# reutilizam a mesma imagem no DOCX; > 0 tolera essa fração de pixels alterados,
+# desde que nenhum bloco de PRINT_DEDUP_BLOCK_SIZE px concentre mais de
+# PRINT_DEDUP_BLOCK_MAX_PIXELS (texto digitado, um contador). Negativo desativa.
+PRINT_DEDUP_THRESHOLD = 0.0
+PRINT_DEDUP_BLOCK_SIZE = 16
+PRINT_DEDUP_BLOCK_MAX_PIXELS = 4
+
+# Área útil do vídeo (remove barras pretas e overlays do Teams). Usada com
+# CROP_MODE=fixed ou quando a detecção automática não consegue analisar o vídeo.
 CROP_LEFT_X = 0
 CROP_RIGHT_X = 1675
 CROP_TOP_Y = 70
 CROP_BOTTOM_Y = 1010
+# Largura das gravações para as quais CROP_* foram medidos (layout do Teams)
+CROP_REFERENCE_WIDTH = 1920
+
+# Detecção automática do recorte (CROP_MODE=auto). Não é o padrão: ela não remove
+# painéis laterais com conteúdo (vídeos dos participantes à direita no Teams)
+CROP_MODE = "fixed"
+# Proxy só-intra (MJPEG) na resolução dos prints: todo frame é keyframe e o seek custa uma decodificação
+VIDEO_PROXY_JPEG_QUALITY = 95
+VIDEO_PROXY_MAX_GRAB_GAP = 1
+AUTO_CROP_SAMPLES = 32
+AUTO_CROP_ANALYSIS_WIDTH = 480
+AUTO_CROP_UNIFORM_STD = 4.0  # desvio espacial máximo de uma linha/coluna "lisa" (barra, letterbox)
+AUTO_CROP_STATIC_STD = 1.0  # desvio temporal máximo de uma faixa que nunca muda
+AUTO_CROP_MAX_OVERLAY_RATIO = 0.12  # espessura máxima de uma faixa estática de overlay por borda
+AUTO_CROP_MIN_AREA_RATIO = 0.5
 
 PRINT_PATTERN = re.compile(
     r"(?P<prefix>^[ \t]*[-*]\s*)?"  # marcador de lista opcional
@@ -86,6 +221,9 @@ LIST_ITEM_LINE_PATTERN = re.compile(r"^(?P<indent>[ \t]*)(?P<marker>(?:\d+[.)]|[
 
 ASSET_SEARCH_ROOTS: List[Path] = [OUT_DIR, WORKDIR]
 ASSET_RESOLVE_CACHE: Dict[str, Optional[Path]] = {}
+# Índice de nomes de arquivo das raízes de busca, montado na primeira imagem não encontrada
+_ASSET_INDEX: Optional[Dict[str, List[Path]]] = None
+_ASSET_INDEX_ROOTS: Tuple[str, ...] = ()
 
 _CODE_LANG_HINTS = {
     "python", "py", "bash", "sh", "shell", "powershell", "ps1", "sql", "json",
@@ -146,14 +284,14 @@ def _normalize_nested_list_markdown(md_text: str) -> str:
                 candidate_indent_width = _indent_width(candidate_match.group('indent'))
                 if candidate_indent_width <= parent_indent_width:
                     break
-                normalized.append(f"{target_indent}{candidate.lstrip(' \t')}")
+                normalized.append(target_indent + candidate.lstrip(' \t'))
                 j += 1
                 continue
 
             continuation_indent_width = len(re.match(r"^[ \t]*", candidate).group(0).expandtabs(4))
             if continuation_indent_width > parent_indent_width:
                 if continuation_indent_width < (parent_indent_width + 4):
-                    normalized.append(f"{target_indent}{candidate.lstrip(' \t')}")
+                    normalized.append(target_indent + candidate.lstrip(' \t'))
                 else:
                     normalized.append(candidate)
                 j += 1
@@ -232,28 +370,42 @@ def _iter_asset_discovery_roots() -> List[Path]:
     return _dedupe_paths(roots)
 
 
+def _build_asset_filename_index(roots: List[Path]) -> Dict[str, List[Path]]:
+    """Nome de arquivo (minúsculo) -> caminhos, numa varredura limitada das raízes de busca."""
+    index = build_file_index(roots)
+    print(
+        f"[DEBUG] Índice de assets: {index.file_count} arquivo(s) em {len(index.dir_mtimes)} pasta(s), "
+        f"{index.elapsed_ms:.0f} ms"
+    )
+    if index.truncated:
+        print(f"[AVISO] Índice de assets truncado em {index.file_count} arquivos; imagens fora dele não serão encontradas.")
+    return index.files_by_name
+
+
+def _asset_filename_index() -> Dict[str, List[Path]]:
+    """Índice das raízes atuais; refeito só quando ASSET_SEARCH_ROOTS muda."""
+    global _ASSET_INDEX, _ASSET_INDEX_ROOTS
+    roots = _iter_asset_discovery_roots()
+    roots_key = tuple(str(root) for root in roots)
+    if _ASSET_INDEX is None or _ASSET_INDEX_ROOTS != roots_key:
+        _ASSET_INDEX = _build_asset_filename_index(roots)
+        _ASSET_INDEX_ROOTS = roots_key
+    return _ASSET_INDEX
+
+
 def _discover_asset_path(src: str) -> Optional[Path]:
     src_path = Path(src)
     src_parts = tuple(part for part in src_path.parts if part not in ('', '.'))
     if not src_parts:
         return None
 
-    filename = src_parts[-1]
-    for root in _iter_asset_discovery_roots():
-        if not root.exists() or not root.is_dir():
+    for candidate in _asset_filename_index().get(src_parts[-1].lower(), ()):
+        if not _path_suffix_matches(candidate, src_parts):
             continue
         try:
-            for candidate in root.rglob(filename):
-                if not candidate.is_file():
-                    continue
-                if not _path_suffix_matches(candidate, src_parts):
-                    continue
-                try:
-                    return candidate.resolve()
-                except Exception:
-                    return candidate
+            return candidate.resolve()
         except Exception:
-            continue
+            return candidate
     return None
 
 
@@ -492,6 +644,91 @@ def parse_timestamp_to_seconds(ts: str) -> float:
     return 0.0
 
 
+# Dimensões (largura, altura) por (caminho absoluto, mtime_ns): quem grava a imagem já sabe o
+# tamanho e o registra aqui; o layout do DOCX só lê o cabeçalho das demais, nunca decodifica
+_IMAGE_DIMENSIONS: Dict[Tuple[str, int], Tuple[int, int]] = {}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+
+def _image_dimension_key(path: Path) -> Optional[Tuple[str, int]]:
+    try:
+        return os.path.abspath(path), os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def register_image_dimensions(path: Path, width: int, height: int) -> None:
+    """Registra o tamanho de uma imagem recém-gravada (chamar depois da escrita: a chave usa o mtime)."""
+    key = _image_dimension_key(path)
+    if key is not None and width > 0 and height > 0:
+        _IMAGE_DIMENSIONS[key] = (int(width), int(height))
+
+
+def _read_image_header_size(handle: BinaryIO) -> Optional[Tuple[int, int]]:
+    """Largura e altura lidas do cabeçalho PNG (IHDR), JPEG (marcador SOF) ou GIF."""
+    head = handle.read(24)
+    if head[:8] == _PNG_SIGNATURE and head[12:16] == b'IHDR':
+        width, height = int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+        return (width, height) if width > 0 and height > 0 else None
+    if head[:4] == b'GIF8' and len(head) >= 10:
+        width, height = int.from_bytes(head[6:8], 'little'), int.from_bytes(head[8:10], 'little')
+        return (width, height) if width > 0 and height > 0 else None
+    if head[:2] != b'\xff\xd8':
+        return None
+
+    # JPEG: percorre os segmentos pulando o conteúdo (EXIF, tabelas) até o SOF
+    handle.seek(2)
+    while True:
+        marker = handle.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:  # bytes de preenchimento entre marcadores
+            fill = handle.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # marcadores sem segmento
+            continue
+        if code in (0xD9, 0xDA):  # fim da imagem ou início dos dados sem ter achado o SOF
+            return None
+        length = handle.read(2)
+        if len(length) < 2:
+            return None
+        segment_length = int.from_bytes(length, 'big')
+        if segment_length < 2:
+            return None
+        if code in _JPEG_SOF_MARKERS:
+            frame = handle.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = int.from_bytes(frame[1:3], 'big'), int.from_bytes(frame[3:5], 'big')
+            return (width, height) if width > 0 and height > 0 else None
+        handle.seek(segment_length - 2, io.SEEK_CUR)
+
+
+def _get_image_dimensions(img_path: Path) -> Optional[Tuple[int, int]]:
+    key = _image_dimension_key(img_path)
+    if key is not None:
+        cached = _IMAGE_DIMENSIONS.get(key)
+        if cached is not None:
+            return cached
+    try:
+        with open(img_path, 'rb') as handle:
+            dimensions = _read_image_header_size(handle)
+        if dimensions is None and PILImage is not None:
+            # Outros formatos: Image.open só lê o cabeçalho até alguém pedir os pixels
+            with PILImage.open(img_path) as image:
+                dimensions = image.size
+    except Exception as error:  # noqa: BLE001
+        print(f"[AVISO] Não foi possível ler dimensões da imagem {img_path}: {error}")
+        return None
+    if dimensions is not None and key is not None:
+        _IMAGE_DIMENSIONS[key] = dimensions
+    return dimensions
+
+
 def _write_image_bgr(img, out_path: Path) -> bool:
     out_path.parent.mkdir(parents=True, exist_ok=True)
     suffix = out_path.suffix.lower()
@@ -501,15 +738,17 @@ def _write_image_bgr(img, out_path: Path) -> bool:
     if suffix == '.png':
         success, buf = cv2.imencode('.png', img)
     else:
-        success, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        success, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
     if not success:
         return False
     try:
         out_path.write_bytes(buf.tobytes())
-        return True
     except Exception as exc:
         print(f"[ERRO] Falha ao salvar imagem: {out_path} - {exc}")
         return False
+    height, width = img.shape[:2]
+    register_image_dimensions(out_path, width, height)
+    return True
 
 
 def _make_placeholder(ts_seconds: float, label: str) -> 'cv2.Mat':
@@ -535,249 +774,2686 @@ def _make_placeholder(ts_seconds: float, label: str) -> 'cv2.Mat':
     return img
 
 
-def extract_frame(video_path: Path, seconds: float, out_path: Path, coords: Optional[Tuple[int, int]] = None) -> bool:
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
-        return _write_image_bgr(placeholder, out_path)
-
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+def _frame_index_for_seconds(seconds: float, fps: float, total_frames: float) -> int:
+    """Índice do frame efetivamente decodificado para um timestamp (mesma regra de extract_frame)."""
     target = int(seconds * fps)
     if total_frames and target >= total_frames:
         target = max(int(total_frames) - 2, 0)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, max(target - 1, 0))
-    ok, frame = cap.read()
-    if not ok or frame is None:
-        cap.release()
-        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
-        return _write_image_bgr(placeholder, out_path)
+    return max(target - 1, 0)
+
+
+@dataclass(frozen=True)
+class CropRect:
+    """Área útil do frame em pixels (right/bottom exclusivos)."""
+
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    def apply(self, frame):
+        h, w = frame.shape[:2]
+        left = max(0, min(self.left, max(w - 1, 0)))
+        right = max(left + 1, min(self.right, w))
+        top = max(0, min(self.top, max(h - 1, 0)))
+        bottom = max(top + 1, min(self.bottom, h))
+        return frame[top:bottom, left:right]
+
+    def signature(self) -> str:
+        return f"{self.left},{self.top},{self.right},{self.bottom}"
+
+    def scaled(self, scale: float) -> 'CropRect':
+        return CropRect(
+            int(round(self.left * scale)),
+            int(round(self.top * scale)),
+            int(round(self.right * scale)),
+            int(round(self.bottom * scale)),
+        )
+
+
+def _fixed_crop_rect(width: int, height: int) -> CropRect:
+    """Recorte das constantes CROP_* (layout do Teams em 1920x1080)."""
+    crop_left = max(0, min(CROP_LEFT_X, max(width - 1, 0)))
+    crop_right = width if CROP_RIGHT_X <= 0 else max(crop_left + 1, min(CROP_RIGHT_X, width))
+    crop_top = max(0, min(CROP_TOP_Y, max(height - 1, 0)))
+    crop_bottom = max(crop_top + 1, min(CROP_BOTTOM_Y, height))
+    return CropRect(crop_left, crop_top, crop_right, crop_bottom)
 
+
+def _crop_print_frame(frame, crop: Optional[CropRect] = None):
     # Recorte para remover barras e overlays (topo, direita e rodapé)
-    h, w = frame.shape[:2]
-    crop_left = max(0, min(CROP_LEFT_X, max(w - 1, 0)))
-    crop_right = w if CROP_RIGHT_X <= 0 else max(crop_left + 1, min(CROP_RIGHT_X, w))
-    crop_top = max(0, min(CROP_TOP_Y, max(h - 1, 0)))
-    crop_bottom = max(crop_top + 1, min(CROP_BOTTOM_Y, h))
-    if crop_bottom <= crop_top:
-        crop_bottom = h
-        crop_top = 0
-    if crop_bottom > crop_top:
-        frame = frame[crop_top:crop_bottom, crop_left:crop_right]
+    if crop is None:
+        h, w = frame.shape[:2]
+        crop = _fixed_crop_rect(w, h)
+    return crop.apply(frame)
+
+
+def print_display_width_inches() -> float:
+    """Largura (polegadas) em que _add_figure() desenha um print sem width/height explícitos."""
+    content_width_mm = PAGE_WIDTH_MM - PAGE_MARGIN_LEFT_MM - PAGE_MARGIN_RIGHT_MM
+    max_width_inches = max(content_width_mm / 25.4 - FIGURE_SIDE_MARGIN_INCHES, 1.0)
+    return max_width_inches * PRINT_IMAGE_SCALE
+
+
+def print_max_width_for_dpi(dpi: int) -> int:
+    """Largura máxima do print em pixels para a resolução pedida (0 = PRINT_MAX_WIDTH)."""
+    if dpi <= 0:
+        return PRINT_MAX_WIDTH
+    return max(int(round(print_display_width_inches() * dpi)), 1)
+
+
+@dataclass(frozen=True)
+class PrintRenderSpec:
+    """Como o frame vira o arquivo do print: recorte, região do clique e largura máxima."""
+
+    crop: Optional[CropRect] = None
+    max_width: int = PRINT_MAX_WIDTH
+    codec: str = 'jpeg'  # 'jpeg' ou 'auto' (PNG-8 quando for menor sem perder legibilidade)
+    roi_scale: float = 0.0  # fração da área útil mantida em torno das coordenadas; 0 desativa
+    roi_highlight: bool = PRINT_ROI_HIGHLIGHT
+
+
+def _print_roi_rect(area: CropRect, focus: Tuple[int, int], roi_scale: float) -> Optional[CropRect]:
+    """
+    Janela com as proporções da área útil, centrada no clique e deslocada para
+    caber inteira nela. None se o clique estiver fora da área (usa o frame inteiro).
+    """
+    x, y = focus
+    if roi_scale <= 0 or roi_scale >= 1 or not (area.left <= x < area.right and area.top <= y < area.bottom):
+        return None
+    width = max(int(round((area.right - area.left) * roi_scale)), 1)
+    height = max(int(round((area.bottom - area.top) * roi_scale)), 1)
+    left = min(max(x - width // 2, area.left), area.right - width)
+    top = min(max(y - height // 2, area.top), area.bottom - height)
+    return CropRect(left, top, left + width, top + height)
+
+
+def _prepare_print_frame(
+    frame,
+    render: Optional[PrintRenderSpec] = None,
+    focus: Optional[Tuple[int, int]] = None,
+):
+    render = render or PrintRenderSpec()
+    area = render.crop
+    if area is None:
         h, w = frame.shape[:2]
+        area = _fixed_crop_rect(w, h)
+    roi = _print_roi_rect(area, focus, render.roi_scale) if focus is not None else None
+    frame = (roi or area).apply(frame)
+    if roi is not None and render.roi_highlight:
+        # Cópia: o frame decodificado pode ser reutilizado por outro print (method='reuse')
+        frame = frame.copy()
+        radius = max(int(min(frame.shape[:2]) * 0.06), 8)
+        center = (focus[0] - roi.left, focus[1] - roi.top)
+        cv2.circle(frame, center, radius, PRINT_ROI_MARKER_COLOR, max(radius // 6, 2), cv2.LINE_AA)
+    h, w = frame.shape[:2]
 
-    max_width = 1400
+    max_width = render.max_width
     if w > max_width:
         scale = max_width / w
         frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return frame
 
-    ok = _write_image_bgr(frame, out_path)
-    cap.release()
-    if not ok:
-        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
-        return _write_image_bgr(placeholder, out_path)
-    return ok
 
+def _env_int(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or '').strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        print(f"[AVISO] Valor inválido em {name}: {raw!r}. Usando {default}.")
+        return default
 
-_COORD_EXTRACT_PATTERN = re.compile(r"\{([^{}]+)\}\s*$")
-_COORD_PAIR_PATTERN = re.compile(r"(x|y)\s*=\s*(-?\d+)", re.IGNORECASE)
 
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or '').strip()
+    if not raw:
+        return default
+    try:
+        return float(raw.replace(',', '.'))
+    except ValueError:
+        print(f"[AVISO] Valor inválido em {name}: {raw!r}. Usando {default}.")
+        return default
 
-def replace_print_placeholders(md_text: str) -> Tuple[str, List[PrintOccurrence]]:
-    occurrences: List[PrintOccurrence] = []
 
-    def repl(match: re.Match) -> str:
-        ts_str = (match.group('ts') or '').strip()
-        raw_desc = (match.group('desc') or '').strip()
-        prefix = match.group('prefix') or ''
+_VIDEO_HASH_MEMO: Dict[Tuple[str, int, int], str] = {}
 
-        coords: Optional[Tuple[int, int]] = None
-        coords_text = match.group('coords')
-        if coords_text:
-            pairs = {k.lower(): int(v) for k, v in _COORD_PAIR_PATTERN.findall(coords_text)}
-            if 'x' in pairs and 'y' in pairs:
-                coords = (pairs['x'], pairs['y'])
-        else:
-            coord_match = _COORD_EXTRACT_PATTERN.search(raw_desc)
-            if coord_match:
-                coords_text = coord_match.group(1)
-                raw_desc = raw_desc[:coord_match.start()].strip()
-                pairs = {k.lower(): int(v) for k, v in _COORD_PAIR_PATTERN.findall(coords_text)}
-                if 'x' in pairs and 'y' in pairs:
-                    coords = (pairs['x'], pairs['y'])
-
-        desc = raw_desc
-        ts_for_file = ts_str.replace(":", "-")
-        safe_desc = re.sub(r"[^a-zA-Z0-9_-]+", "-", desc)[:80].strip("-") or "print"
-        filename = f"frame_{ts_for_file}_{safe_desc}.jpg".lower()
-        img_path = ASSETS_DIR / filename
-        token = f"PRINT_SLOT_{len(occurrences) + 1}_TOKEN"
-        occurrences.append(PrintOccurrence(
-            token=token,
-            timestamp=ts_str,
-            description=desc,
-            image_path=img_path,
-            coords=coords,
-        ))
-        replacement = token
-        if prefix:
-            replacement = f"{prefix}{token}"
-        return replacement
 
-    new_md = PRINT_PATTERN.sub(repl, md_text)
-    return new_md, occurrences
+def video_content_hash(video_path: Path) -> str:
+    """
+    Hash do conteúdo do vídeo usado como chave dos caches.
 
+    Para não ler vídeos de vários GB inteiros, combina o tamanho do arquivo com
+    amostras do início, do meio e do fim (Captura/utils/video_hash.py). Se o app já
+    calculou esse mesmo hash (INPUT_VIDEO_CONTENT_HASH), ele é usado para
+    INPUT_VIDEO_PATH sem reler o vídeo.
+    """
+    stat = video_path.stat()
+    memo_key = (str(video_path), stat.st_size, stat.st_mtime_ns)
+    cached = _VIDEO_HASH_MEMO.get(memo_key)
+    if cached:
+        return cached
+
+    known_hash = (os.environ.get("INPUT_VIDEO_CONTENT_HASH") or '').strip().lower()
+    if (
+        re.fullmatch(r"[0-9a-f]{64}", known_hash)
+        and _VIDEO_ENV
+        and Path(_VIDEO_ENV).resolve() == video_path.resolve()
+    ):
+        _VIDEO_HASH_MEMO[memo_key] = known_hash
+        return known_hash
+
+    value = _sampled_video_hash(video_path)
+    _VIDEO_HASH_MEMO[memo_key] = value
+    return value
+
+
+class FrameCache:
+    """
+    Cache em disco de prints já renderizados, endereçado pelo conteúdo.
 
-def _create_diagram_placeholder(output_path: Path) -> bool:
-    width, height = 1280, 720
-    try:
-        import numpy as np  # type: ignore
-    except Exception as exc:  # noqa: BLE001
-        print(f"[AVISO] Falha ao importar numpy para placeholder de diagrama: {exc}")
-        return False
+    A chave combina o hash do vídeo, o frame exato e a assinatura de renderização
+    (recorte, largura máxima, qualidade). A remoção é LRU pela data de modificação,
+    atualizada a cada acerto, respeitando o orçamento de disco.
+    """
 
-    img = np.full((height, width, 3), 255, dtype='uint8')
-    cv2.rectangle(img, (40, 40), (width - 40, height - 40), (200, 200, 200), thickness=4)
-    cv2.putText(img, 'Diagrama não renderizado', (60, height // 2 - 30), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (50, 50, 50), 3, cv2.LINE_AA)
-    cv2.putText(img, 'Verifique a conexão ou gere manualmente', (60, height // 2 + 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (90, 90, 90), 2, cv2.LINE_AA)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    max_export_width = 1200
-    max_export_height = 720
-    current_height, current_width = img.shape[:2]
-    export_scale = min(1.0, max_export_width / max(current_width, 1), max_export_height / max(current_height, 1))
-    if export_scale < 1.0:
-        new_size = (max(1, int(current_width * export_scale)), max(1, int(current_height * export_scale)))
-        img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(video_hash: str, frame_index: int, signature: str) -> str:
+        payload = f"{video_hash}|{frame_index}|{signature}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.root / key[:2] / f"{key}{suffix}"
+
+    def fetch(self, key: str, out_path: Path) -> Optional[Path]:
+        """
+        Copia a entrada para out_path e devolve o caminho gravado. A extensão pode
+        diferir de out_path quando o codec foi escolhido na gravação (PNG x JPEG).
+        """
+        suffixes = [out_path.suffix.lower()] + [ext for ext in ('.jpg', '.png') if ext != out_path.suffix.lower()]
+        for suffix in suffixes:
+            entry = self._entry_path(key, suffix)
+            if not entry.exists():
+                continue
+            target = out_path.with_suffix(suffix)
+            try:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(entry, target)
+                os.utime(entry, None)  # marca como usado recentemente (LRU)
+            except OSError:
+                break
+            with self._lock:
+                self.hits += 1
+            return target
+        with self._lock:
+            self.misses += 1
+        return None
 
-    return _write_image_bgr(img, output_path)
+    def has(self, key: str, out_path: Path) -> bool:
+        """Se existe entrada para a chave, em qualquer das extensões aceitas por fetch()."""
+        return any(self._entry_path(key, suffix).exists() for suffix in {out_path.suffix.lower(), '.jpg', '.png'})
 
+    def store(self, key: str, src_path: Path) -> None:
+        entry = self._entry_path(key, src_path.suffix.lower())
+        tmp_path = entry.with_name(f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, entry)
+            size = entry.stat().st_size
+        except OSError as error:
+            print(f"[AVISO] Falha ao gravar frame no cache ({entry}): {error}")
+            return
+        self._record_size(size)
 
-def _build_print_figure(soup: BeautifulSoup, occurrence: PrintOccurrence) -> Tag:
-    figure = soup.new_tag("figure", attrs={"class": "video-print"})
-    img = soup.new_tag("img", src=f"assets/prints/{occurrence.image_path.name}", alt=occurrence.description, loading="lazy")
-    figure.append(img)
-    caption = soup.new_tag("figcaption")
-    caption.string = occurrence.description
-    figure.append(caption)
-    return figure
+    def _record_size(self, size: int) -> None:
+        with self._lock:
+            if self._size_bytes is None:
+                self._size_bytes = sum(entry_size for _, entry_size, _ in self._entries())
+            else:
+                self._size_bytes += size
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries: List[Tuple[float, int, Path]] = []
+        if not self.root.exists():
+            return entries
+        for bucket in self.root.iterdir():
+            if not bucket.is_dir():
+                continue
+            for entry in bucket.iterdir():
+                if entry.suffix == '.tmp':
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # Libera um pouco abaixo do limite para não remover a cada novo frame
+        target = int(self.max_bytes * 0.9)
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._size_bytes = total
 
+    def size_bytes(self) -> int:
+        with self._lock:
+            if self._size_bytes is None:
+                self._size_bytes = sum(size for _, size, _ in self._entries())
+            return self._size_bytes
 
-def inject_print_figures(soup: BeautifulSoup, occurrences: List[PrintOccurrence]) -> None:
-    if not occurrences:
-        return
 
-    token_map: Dict[str, PrintOccurrence] = {occ.token: occ for occ in occurrences}
-    for text_node in list(soup.find_all(string=PRINT_TOKEN_PATTERN)):
-        text_value = str(text_node)
-        matches = list(PRINT_TOKEN_PATTERN.finditer(text_value))
-        if not matches:
-            continue
+_FRAME_CACHE: Optional[FrameCache] = None
 
-        fragments: List[Any] = []
-        last = 0
-        for match in matches:
-            if match.start() > last:
-                fragments.append(text_value[last:match.start()])
-            token = match.group(0)
-            occurrence = token_map.get(token)
-            if occurrence is None:
-                fragments.append(token)
-            else:
-                figure_tag = _build_print_figure(soup, occurrence)
-                fragments.append(figure_tag)
-            last = match.end()
-        if last < len(text_value):
-            fragments.append(text_value[last:])
 
-        for fragment in fragments:
-            if isinstance(fragment, str):
-                if fragment:
-                    text_node.insert_before(fragment)
-            else:
-                text_node.insert_before(fragment)
-        text_node.extract()
+def get_frame_cache() -> Optional[FrameCache]:
+    """Cache de frames do processo atual; None quando desativado (FRAME_CACHE_MAX_MB=0)."""
+    global _FRAME_CACHE
+    max_mb = _env_int("FRAME_CACHE_MAX_MB", FRAME_CACHE_MAX_MB)
+    if max_mb <= 0:
+        return None
+    if _FRAME_CACHE is None:
+        _FRAME_CACHE = FrameCache(FRAME_CACHE_DIR, max_mb * 1024 * 1024)
+    return _FRAME_CACHE
+
+
+def _print_render_signature(
+    out_path: Path,
+    render: Optional[PrintRenderSpec] = None,
+    focus: Optional[Tuple[int, int]] = None,
+) -> str:
+    """Parâmetros que afetam os bytes do print gerado; entram na chave do cache."""
+    render = render or PrintRenderSpec()
+    crop_signature = render.crop.signature() if render.crop is not None else (
+        f"{CROP_LEFT_X},{CROP_TOP_Y},{CROP_RIGHT_X},{CROP_BOTTOM_Y}"
+    )
+    signature = (
+        f"crop={crop_signature};"
+        f"max_w={render.max_width};q={JPEG_QUALITY};fmt={out_path.suffix.lower()}"
+    )
+    if render.codec != 'jpeg':
+        signature += f";codec={render.codec}"
+    if focus is not None and render.roi_scale > 0:
+        signature += f";roi={focus[0]},{focus[1]},{render.roi_scale:g},{int(render.roi_highlight)}"
+    return signature
 
 
-def _render_mermaid_diagram(code: str, output_path: Path) -> bool:
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    url = "https://kroki.io/mermaid/png"
-    headers = {'Accept': 'image/png', 'Content-Type': 'application/json; charset=utf-8'}
-    try:
-        response = requests.post(url, json={'diagram_source': code}, headers=headers, timeout=20)
-        if response.status_code == 200:
-            output_path.write_bytes(response.content)
-            return True
-        preview = response.text[:200] if response.content else ''
-        if preview:
-            print(f"[AVISO] Kroki retornou status {response.status_code}: {preview}")
+@dataclass
+class VideoSeekIndex:
+    """
+    Índice de seek do vídeo: PTS real de cada frame (ordem de apresentação) e
+    posição dos keyframes. Gerado uma vez por vídeo e salvo como .npz ao lado do
+    cache de frames, endereçado pelo hash do conteúdo.
+    """
+
+    pts_ms: Any  # np.ndarray[float64], relativo ao primeiro frame
+    keyframes: Any  # np.ndarray[int64], índices de frame (vazio se o backend não informar)
+    fps: float
+
+    # Tolerância para imprecisão de ponto flutuante ao comparar timestamps
+    PTS_TOLERANCE_MS = 0.5
+
+    @property
+    def frame_count(self) -> int:
+        return int(self.pts_ms.size)
+
+    @property
+    def duration_seconds(self) -> float:
+        if self.frame_count == 0:
+            return 0.0
+        if self.frame_count > 1:
+            frame_ms = float(np.median(np.diff(self.pts_ms)))
         else:
-            print(f"[AVISO] Kroki retornou status {response.status_code} para diagrama Mermaid.")
-    except Exception as error:  # noqa: BLE001
-        print(f"[AVISO] Falha ao renderizar diagrama Mermaid via Kroki: {error}")
-    if _render_mermaid_locally(code, output_path):
-        print("[OK] Diagrama Mermaid renderizado localmente.")
-        return True
-    print("[AVISO] Usando placeholder para diagrama Mermaid.")
-    return _create_diagram_placeholder(output_path)
+            frame_ms = 1000.0 / (self.fps or 30.0)
+        return (float(self.pts_ms[-1]) + frame_ms) / 1000.0
+
+    @property
+    def has_keyframes(self) -> bool:
+        return int(self.keyframes.size) > 0
+
+    def frame_index_for_seconds(self, seconds: float) -> int:
+        """Mesma regra de _frame_index_for_seconds, mas usando os PTS reais (vídeos VFR)."""
+        count = self.frame_count
+        if seconds >= self.duration_seconds:
+            target = count
+        else:
+            position = np.searchsorted(self.pts_ms, seconds * 1000.0 + self.PTS_TOLERANCE_MS, side='right')
+            target = int(position) - 1
+        if target >= count:
+            target = max(count - 2, 0)
+        return max(target - 1, 0)
 
+    def keyframe_at_or_before(self, frame_index: int) -> int:
+        if not self.has_keyframes:
+            return 0
+        position = int(np.searchsorted(self.keyframes, frame_index, side='right')) - 1
+        return int(self.keyframes[max(position, 0)])
 
-def replace_mermaid_blocks(md_text: str) -> Tuple[str, List[Path]]:
-    generated_paths: List[Path] = []
+    def seek_decode_cost(self, frame_index: int) -> int:
+        """Quantidade de frames que um seek até frame_index precisa decodificar."""
+        return frame_index - self.keyframe_at_or_before(frame_index)
 
-    def repl(match: re.Match) -> str:
-        code = match.group(1)  # Grupo 1 agora contém o código do diagrama
-        if code is None:
-            return ''
-        diagram_code = code.strip()
-        if not diagram_code:
-            return ''
-        diagram_index = len(generated_paths) + 1
-        filename = f"diagram_{diagram_index:02d}.png"
-        output_path = DIAGRAMS_DIR / filename
-        success = _render_mermaid_diagram(diagram_code, output_path)
-        if success:
-            print(f"[OK] Diagrama Mermaid #{diagram_index} salvo em: {output_path}")
-        generated_paths.append(output_path)
+    def nominal_position(self, frame_index: int) -> int:
+        """
+        Posição para CAP_PROP_POS_FRAMES. O backend do OpenCV converte frames em
+        tempo usando o FPS nominal, então em vídeos VFR o índice real precisa ser
+        traduzido pelo PTS do frame.
+        """
+        return int(round(float(self.pts_ms[frame_index]) * (self.fps or 30.0) / 1000.0))
 
-        caption = "Diagrama de fluxo do processo"
-        escaped_caption = escape(caption)
-        figure_html = (
-            f'<figure class="process-diagram">'
-            f'<img src="assets/diagrams/{filename}" alt="{escaped_caption}" loading="lazy"/>'
-            f'<figcaption>{escaped_caption}</figcaption>'
-            '</figure>'
-        )
-        return figure_html
 
-    new_md = MERMAID_BLOCK_PATTERN.sub(repl, md_text)
-    return new_md, generated_paths
+_SEEK_INDEX_MEMO: Dict[str, VideoSeekIndex] = {}
 
 
-def _parse_node_token(token: str) -> Tuple[str, str, str]:
+def _scan_video_seek_index(video_path: Path) -> Optional[VideoSeekIndex]:
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    # Em modo "raw" o grab() apenas demultiplexa os pacotes, sem decodificar
+    raw_mode = bool(cap.set(cv2.CAP_PROP_FORMAT, -1))
+    key_prop = getattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME', None) if raw_mode else None
+    pts: List[float] = []
+    key_pts: List[float] = []
+    try:
+        while cap.grab():
+            position_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+            pts.append(position_ms)
+            if key_prop is not None and cap.get(key_prop):
+                key_pts.append(position_ms)
+    finally:
+        cap.release()
+    if not pts:
+        return None
+
+    # Pacotes chegam em ordem de decodificação; frames decodificados saem em ordem de PTS
+    pts_ms = np.sort(np.asarray(pts, dtype=np.float64))
+    origin = float(pts_ms[0])
+    pts_ms -= origin
+    keyframes = np.unique(np.searchsorted(pts_ms, np.asarray(key_pts, dtype=np.float64) - origin))
+    return VideoSeekIndex(pts_ms=pts_ms, keyframes=keyframes.astype(np.int64), fps=float(fps))
+
+
+def load_video_seek_index(video_path: Path, video_hash: Optional[str] = None) -> Optional[VideoSeekIndex]:
     """
-    Parseia um token de nó Mermaid e extrai: node_id, label, shape.
-    
-    Exemplos:
-        - "Start([Início])" -> ('Start', 'Início', 'circle')
-        - "Config[Carregar Configurações]" -> ('Config', 'Carregar Configurações', 'rect')
-        - "Classify[Classificar Transações <br/>(Regex no Histórico)]" -> ('Classify', 'Classificar Transações (Regex no Histórico)', 'rect')
+    Carrega o índice de seek do vídeo, criando-o na primeira vez (uma passada sem
+    decodificar). Retorna None se o vídeo não puder ser indexado.
     """
-    token = token.strip()
-    if not token:
-        return '', '', 'rect'
+    video_hash = video_hash or video_content_hash(video_path)
+    cached = _SEEK_INDEX_MEMO.get(video_hash)
+    if cached is not None:
+        return cached
+
+    sidecar = VIDEO_INDEX_DIR / f"{video_hash}.npz"
+    index: Optional[VideoSeekIndex] = None
+    if sidecar.exists():
+        try:
+            with np.load(sidecar) as data:
+                index = VideoSeekIndex(
+                    pts_ms=data['pts_ms'],
+                    keyframes=data['keyframes'],
+                    fps=float(data['fps']),
+                )
+        except Exception as error:  # noqa: BLE001
+            print(f"[AVISO] Índice de seek inválido ({sidecar.name}): {error}. Recriando.")
+            index = None
+
+    if index is None:
+        started = time.perf_counter()
+        index = _scan_video_seek_index(video_path)
+        if index is None:
+            print(f"[AVISO] Não foi possível indexar o vídeo {video_path.name}; usando o FPS nominal.")
+            return None
+        tmp_path = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+        try:
+            VIDEO_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open('wb') as handle:
+                np.savez_compressed(handle, pts_ms=index.pts_ms, keyframes=index.keyframes, fps=index.fps)
+            os.replace(tmp_path, sidecar)
+        except OSError as error:
+            print(f"[AVISO] Falha ao salvar índice de seek ({sidecar}): {error}")
+        print(
+            f"[OK] Índice de seek criado: {index.frame_count} frame(s), {int(index.keyframes.size)} keyframe(s), "
+            f"duração {index.duration_seconds:.1f}s ({(time.perf_counter() - started) * 1000:.0f} ms)"
+        )
 
-    # Lista de delimitadores ordenados do mais específico para o menos específico
-    # O formato é: (start_delim, end_delim, shape_name)
-    shapes = [
-        ('([', '])', 'circle'),   # Stadium shape - usado para início/fim
-        ('[[', ']]', 'rect'),     # Subroutine
-        ('{{', '}}', 'circle'),   # Hexagon
-        ('((', '))', 'circle'),   # Circle
-        ('{', '}', 'diamond'),    # Diamond/Decision
-        ('[', ']', 'rect'),       # Rectangle
-        ('(', ')', 'round'),      # Rounded rectangle
-    ]
-    
+    _SEEK_INDEX_MEMO[video_hash] = index
+    return index
+
+
+def _resolve_frame_index(
+    seconds: float,
+    fps: float,
+    total_frames: float,
+    seek_index: Optional[VideoSeekIndex],
+    label: str,
+) -> int:
+    if seek_index is None:
+        return _frame_index_for_seconds(seconds, fps, total_frames)
+    if seconds >= seek_index.duration_seconds:
+        print(
+            f"[AVISO] Print {label} após o fim do vídeo ({seek_index.duration_seconds:.1f}s). "
+            "Usando o último frame."
+        )
+    return seek_index.frame_index_for_seconds(seconds)
+
+
+def _leading_run(mask) -> int:
+    """Quantidade de True consecutivos no início do vetor."""
+    misses = np.flatnonzero(~mask)
+    return int(misses[0]) if misses.size else int(mask.size)
+
+
+def _edge_trim(uniform, static, max_overlay: int) -> Tuple[int, int]:
+    """Quanto remover no início e no fim de um eixo: barras lisas + faixa estática de overlay."""
+    trims = []
+    for uniform_axis, static_axis in ((uniform, static), (uniform[::-1], static[::-1])):
+        border = _leading_run(uniform_axis & static_axis)
+        overlay = _leading_run(static_axis[border:])
+        trims.append(border + (overlay if overlay <= max_overlay else 0))
+    return trims[0], trims[1]
+
+
+def detect_print_crop(video_path: Path, seek_index: Optional[VideoSeekIndex] = None) -> Optional[CropRect]:
+    """
+    Detecta a área útil do vídeo a partir de AUTO_CROP_SAMPLES frames espalhados.
+
+    Em uma pilha de frames em tons de cinza reduzidos, calcula por linha e por coluna
+    o desvio espacial (barras lisas, letterbox) e o desvio temporal (faixas que nunca
+    mudam). Remove das bordas as barras lisas e estáticas e, se o centro do vídeo
+    muda, também faixas horizontais estáticas de overlay (barra de título, barra do
+    gravador) até AUTO_CROP_MAX_OVERLAY_RATIO. Nas laterais só barras lisas são
+    removidas: colunas estáticas costumam ser conteúdo (rótulos, menus fixos).
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return None
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+    if seek_index is not None:
+        frame_count = seek_index.frame_count
+    else:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+    grays = []
+    try:
+        # Ignora o primeiro e o último frame (telas de abertura/encerramento da gravação)
+        positions = np.linspace(0, max(frame_count - 1, 0), AUTO_CROP_SAMPLES + 2)[1:-1] if frame_count else []
+        for position in sorted({int(value) for value in positions}):
+            if seek_index is not None:
+                position = seek_index.nominal_position(position)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                continue
+            height, width = frame.shape[:2]
+            scale = min(AUTO_CROP_ANALYSIS_WIDTH / max(width, 1), 1.0)
+            small = cv2.resize(frame, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv2.INTER_AREA)
+            grays.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+    finally:
+        cap.release()
+    if len(grays) < 2 or not width or not height:
+        return None
+
+    stack = np.stack(grays).astype(np.float32)
+    temporal = stack.std(axis=0)
+    row_uniform = stack.std(axis=2).mean(axis=0) < AUTO_CROP_UNIFORM_STD
+    col_uniform = stack.std(axis=1).mean(axis=0) < AUTO_CROP_UNIFORM_STD
+    row_static = temporal.max(axis=1) < AUTO_CROP_STATIC_STD
+    col_static = temporal.max(axis=0) < AUTO_CROP_STATIC_STD
+
+    small_h, small_w = stack.shape[1:]
+    if row_static.all() or col_static.all():
+        # Vídeo sem mudanças: não há como separar overlay de conteúdo, remove só barras lisas
+        row_static = row_static & row_uniform
+        col_static = col_static & col_uniform
+    top, bottom = _edge_trim(row_uniform, row_static, int(small_h * AUTO_CROP_MAX_OVERLAY_RATIO))
+    left, right = _edge_trim(col_uniform, col_static, 0)
+
+    scale_x = width / small_w
+    scale_y = height / small_h
+    crop = CropRect(
+        left=int(np.ceil(left * scale_x)),
+        top=int(np.ceil(top * scale_y)),
+        right=int(np.floor((small_w - right) * scale_x)),
+        bottom=int(np.floor((small_h - bottom) * scale_y)),
+    )
+    area = max(crop.right - crop.left, 0) * max(crop.bottom - crop.top, 0)
+    if area < width * height * AUTO_CROP_MIN_AREA_RATIO:
+        print(f"[AVISO] Recorte automático descartado ({crop.signature()}): área útil pequena demais.")
+        return CropRect(0, 0, width, height)
+    return crop
+
+
+_CROP_MEMO: Dict[Tuple[str, str], CropRect] = {}
+
+
+def resolve_print_crop(
+    video_path: Path,
+    video_hash: Optional[str] = None,
+    mode: Optional[str] = None,
+    seek_index: Optional[VideoSeekIndex] = None,
+) -> Optional[CropRect]:
+    """
+    Recorte aplicado aos prints deste vídeo. Com CROP_MODE=auto a detecção roda uma
+    vez por vídeo e o resultado fica em CAPTURA_CACHE_DIR/index/<hash>.crop.json.
+    Em gravações com a largura do layout do Teams (CROP_REFERENCE_WIDTH), a borda
+    direita nunca passa de CROP_RIGHT_X: o painel lateral de vídeos não é uma barra
+    lisa e a detecção não o remove.
+    Retorna None para usar as constantes CROP_* (modo fixed ou falha na detecção).
+    """
+    mode = (mode or os.environ.get("CROP_MODE") or CROP_MODE).strip().lower()
+    if mode != 'auto':
+        return None
+    video_hash = video_hash or video_content_hash(video_path)
+    memo_key = (video_hash, mode)
+    if memo_key in _CROP_MEMO:
+        return _CROP_MEMO[memo_key]
+
+    sidecar = VIDEO_INDEX_DIR / f"{video_hash}.crop.json"
+    crop: Optional[CropRect] = None
+    if sidecar.exists():
+        try:
+            data = json.loads(sidecar.read_text(encoding='utf-8'))
+            crop = CropRect(int(data['left']), int(data['top']), int(data['right']), int(data['bottom']))
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print(f"[AVISO] Recorte em cache inválido ({sidecar.name}): {error}. Detectando novamente.")
+            crop = None
+
+    if crop is None:
+        started = time.perf_counter()
+        crop = detect_print_crop(video_path, seek_index)
+        if crop is None:
+            print("[AVISO] Não foi possível detectar o recorte do vídeo. Usando CROP_* fixos.")
+            return None
+        try:
+            VIDEO_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_path = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(crop.__dict__), encoding='utf-8')
+            os.replace(tmp_path, sidecar)
+        except OSError as error:
+            print(f"[AVISO] Falha ao salvar recorte detectado ({sidecar}): {error}")
+        print(
+            f"[OK] Recorte automático: x={crop.left}..{crop.right}, y={crop.top}..{crop.bottom} "
+            f"({(time.perf_counter() - started) * 1000:.0f} ms)"
+        )
+
+    crop = _clamp_teams_side_panel(video_path, crop)
+    _CROP_MEMO[memo_key] = crop
+    return crop
+
+
+def _clamp_teams_side_panel(video_path: Path, crop: CropRect) -> CropRect:
+    if CROP_RIGHT_X <= 0 or crop.right <= CROP_RIGHT_X:
+        return crop
+    cap = cv2.VideoCapture(str(video_path))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0) if cap.isOpened() else 0
+    cap.release()
+    if width != CROP_REFERENCE_WIDTH or crop.left >= CROP_RIGHT_X:
+        return crop
+    print(f"[DEBUG] Recorte automático limitado a x<={CROP_RIGHT_X} (painel lateral do Teams).")
+    return CropRect(crop.left, crop.top, CROP_RIGHT_X, crop.bottom)
+
+
+@dataclass(frozen=True)
+class VideoProxy:
+    """Cópia só-intra do vídeo (MJPEG) com os mesmos frames, reduzida por `scale`."""
+
+    path: Path
+    scale: float
+    source_width: int
+    source_height: int
+
+    def map_crop(self, crop: Optional[CropRect]) -> CropRect:
+        """Recorte do vídeo original convertido para as coordenadas do proxy."""
+        crop = crop or _fixed_crop_rect(self.source_width, self.source_height)
+        return crop.scaled(self.scale)
+
+
+_PROXY_MEMO: Dict[Tuple[str, int], VideoProxy] = {}
+
+
+def _evict_video_proxies(keep: Path) -> None:
+    """
+    Mantém CAPTURA_CACHE_DIR/proxy dentro de VIDEO_PROXY_MAX_MB (0 = sem limite),
+    removendo os proxies usados há mais tempo, como no cache de frames.
+    """
+    max_bytes = _env_int("VIDEO_PROXY_MAX_MB", VIDEO_PROXY_MAX_MB) * 1024 * 1024
+    if max_bytes <= 0 or not VIDEO_PROXY_DIR.exists():
+        return
+    entries: List[Tuple[float, int, Path]] = []
+    for entry in VIDEO_PROXY_DIR.glob("*.avi"):
+        if entry.name.endswith(".tmp.avi") or entry == keep:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    try:
+        total = sum(size for _, size, _ in entries) + keep.stat().st_size
+    except OSError:
+        return
+    # Libera um pouco abaixo do limite para não remover a cada novo proxy
+    target = int(max_bytes * 0.9)
+    for _, size, entry in sorted(entries):
+        if total <= target:
+            break
+        try:
+            entry.unlink()
+        except OSError:
+            continue
+        total -= size
+        print(f"[DEBUG] Proxy removido do cache (limite de {max_bytes // (1024 * 1024)} MB): {entry.name}")
+
+
+def _build_video_proxy(video_path: Path, out_path: Path, size: Tuple[int, int], fps: float) -> int:
+    """Transcodifica todos os frames para MJPEG em `size`; retorna quantos foram gravados."""
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return 0
+    writer = cv2.VideoWriter(str(out_path), cv2.CAP_OPENCV_MJPEG, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    if not writer.isOpened():
+        cap.release()
+        return 0
+    writer.set(cv2.VIDEOWRITER_PROP_QUALITY, VIDEO_PROXY_JPEG_QUALITY)
+    written = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            written += 1
+    finally:
+        cap.release()
+        writer.release()
+    return written
+
+
+def load_video_proxy(
+    video_path: Path,
+    video_hash: Optional[str] = None,
+    crop: Optional[CropRect] = None,
+    max_width: int = PRINT_MAX_WIDTH,
+) -> Optional[VideoProxy]:
+    """
+    Proxy do vídeo para extrações repetidas (revisões): transcodificado uma vez para
+    MJPEG na escala em que a área recortada já sai com max_width pixels e guardado
+    em CAPTURA_CACHE_DIR/proxy/<hash>.w<largura>.avi, com remoção LRU acima de
+    VIDEO_PROXY_MAX_MB. Os índices de frame são os mesmos do original. Retorna None
+    se o proxy não puder ser criado.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return None
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    if width <= 0 or height <= 0:
+        return None
+
+    source_crop = crop or _fixed_crop_rect(width, height)
+    scale = min(1.0, max_width / max(source_crop.right - source_crop.left, 1))
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    video_hash = video_hash or video_content_hash(video_path)
+    memo_key = (video_hash, size[0])
+    cached = _PROXY_MEMO.get(memo_key)
+    if cached is not None:
+        return cached
+
+    proxy_path = VIDEO_PROXY_DIR / f"{video_hash}.w{size[0]}.avi"
+    if not proxy_path.exists():
+        started = time.perf_counter()
+        tmp_path = proxy_path.with_name(f"{proxy_path.stem}.{os.getpid()}.tmp.avi")
+        try:
+            VIDEO_PROXY_DIR.mkdir(parents=True, exist_ok=True)
+            written = _build_video_proxy(video_path, tmp_path, size, fps)
+            check = cv2.VideoCapture(str(tmp_path))
+            proxy_frames = int(check.get(cv2.CAP_PROP_FRAME_COUNT)) if check.isOpened() else 0
+            check.release()
+            if written == 0 or proxy_frames != written:
+                print(f"[AVISO] Falha ao criar o proxy do vídeo {video_path.name}; usando o original.")
+                tmp_path.unlink(missing_ok=True)
+                return None
+            os.replace(tmp_path, proxy_path)
+        except (OSError, cv2.error) as error:
+            print(f"[AVISO] Falha ao criar o proxy do vídeo ({proxy_path}): {error}. Usando o original.")
+            tmp_path.unlink(missing_ok=True)
+            return None
+        print(
+            f"[OK] Proxy MJPEG criado: {written} frame(s) em {size[0]}x{size[1]}, "
+            f"{proxy_path.stat().st_size / (1024 * 1024):.1f} MB ({(time.perf_counter() - started) * 1000:.0f} ms)"
+        )
+        _evict_video_proxies(proxy_path)
+    else:
+        try:
+            os.utime(proxy_path, None)  # marca como usado recentemente (LRU)
+        except OSError:
+            pass
+
+    proxy = VideoProxy(path=proxy_path, scale=scale, source_width=width, source_height=height)
+    _PROXY_MEMO[memo_key] = proxy
+    return proxy
+
+
+_FINGERPRINT_DTYPE = np.dtype([
+    ('thumb', 'u1', (FINGERPRINT_THUMB_SIZE[1], FINGERPRINT_THUMB_SIZE[0])),
+    ('dhash', '<u8', (FINGERPRINT_HASH_SIZE * FINGERPRINT_HASH_SIZE // 64,)),
+    ('hist', 'u1', (FINGERPRINT_HIST_BINS,)),
+])
+
+
+def _frame_fingerprint(frame, crop: Optional[CropRect] = None) -> Tuple[Any, Any, Any]:
+    """Miniatura da área recortada, dHash e histograma de luminância (normalizado para 0..255)."""
+    gray = cv2.cvtColor(_crop_print_frame(frame, crop), cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(gray, FINGERPRINT_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    small = cv2.resize(thumb, (FINGERPRINT_HASH_SIZE + 1, FINGERPRINT_HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    dhash = np.packbits(bits.reshape(-1)).view('<u8')
+    counts = np.bincount((thumb // (256 // FINGERPRINT_HIST_BINS)).reshape(-1), minlength=FINGERPRINT_HIST_BINS)
+    hist = np.round(counts * 255.0 / max(int(counts.sum()), 1)).astype(np.uint8)
+    return thumb, dhash, hist
+
+
+def _hamming_distance(left, right):
+    """Distância de Hamming entre hashes (vetorizada sobre a primeira dimensão)."""
+    xor = np.bitwise_xor(left, right).view(np.uint8)
+    return np.unpackbits(xor.reshape(xor.shape[:-1] + (-1,)), axis=-1).sum(axis=-1)
+
+
+def _changed_pixel_ratio(left, right):
+    """Fração de pixels alterados entre miniaturas (vetorizada sobre a primeira dimensão)."""
+    delta = np.abs(left.astype(np.int16) - right.astype(np.int16)) > FINGERPRINT_PIXEL_DELTA
+    return delta.reshape(delta.shape[:-2] + (-1,)).mean(axis=-1)
+
+
+class VideoFingerprints:
+    """
+    Impressões digitais perceptuais do vídeo, uma por amostra (FINGERPRINT_INTERVAL_SECONDS),
+    lidas de um .npy mapeado em memória. Responde em microssegundos perguntas como
+    "frame estável mais próximo de t" ou "o frame em t é igual ao de t + 5",
+    sem decodificar o vídeo novamente.
+
+    A miniatura detecta mudanças pequenas (texto digitado, um item de menu); dHash e
+    histograma detectam trocas de tela inteiras para a linha do tempo de cenas.
+    """
+
+    def __init__(self, records, interval_seconds: float) -> None:
+        self.records = records
+        self.interval_seconds = interval_seconds
+        self._neighbor_change = None
+        self._scene_changes = None
+
+    def __len__(self) -> int:
+        return int(self.records.shape[0])
+
+    def sample_for_seconds(self, seconds: float) -> int:
+        sample = int(round(max(seconds, 0.0) / self.interval_seconds))
+        return min(sample, len(self) - 1)
+
+    @property
+    def neighbor_change(self):
+        """Fração de pixels alterados entre cada amostra e a anterior (a primeira é 0)."""
+        if self._neighbor_change is None:
+            change = np.zeros(len(self), dtype=np.float32)
+            if len(self) > 1:
+                thumbs = self.records['thumb']
+                change[1:] = _changed_pixel_ratio(thumbs[1:], thumbs[:-1])
+            self._neighbor_change = change
+        return self._neighbor_change
+
+    @property
+    def scene_changes(self):
+        """Índices das amostras que iniciam uma nova cena."""
+        if self._scene_changes is None:
+            changed = self.neighbor_change > SCENE_CHANGE_PIXEL_RATIO
+            if len(self) > 1:
+                hashes = self.records['dhash']
+                changed[1:] |= _hamming_distance(hashes[1:], hashes[:-1]) > SCENE_CHANGE_HASH_DISTANCE
+                hist = self.records['hist'].astype(np.float32) / 255.0
+                changed[1:] |= np.abs(np.diff(hist, axis=0)).sum(axis=1) / 2.0 > SCENE_CHANGE_HIST_DISTANCE
+            changed[0] = False
+            self._scene_changes = np.flatnonzero(changed)
+        return self._scene_changes
+
+    def scene_timeline(self) -> List[Tuple[float, float]]:
+        """Lista de cenas como (início, fim) em segundos."""
+        bounds = [0] + [int(sample) for sample in self.scene_changes] + [len(self)]
+        return [
+            (start * self.interval_seconds, end * self.interval_seconds)
+            for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start
+        ]
+
+    def change_ratio(self, seconds_a: float, seconds_b: float) -> float:
+        thumbs = self.records['thumb']
+        return float(_changed_pixel_ratio(
+            thumbs[self.sample_for_seconds(seconds_a)],
+            thumbs[self.sample_for_seconds(seconds_b)],
+        ))
+
+    def is_same(self, seconds_a: float, seconds_b: float, max_ratio: float = FINGERPRINT_SAME_RATIO) -> bool:
+        return self.change_ratio(seconds_a, seconds_b) <= max_ratio
+
+    def is_stable(self, seconds: float, radius_seconds: float = 0.0) -> bool:
+        """True se o conteúdo não muda entre t - radius e t + radius (vizinhas inclusive)."""
+        radius = max(int(np.ceil(radius_seconds / self.interval_seconds)), 1)
+        sample = self.sample_for_seconds(seconds)
+        start = max(sample - radius + 1, 1)
+        end = min(sample + radius, len(self) - 1)
+        if end < start:
+            return True
+        return bool((self.neighbor_change[start:end + 1] <= FINGERPRINT_SAME_RATIO).all())
+
+    def nearest_stable(self, seconds: float) -> float:
+        """Timestamp (segundos) da amostra estável mais próxima de t."""
+        change = self.neighbor_change
+        stable = change <= FINGERPRINT_SAME_RATIO
+        stable[:-1] &= change[1:] <= FINGERPRINT_SAME_RATIO
+        candidates = np.flatnonzero(stable)
+        if candidates.size == 0:
+            return seconds
+        sample = self.sample_for_seconds(seconds)
+        position = int(np.searchsorted(candidates, sample))
+        nearby = candidates[max(position - 1, 0):position + 1]
+        best = int(nearby[np.argmin(np.abs(nearby - sample))])
+        return best * self.interval_seconds
+
+
+_FINGERPRINT_MEMO: Dict[str, VideoFingerprints] = {}
+
+
+def _fingerprint_signature(crop: Optional[CropRect] = None) -> str:
+    crop_signature = crop.signature() if crop is not None else (
+        f"{CROP_LEFT_X},{CROP_TOP_Y},{CROP_RIGHT_X},{CROP_BOTTOM_Y}"
+    )
+    payload = (
+        f"v1;crop={crop_signature};interval={FINGERPRINT_INTERVAL_SECONDS:g};"
+        f"thumb={FINGERPRINT_THUMB_SIZE[0]}x{FINGERPRINT_THUMB_SIZE[1]};hash={FINGERPRINT_HASH_SIZE}"
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def _scan_video_fingerprints(video_path: Path, interval_seconds: float, crop: Optional[CropRect] = None):
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return None
+    records: List[Tuple[Any, Any, Any]] = []
+    next_sample = 0.0
+    try:
+        while cap.grab():
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if position + 1e-6 < next_sample:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            fingerprint = _frame_fingerprint(frame, crop)
+            # Mantém amostra i <-> i * intervalo mesmo com lacunas (VFR)
+            while next_sample <= position + 1e-6:
+                records.append(fingerprint)
+                next_sample += interval_seconds
+    finally:
+        cap.release()
+    if not records:
+        return None
+    array = np.zeros(len(records), dtype=_FINGERPRINT_DTYPE)
+    for sample, (thumb, dhash, hist) in enumerate(records):
+        array[sample]['thumb'] = thumb
+        array[sample]['dhash'] = dhash
+        array[sample]['hist'] = hist
+    return array
+
+
+def load_video_fingerprints(
+    video_path: Path,
+    video_hash: Optional[str] = None,
+    crop: Optional[CropRect] = None,
+) -> Optional[VideoFingerprints]:
+    """
+    Carrega (ou gera na primeira vez, decodificando o vídeo uma única vez) as impressões
+    digitais por amostra, salvas em FINGERPRINT_DIR e endereçadas pelo hash do vídeo.
+    """
+    video_hash = video_hash or video_content_hash(video_path)
+    key = f"{video_hash}-{_fingerprint_signature(crop)}"
+    cached = _FINGERPRINT_MEMO.get(key)
+    if cached is not None:
+        return cached
+
+    path = FINGERPRINT_DIR / f"{key}.npy"
+    records = None
+    if path.exists():
+        try:
+            records = np.load(path, mmap_mode='r')
+            if records.dtype != _FINGERPRINT_DTYPE:
+                raise ValueError(f"dtype inesperado {records.dtype}")
+        except Exception as error:  # noqa: BLE001
+            print(f"[AVISO] Impressões digitais inválidas ({path.name}): {error}. Recriando.")
+            records = None
+
+    if records is None:
+        started = time.perf_counter()
+        scanned = _scan_video_fingerprints(video_path, FINGERPRINT_INTERVAL_SECONDS, crop)
+        if scanned is None:
+            print(f"[AVISO] Não foi possível analisar o vídeo {video_path.name}.")
+            return None
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            FINGERPRINT_DIR.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open('wb') as handle:
+                np.save(handle, scanned)
+            os.replace(tmp_path, path)
+            records = np.load(path, mmap_mode='r')
+        except OSError as error:
+            print(f"[AVISO] Falha ao salvar impressões digitais ({path}): {error}")
+            records = scanned
+        fingerprints = VideoFingerprints(records, FINGERPRINT_INTERVAL_SECONDS)
+        print(
+            f"[OK] Análise do vídeo: {len(fingerprints)} amostra(s), "
+            f"{int(fingerprints.scene_changes.size)} mudança(s) de cena "
+            f"({(time.perf_counter() - started) * 1000:.0f} ms)"
+        )
+    else:
+        fingerprints = VideoFingerprints(records, FINGERPRINT_INTERVAL_SECONDS)
+
+    _FINGERPRINT_MEMO[key] = fingerprints
+    return fingerprints
+
+
+@dataclass
+class FrameSelection:
+    """Resultado do modo "melhor frame" para um print."""
+
+    frame_index: int
+    candidates: int
+    offset: int  # frame escolhido - frame do timestamp
+    score_ms: float
+
+
+def _score_frame_candidates(
+    frames: List[Any],
+    indices: List[int],
+    target: int,
+    crop: Optional[CropRect] = None,
+) -> int:
+    """
+    Pontua os candidatos e devolve a posição do melhor na lista.
+
+    Nitidez: variância do Laplaciano (quanto maior, menos borrado). Estabilidade:
+    menor diferença média para o candidato vizinho (frames no meio de uma transição
+    diferem dos dois lados). Ambos são calculados sobre a área recortada, reduzida
+    para BEST_FRAME_SCORE_WIDTH, em uma única pilha NumPy.
+    """
+    if len(frames) == 1:
+        return 0
+    grays = []
+    for frame in frames:
+        region = _crop_print_frame(frame, crop)
+        h, w = region.shape[:2]
+        if w > BEST_FRAME_SCORE_WIDTH:
+            scale = BEST_FRAME_SCORE_WIDTH / w
+            region = cv2.resize(region, (BEST_FRAME_SCORE_WIDTH, max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+        grays.append(cv2.cvtColor(region, cv2.COLOR_BGR2GRAY))
+    stack = np.stack(grays).astype(np.float32)
+
+    laplacian = (
+        stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+        - 4.0 * stack[:, 1:-1, 1:-1]
+    )
+    sharpness = laplacian.reshape(len(frames), -1).var(axis=1)
+
+    diffs = np.abs(np.diff(stack, axis=0)).reshape(len(frames) - 1, -1).mean(axis=1)
+    motion = np.empty(len(frames), dtype=np.float32)
+    motion[0] = diffs[0]
+    motion[-1] = diffs[-1]
+    if len(frames) > 2:
+        motion[1:-1] = np.minimum(diffs[:-1], diffs[1:])
+
+    offsets = np.abs(np.asarray(indices, dtype=np.float32) - target)
+    score = (
+        sharpness / max(float(sharpness.max()), 1e-6)
+        - motion / max(float(motion.max()), 1e-6)
+        # Desempate: em cenas estáticas, fica com o frame mais próximo do timestamp
+        - 0.05 * offsets / max(float(offsets.max()), 1.0)
+    )
+    return int(np.argmax(score))
+
+
+def _window_bounds(target: int, half_window: int, frame_count: int) -> Tuple[int, int]:
+    start = max(target - half_window, 0)
+    end = target + half_window
+    if frame_count > 0:
+        end = min(end, frame_count - 1)
+    return start, max(end, start)
+
+
+def _select_best_frame(
+    cap,
+    start: int,
+    end: int,
+    target: int,
+    samples: int,
+    crop: Optional[CropRect] = None,
+) -> Tuple[Optional[Any], Optional[FrameSelection], Optional[int]]:
+    """
+    Lê a janela start..end (cap já posicionado em start), decodificando apenas os
+    candidatos amostrados, e devolve (frame escolhido, seleção, próxima posição).
+    A próxima posição é None se a leitura falhou no meio da janela.
+    """
+    positions = sorted({int(round(value)) for value in np.linspace(start, end, max(samples, 1))} | {target})
+    frames: List[Any] = []
+    indices: List[int] = []
+    current: Optional[int] = start
+    for position in positions:
+        while current is not None and current < position:
+            current = current + 1 if cap.grab() else None
+        if current is None:
+            break
+        ok, frame = cap.read()
+        if not ok or frame is None:
+            current = None
+            break
+        current += 1
+        frames.append(frame)
+        indices.append(position)
+
+    if not frames:
+        return None, None, current
+    started = time.perf_counter()
+    best = _score_frame_candidates(frames, indices, target, crop)
+    selection = FrameSelection(
+        frame_index=indices[best],
+        candidates=len(frames),
+        offset=indices[best] - target,
+        score_ms=(time.perf_counter() - started) * 1000,
+    )
+    return frames[best], selection, current
+
+
+def _frame_selection_signature(window_seconds: float, samples: int) -> str:
+    """Sufixo da chave do cache no modo "melhor frame" (vazio no modo padrão)."""
+    if window_seconds <= 0:
+        return ''
+    return f";best={window_seconds:g},{samples}"
+
+
+def _estimate_png_candidate(img) -> Tuple[bool, int, float]:
+    """
+    Estimativa barata (NumPy, 1 a cada 4 pixels) se o print parece uma tela de
+    cores chapadas e texto: poucas cores distintas e bordas nítidas frequentes.
+    """
+    sample = img[::4, ::4]
+    coarse = (sample >> 4).astype(np.uint16)
+    packed = (coarse[..., 0] << 8) | (coarse[..., 1] << 4) | coarse[..., 2]
+    colors = int(np.unique(packed).size)
+    green = sample[..., 1].astype(np.int16)
+    edge_density = float((np.abs(np.diff(green, axis=1)) > 48).mean()) if green.shape[1] > 1 else 0.0
+    candidate = colors <= PNG_CANDIDATE_MAX_COLORS and edge_density >= PNG_CANDIDATE_MIN_EDGE_DENSITY
+    return candidate, colors, edge_density
+
+
+def _encode_png8(img) -> Optional[Tuple[bytes, float]]:
+    """PNG com paleta de 256 cores (Pillow) e o erro médio da quantização."""
+    if PILImage is None:
+        return None
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    quantized = PILImage.fromarray(rgb).quantize(colors=256, method=PILImage.Quantize.FASTOCTREE)
+    error = float(np.abs(np.asarray(quantized.convert('RGB'), dtype=np.int16) - rgb).mean())
+    buffer = io.BytesIO()
+    quantized.save(buffer, format='PNG', compress_level=9)
+    return buffer.getvalue(), error
+
+
+def _write_print_image(img, out_path: Path, codec: str = 'jpeg') -> Optional[Path]:
+    """
+    Grava o print e devolve o caminho final. Com codec 'auto', telas candidatas
+    são codificadas também como PNG-8 e fica o menor arquivo entre PNG-8 e JPEG,
+    desde que a paleta não degrade a imagem (PNG_MAX_QUANT_ERROR).
+    """
+    if codec != 'auto':
+        return out_path if _write_image_bgr(img, out_path) else None
+
+    success, jpeg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+    if not success:
+        return None
+    jpeg_bytes = jpeg.tobytes()
+    data, target = jpeg_bytes, out_path.with_suffix('.jpg')
+
+    candidate, colors, edge_density = _estimate_png_candidate(img)
+    decision = f"JPEG ({colors} cores, bordas {edge_density:.1%})"
+    if candidate:
+        encoded = _encode_png8(img)
+        if encoded is not None:
+            png_bytes, error = encoded
+            if error > PNG_MAX_QUANT_ERROR:
+                decision = f"JPEG (paleta degradaria a imagem, erro {error:.1f})"
+            elif len(png_bytes) < len(jpeg_bytes):
+                data, target = png_bytes, out_path.with_suffix('.png')
+                saving = 1 - len(png_bytes) / len(jpeg_bytes)
+                decision = f"PNG-8 ({colors} cores, -{saving:.0%} vs JPEG {len(jpeg_bytes) / 1024:.0f} KB)"
+            else:
+                decision = f"JPEG (PNG-8 maior: {len(png_bytes) / 1024:.0f} KB)"
+    print(f"[DEBUG] Codec de {target.name}: {decision}, {len(data) / 1024:.0f} KB")
+
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+    except Exception as exc:
+        print(f"[ERRO] Falha ao salvar imagem: {target} - {exc}")
+        return None
+    height, width = img.shape[:2]
+    register_image_dimensions(target, width, height)
+    return target
+
+
+def _write_print_frame(
+    frame,
+    seconds: float,
+    out_path: Path,
+    cache: Optional[FrameCache] = None,
+    cache_key: Optional[str] = None,
+    render: Optional[PrintRenderSpec] = None,
+    focus: Optional[Tuple[int, int]] = None,
+) -> Optional[Path]:
+    """Grava o print (ou um placeholder) e devolve o caminho final; None se nada foi gravado."""
+    codec = render.codec if render is not None else 'jpeg'
+    written = _write_print_image(_prepare_print_frame(frame, render, focus), out_path, codec)
+    if written is None:
+        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
+        return out_path if _write_image_bgr(placeholder, out_path) else None
+    if cache is not None and cache_key:
+        cache.store(cache_key, written)
+    return written
+
+
+def extract_frame(
+    video_path: Path,
+    seconds: float,
+    out_path: Path,
+    coords: Optional[Tuple[int, int]] = None,
+    best_frame_window: float = 0.0,
+    best_frame_samples: int = BEST_FRAME_SAMPLES,
+    render: Optional[PrintRenderSpec] = None,
+) -> bool:
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
+        return _write_image_bgr(placeholder, out_path)
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    seek_index = load_video_seek_index(video_path)
+    frame_index = _resolve_frame_index(seconds, fps, total_frames, seek_index, f"{seconds:.1f}s")
+    if render is None:
+        render = PrintRenderSpec(crop=resolve_print_crop(video_path, seek_index=seek_index))
+
+    cache = get_frame_cache()
+    cache_key = None
+    if cache is not None:
+        signature = _print_render_signature(out_path, render, coords)
+        signature += _frame_selection_signature(best_frame_window, best_frame_samples)
+        cache_key = FrameCache.make_key(video_content_hash(video_path), frame_index, signature)
+        if cache.fetch(cache_key, out_path) is not None:
+            cap.release()
+            return True
+
+    start, end = frame_index, frame_index
+    if best_frame_window > 0:
+        frame_count = seek_index.frame_count if seek_index is not None else int(total_frames)
+        start, end = _window_bounds(frame_index, int(best_frame_window * fps / 2), frame_count)
+    position = seek_index.nominal_position(start) if seek_index is not None else start
+    cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+    if end > start:
+        frame, _, _ = _select_best_frame(cap, start, end, frame_index, best_frame_samples, render.crop)
+        ok = frame is not None
+    else:
+        ok, frame = cap.read()
+    cap.release()
+    if not ok or frame is None:
+        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
+        return _write_image_bgr(placeholder, out_path)
+
+    return _write_print_frame(frame, seconds, out_path, cache, cache_key, render, coords) is not None
+
+
+@dataclass
+class FrameExtractionOptions:
+    workers: int = 1
+    encode_threads: int = 1
+    use_cache: bool = True
+    use_seek_index: bool = True
+    best_frame_window: float = 0.0  # segundos; 0 usa exatamente o frame do timestamp
+    best_frame_samples: int = BEST_FRAME_SAMPLES
+    use_fingerprints: bool = False
+    crop_mode: str = CROP_MODE  # 'auto' (detecção por vídeo) ou 'fixed' (constantes CROP_*)
+    dedup_threshold: float = PRINT_DEDUP_THRESHOLD
+    print_dpi: int = PRINT_DPI
+    print_codec: str = PRINT_CODEC
+    use_proxy: bool = False  # lê os frames do proxy MJPEG em vez do vídeo original
+    roi_scale: float = PRINT_ROI_SCALE  # > 0: print recortado em torno das coordenadas {x=..,y=..}
+    roi_highlight: bool = PRINT_ROI_HIGHLIGHT
+
+
+def build_frame_extraction_options(
+    workers: Optional[int] = None,
+    use_cache: bool = True,
+    use_seek_index: bool = True,
+    best_frame_window: Optional[float] = None,
+    best_frame_samples: Optional[int] = None,
+    use_fingerprints: Optional[bool] = None,
+    crop_mode: Optional[str] = None,
+    dedup_threshold: Optional[float] = None,
+    print_dpi: Optional[int] = None,
+    print_codec: Optional[str] = None,
+    use_proxy: Optional[bool] = None,
+    roi_scale: Optional[float] = None,
+    roi_highlight: Optional[bool] = None,
+) -> FrameExtractionOptions:
+    """Monta as opções de extração: argumentos explícitos > variáveis de ambiente > padrões."""
+    if workers is None:
+        workers = _env_int(
+            "FRAME_EXTRACTION_WORKERS", min(FRAME_PARALLEL_DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+        )
+    encode_threads = _env_int("FRAME_ENCODE_THREADS", FRAME_ENCODE_THREADS)
+    if best_frame_window is None:
+        best_frame_window = _env_float("BEST_FRAME_WINDOW_SECONDS", BEST_FRAME_WINDOW_SECONDS)
+    if best_frame_samples is None:
+        best_frame_samples = _env_int("BEST_FRAME_SAMPLES", BEST_FRAME_SAMPLES)
+    if use_fingerprints is None:
+        use_fingerprints = _env_int("VIDEO_FINGERPRINTS", 0) > 0
+    crop_mode = (crop_mode or os.environ.get("CROP_MODE") or CROP_MODE).strip().lower()
+    if crop_mode not in ('auto', 'fixed'):
+        print(f"[AVISO] CROP_MODE inválido: {crop_mode!r}. Usando {CROP_MODE}.")
+        crop_mode = CROP_MODE
+    if dedup_threshold is None:
+        dedup_threshold = _env_float("PRINT_DEDUP_THRESHOLD", PRINT_DEDUP_THRESHOLD)
+    if print_dpi is None:
+        print_dpi = _env_int("PRINT_DPI", PRINT_DPI)
+    print_codec = (print_codec or os.environ.get("PRINT_CODEC") or PRINT_CODEC).strip().lower()
+    if print_codec not in ('auto', 'jpeg'):
+        print(f"[AVISO] PRINT_CODEC inválido: {print_codec!r}. Usando {PRINT_CODEC}.")
+        print_codec = PRINT_CODEC
+    if print_codec == 'auto' and PILImage is None:
+        print("[AVISO] Pillow não disponível: prints serão gravados sempre em JPEG.")
+        print_codec = 'jpeg'
+    if use_proxy is None:
+        use_proxy = _env_int("VIDEO_PROXY", 0) > 0
+    if roi_scale is None:
+        roi_scale = _env_float("PRINT_ROI_SCALE", PRINT_ROI_SCALE)
+    if not 0 <= roi_scale < 1:
+        print(f"[AVISO] PRINT_ROI_SCALE fora de [0, 1): {roi_scale}. Usando o frame inteiro.")
+        roi_scale = 0.0
+    if roi_highlight is None:
+        roi_highlight = _env_int("PRINT_ROI_HIGHLIGHT", int(PRINT_ROI_HIGHLIGHT)) > 0
+    return FrameExtractionOptions(
+        workers=max(workers, 1),
+        encode_threads=max(encode_threads, 1),
+        use_cache=use_cache,
+        use_seek_index=use_seek_index,
+        best_frame_window=max(best_frame_window, 0.0),
+        best_frame_samples=max(best_frame_samples, 2),
+        use_fingerprints=use_fingerprints,
+        crop_mode=crop_mode,
+        dedup_threshold=dedup_threshold,
+        print_dpi=max(print_dpi, 0),
+        print_codec=print_codec,
+        use_proxy=use_proxy,
+        roi_scale=roi_scale,
+        roi_highlight=roi_highlight,
+    )
+
+
+@dataclass
+class FrameExtractionResult:
+    token: str
+    timestamp: str
+    image_path: Path
+    frame_index: int
+    ok: bool
+    method: str  # 'cache', 'grab', 'seek', 'reuse' ou 'placeholder'
+    elapsed_ms: float
+    selection: Optional[FrameSelection] = None
+
+
+def _placeholder_results(occurrences: List[PrintOccurrence]) -> List[FrameExtractionResult]:
+    results: List[FrameExtractionResult] = []
+    for occurrence in occurrences:
+        started = time.perf_counter()
+        seconds = parse_timestamp_to_seconds(occurrence.timestamp)
+        placeholder = _make_placeholder(seconds, occurrence.image_path.stem.replace('_', ' '))
+        _write_image_bgr(placeholder, occurrence.image_path)
+        results.append(FrameExtractionResult(
+            token=occurrence.token,
+            timestamp=occurrence.timestamp,
+            image_path=occurrence.image_path,
+            frame_index=-1,
+            ok=False,
+            method='placeholder',
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+        ))
+    return results
+
+
+def _encode_print_frame(
+    frame,
+    seconds: float,
+    out_path: Path,
+    cache: Optional[FrameCache] = None,
+    cache_key: Optional[str] = None,
+    render: Optional[PrintRenderSpec] = None,
+    focus: Optional[Tuple[int, int]] = None,
+) -> Tuple[bool, float, Path]:
+    """Devolve (sucesso, tempo de gravação em ms, caminho final do arquivo)."""
+    started = time.perf_counter()
+    if frame is None:
+        placeholder = _make_placeholder(seconds, out_path.stem.replace('_', ' '))
+        _write_image_bgr(placeholder, out_path)
+        return False, (time.perf_counter() - started) * 1000, out_path
+    written = _write_print_frame(frame, seconds, out_path, cache, cache_key, render, focus)
+    return written is not None, (time.perf_counter() - started) * 1000, written or out_path
+
+
+def _print_render_spec(crop: Optional[CropRect], options: FrameExtractionOptions) -> PrintRenderSpec:
+    """Renderização do print em coordenadas do vídeo original (também usada na chave do cache)."""
+    return PrintRenderSpec(
+        crop=crop,
+        max_width=print_max_width_for_dpi(options.print_dpi),
+        codec=options.print_codec,
+        roi_scale=options.roi_scale,
+        roi_highlight=options.roi_highlight,
+    )
+
+
+def _print_cache_key(
+    video_hash: str,
+    frame_index: int,
+    occurrence: PrintOccurrence,
+    render: PrintRenderSpec,
+    selection_signature: str,
+) -> str:
+    """
+    Chave do print no cache de frames. Usa sempre o recorte e o clique em pixels do
+    vídeo original, para que extrações pelo proxy e pelo original compartilhem entradas.
+    """
+    focus = occurrence.coords if render.roi_scale > 0 else None
+    signature = _print_render_signature(occurrence.image_path, render, focus) + selection_signature
+    return FrameCache.make_key(video_hash, frame_index, signature)
+
+
+def _has_print_cache_misses(
+    video_path: Path,
+    occurrences: List[PrintOccurrence],
+    options: FrameExtractionOptions,
+    video_hash: Optional[str],
+    seek_index: Optional[VideoSeekIndex],
+    crop: Optional[CropRect],
+) -> bool:
+    """Se algum print terá de ser decodificado (decide se o proxy precisa existir)."""
+    cache = get_frame_cache() if options.use_cache else None
+    if cache is None or not video_hash:
+        return bool(occurrences)
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    cap.release()
+    render = _print_render_spec(crop, options)
+    selection_signature = _frame_selection_signature(options.best_frame_window, options.best_frame_samples)
+    for occurrence in occurrences:
+        frame_index = _resolve_frame_index(
+            parse_timestamp_to_seconds(occurrence.timestamp), fps, total_frames, seek_index, occurrence.timestamp,
+        )
+        key = _print_cache_key(video_hash, frame_index, occurrence, render, selection_signature)
+        if not cache.has(key, occurrence.image_path):
+            return True
+    return False
+
+
+def extract_frames_batch(
+    video_path: Path,
+    occurrences: List[PrintOccurrence],
+    options: Optional[FrameExtractionOptions] = None,
+    video_hash: Optional[str] = None,
+) -> List[FrameExtractionResult]:
+    """
+    Extrai todos os prints em uma única passada pelo vídeo.
+
+    As ocorrências são ordenadas por timestamp e o vídeo é aberto uma única vez:
+    lacunas curtas são percorridas com grab() e apenas saltos longos usam seek real.
+    Com o índice de seek, a escolha compara a lacuna com o número de frames que o
+    seek decodificaria a partir do keyframe anterior. Com encode_threads > 1,
+    recorte, redimensionamento e compressão JPEG rodam em um pool de threads (o cv2
+    libera o GIL nessas etapas). No modo "melhor frame" cada print lê uma janela em
+    torno do timestamp e fica com o candidato mais nítido e estável.
+    Com use_proxy os frames vêm do proxy MJPEG (seek exato e barato em qualquer
+    ponto), com o recorte convertido para a escala do proxy; o proxy só é criado
+    e aberto na primeira falta do cache.
+    Prints presentes no cache de frames são copiados sem decodificar o vídeo. A
+    chave usa as coordenadas do vídeo original, então o proxy reaproveita os prints
+    da geração inicial; prints lidos do proxy não são gravados no cache, para que a
+    exportação final não herde a dupla compressão.
+    Retorna um resultado por ocorrência, na ordem original.
+    """
+    if not occurrences:
+        return []
+    options = options or FrameExtractionOptions()
+    encode_threads = options.encode_threads
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        return _placeholder_results(occurrences)
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    max_grab_gap = max(int(FRAME_BATCH_MAX_GRAB_GAP_SECONDS * fps), 0)
+    half_window = int(options.best_frame_window * fps / 2) if options.best_frame_window > 0 else 0
+    selection_signature = _frame_selection_signature(options.best_frame_window, options.best_frame_samples)
+    cache = get_frame_cache() if options.use_cache else None
+    if video_hash is None and (
+        cache is not None or options.use_seek_index or options.use_fingerprints
+        or options.crop_mode == 'auto' or options.use_proxy
+    ):
+        video_hash = video_content_hash(video_path)
+    seek_index = load_video_seek_index(video_path, video_hash) if options.use_seek_index else None
+    crop = resolve_print_crop(video_path, video_hash, options.crop_mode, seek_index)
+    render = _print_render_spec(crop, options)
+    # Com use_proxy, troca para o proxy na primeira falta do cache
+    proxy: Optional[VideoProxy] = None
+    proxy_pending = options.use_proxy
+    frame_render = render
+    fingerprints = None
+    if options.use_fingerprints and half_window > 0:
+        fingerprints = load_video_fingerprints(video_path, video_hash, crop)
+    frame_count = seek_index.frame_count if seek_index is not None else int(total_frames)
+
+    plan = sorted(
+        (
+            (
+                _resolve_frame_index(
+                    parse_timestamp_to_seconds(occ.timestamp), fps, total_frames, seek_index, occ.timestamp,
+                ),
+                idx,
+            )
+            for idx, occ in enumerate(occurrences)
+        ),
+    )
+
+    executor = ThreadPoolExecutor(max_workers=encode_threads) if encode_threads > 1 else None
+    max_pending = max(encode_threads * 2, 1)
+    pending: List[Tuple[int, int, str, float, Any, Optional[FrameSelection]]] = []
+    results: List[Optional[FrameExtractionResult]] = [None] * len(occurrences)
+
+    def _collect(entry: Tuple[int, int, str, float, Any, Optional[FrameSelection]]) -> None:
+        occ_idx, frame_index, method, decode_ms, outcome, selection = entry
+        ok, encode_ms, image_path = outcome.result() if isinstance(outcome, Future) else outcome
+        occurrence = occurrences[occ_idx]
+        results[occ_idx] = FrameExtractionResult(
+            token=occurrence.token,
+            timestamp=occurrence.timestamp,
+            image_path=image_path,
+            frame_index=selection.frame_index if selection is not None else frame_index,
+            ok=ok,
+            method=method,
+            elapsed_ms=decode_ms + encode_ms,
+            selection=selection,
+        )
+
+    next_position: Optional[int] = 0  # próximo frame que cap.read() devolveria (None = desconhecido)
+    last_index = -1
+    last_frame = None
+    last_selection: Optional[FrameSelection] = None
+    try:
+        for frame_index, occ_idx in plan:
+            occurrence = occurrences[occ_idx]
+            seconds = parse_timestamp_to_seconds(occurrence.timestamp)
+            started = time.perf_counter()
+
+            cache_key = None
+            if cache is not None and video_hash:
+                cache_key = _print_cache_key(video_hash, frame_index, occurrence, render, selection_signature)
+                cached_path = cache.fetch(cache_key, occurrence.image_path)
+                if cached_path is not None:
+                    elapsed = (time.perf_counter() - started) * 1000
+                    _collect((occ_idx, frame_index, 'cache', 0.0, (True, elapsed, cached_path), None))
+                    continue
+
+            if proxy_pending:
+                proxy_pending = False
+                proxy = load_video_proxy(video_path, video_hash, crop, render.max_width)
+                proxy_cap = cv2.VideoCapture(str(proxy.path)) if proxy is not None else None
+                if proxy_cap is not None and proxy_cap.isOpened():
+                    cap.release()
+                    cap = proxy_cap
+                    next_position = 0
+                    frame_render = PrintRenderSpec(
+                        crop=proxy.map_crop(crop),
+                        max_width=render.max_width,
+                        codec=render.codec,
+                        roi_scale=render.roi_scale,
+                        roi_highlight=render.roi_highlight,
+                    )
+                    # Todo frame do proxy é keyframe: o seek decodifica um único frame
+                    max_grab_gap = VIDEO_PROXY_MAX_GRAB_GAP
+                else:
+                    if proxy_cap is not None:
+                        proxy_cap.release()
+                    proxy = None
+            if proxy is not None:
+                # Prints do proxy não vão para o cache (ver docstring)
+                cache_key = None
+
+            focus = None
+            if options.roi_scale > 0 and occurrence.coords is not None:
+                # Coordenadas do clique estão em pixels do vídeo original
+                focus = occurrence.coords
+                if proxy is not None:
+                    focus = (int(round(focus[0] * proxy.scale)), int(round(focus[1] * proxy.scale)))
+
+            if frame_index == last_index and last_frame is not None:
+                method = 'reuse'
+                frame = last_frame
+                selection = last_selection
+            else:
+                window = half_window
+                if fingerprints is not None and fingerprints.is_stable(seconds, options.best_frame_window / 2):
+                    # Conteúdo estável em toda a janela: o frame exato já é o melhor
+                    window = 0
+                start, end = _window_bounds(frame_index, window, frame_count)
+                gap = start - next_position if next_position is not None else -1
+                grab_limit = max_grab_gap
+                if proxy is None and seek_index is not None and seek_index.has_keyframes:
+                    # Com GOP longo o seek decodificaria desde o keyframe anterior de qualquer forma
+                    grab_limit = max(grab_limit, seek_index.seek_decode_cost(start))
+                method = 'seek'
+                if 0 <= gap <= grab_limit:
+                    method = 'grab'
+                    for _ in range(gap):
+                        if not cap.grab():
+                            method = 'seek'
+                            break
+                if method == 'seek':
+                    position = start
+                    if proxy is None and seek_index is not None:
+                        position = seek_index.nominal_position(start)
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+                selection = None
+                if end > start:
+                    frame, selection, next_position = _select_best_frame(
+                        cap, start, end, frame_index, options.best_frame_samples, frame_render.crop,
+                    )
+                else:
+                    ok, frame = cap.read()
+                    next_position = frame_index + 1
+                    if not ok:
+                        frame = None
+                if frame is None:
+                    method = 'placeholder'
+                    # Força um seek na próxima ocorrência, a posição atual é incerta
+                    next_position = None
+                last_index = frame_index if frame is not None else -1
+                last_frame = frame
+                last_selection = selection
+
+            decode_ms = (time.perf_counter() - started) * 1000
+            if executor is None:
+                outcome = _encode_print_frame(
+                    frame, seconds, occurrence.image_path, cache, cache_key, frame_render, focus,
+                )
+                _collect((occ_idx, frame_index, method, decode_ms, outcome, selection))
+                continue
+
+            if len(pending) >= max_pending:
+                _collect(pending.pop(0))
+            future = executor.submit(
+                _encode_print_frame, frame, seconds, occurrence.image_path, cache, cache_key, frame_render, focus,
+            )
+            pending.append((occ_idx, frame_index, method, decode_ms, future, selection))
+
+        for entry in pending:
+            _collect(entry)
+    finally:
+        cap.release()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    return [result for result in results if result is not None]
+
+
+def _init_frame_extraction_worker() -> None:
+    # stdout do processo pai carrega o DOCX binário; mensagens dos workers vão para stderr
+    sys.stdout = sys.stderr
+
+
+def _extract_frames_shard(
+    video_path: str,
+    shard: List[Tuple[str, str, str, Optional[Tuple[int, int]]]],
+    options: FrameExtractionOptions,
+    video_hash: Optional[str],
+) -> List[FrameExtractionResult]:
+    occurrences = [
+        PrintOccurrence(token=token, timestamp=timestamp, description='', image_path=Path(image_path), coords=coords)
+        for token, timestamp, image_path, coords in shard
+    ]
+    return extract_frames_batch(Path(video_path), occurrences, options, video_hash=video_hash)
+
+
+def extract_frames_parallel(
+    video_path: Path,
+    occurrences: List[PrintOccurrence],
+    options: FrameExtractionOptions,
+) -> List[FrameExtractionResult]:
+    """
+    Divide os prints (ordenados por timestamp) em trechos contíguos da linha do tempo
+    e extrai cada trecho em um processo próprio, com seu próprio VideoCapture.
+
+    O resultado é idêntico byte a byte ao de extract_frames_batch(); se o pool de
+    processos falhar, a extração cai para o modo serial.
+    """
+    if not occurrences:
+        return []
+
+    ordered = sorted(range(len(occurrences)), key=lambda idx: parse_timestamp_to_seconds(occurrences[idx].timestamp))
+    shard_count = min(options.workers, max(len(ordered) // FRAME_PARALLEL_MIN_SHARD_SIZE, 1))
+    if shard_count <= 1 or len(ordered) < FRAME_PARALLEL_MIN_PRINTS:
+        return extract_frames_batch(video_path, occurrences, options)
+
+    # Hash e índice de seek são calculados uma vez no processo pai; os workers
+    # recebem o hash e carregam o índice já salvo em disco
+    video_hash = None
+    if (
+        options.use_seek_index or options.use_fingerprints or options.crop_mode == 'auto' or options.use_proxy
+        or (options.use_cache and get_frame_cache() is not None)
+    ):
+        video_hash = video_content_hash(video_path)
+    seek_index = load_video_seek_index(video_path, video_hash) if options.use_seek_index else None
+    crop = resolve_print_crop(video_path, video_hash, options.crop_mode, seek_index)
+    if options.use_fingerprints and options.best_frame_window > 0:
+        load_video_fingerprints(video_path, video_hash, crop)
+    if options.use_proxy and _has_print_cache_misses(video_path, occurrences, options, video_hash, seek_index, crop):
+        # Criado uma vez aqui para os processos não transcodificarem o mesmo proxy em paralelo
+        load_video_proxy(video_path, video_hash, crop, print_max_width_for_dpi(options.print_dpi))
+
+    shard_size = -(-len(ordered) // shard_count)
+    shards = [ordered[start:start + shard_size] for start in range(0, len(ordered), shard_size)]
+    results: Dict[str, FrameExtractionResult] = {}
+    try:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=len(shards),
+            mp_context=context,
+            initializer=_init_frame_extraction_worker,
+        ) as pool:
+            futures = [
+                pool.submit(
+                    _extract_frames_shard,
+                    str(video_path),
+                    [
+                        (
+                            occurrences[idx].token,
+                            occurrences[idx].timestamp,
+                            str(occurrences[idx].image_path),
+                            occurrences[idx].coords,
+                        )
+                        for idx in shard
+                    ],
+                    options,
+                    video_hash,
+                )
+                for shard in shards
+            ]
+            for future in futures:
+                for result in future.result():
+                    results[result.token] = result
+    except Exception as error:  # noqa: BLE001
+        print(f"[AVISO] Extração paralela falhou ({error}). Usando extração serial.")
+        return extract_frames_batch(video_path, occurrences, options, video_hash=video_hash)
+
+    print(f"[DEBUG] Extração paralela: {len(shards)} trecho(s) da linha do tempo em {len(shards)} processo(s)")
+    return [results[occ.token] for occ in occurrences if occ.token in results]
+
+
+def extract_print_frames(
+    video_path: Path,
+    occurrences: List[PrintOccurrence],
+    options: Optional[FrameExtractionOptions] = None,
+) -> List[FrameExtractionResult]:
+    options = options or build_frame_extraction_options()
+    if options.print_dpi > 0 and occurrences:
+        print(
+            f"[OK] Prints dimensionados para {options.print_dpi} DPI: até "
+            f"{print_max_width_for_dpi(options.print_dpi)} px em {print_display_width_inches():.2f} pol"
+        )
+    if options.roi_scale > 0:
+        with_coords = 0
+        for occurrence in occurrences:
+            if occurrence.coords is None:
+                continue
+            # O recorte (e o destaque) em torno do clique muda a imagem: coordenadas no nome do arquivo
+            path = occurrence.image_path
+            occurrence.image_path = path.with_name(
+                f"{path.stem}_x{occurrence.coords[0]}_y{occurrence.coords[1]}{path.suffix}"
+            )
+            with_coords += 1
+        if with_coords:
+            print(
+                f"[OK] {with_coords} print(s) com coordenadas recortados em torno do clique "
+                f"({options.roi_scale:.0%} da área útil; clique fora da área mantém o frame inteiro)"
+            )
+    if options.use_proxy and occurrences:
+        print(
+            "[OK] Prints fora do cache extraídos do proxy MJPEG, sem gravá-los no cache "
+            "(use --final-export para ler o vídeo original)"
+        )
+    if options.workers > 1:
+        results = extract_frames_parallel(video_path, occurrences, options)
+    else:
+        results = extract_frames_batch(video_path, occurrences, options)
+    # Com PRINT_CODEC=auto a extensão final (.png/.jpg) só é conhecida após a gravação
+    written = {result.token: result.image_path for result in results}
+    for occurrence in occurrences:
+        occurrence.image_path = written.get(occurrence.token, occurrence.image_path)
+    return results
+
+
+def _print_images_match(left_path: Path, right_path: Path, threshold: float) -> Tuple[bool, float]:
+    """
+    Se dois prints podem compartilhar a imagem; devolve também a fração de pixels
+    alterados. Compara em resolução total: qualquer mudança localizada acima de
+    PRINT_DEDUP_BLOCK_MAX_PIXELS num bloco impede a fusão, mesmo abaixo de threshold.
+    """
+    try:
+        if left_path.read_bytes() == right_path.read_bytes():
+            return True, 0.0
+    except OSError:
+        return False, 1.0
+    left = cv2.imread(str(left_path), cv2.IMREAD_GRAYSCALE)
+    right = cv2.imread(str(right_path), cv2.IMREAD_GRAYSCALE)
+    if left is None or right is None or left.shape != right.shape:
+        return False, 1.0
+    changed = cv2.absdiff(left, right) > FINGERPRINT_PIXEL_DELTA
+    changed_count = int(np.count_nonzero(changed))
+    ratio = changed_count / changed.size
+    if changed_count == 0:
+        return True, 0.0
+    if threshold <= 0 or ratio > threshold:
+        return False, ratio
+    block = PRINT_DEDUP_BLOCK_SIZE
+    height, width = changed.shape
+    padded = np.pad(changed, ((0, -height % block), (0, -width % block)))
+    per_block = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block).sum(axis=(1, 3))
+    return int(per_block.max()) <= PRINT_DEDUP_BLOCK_MAX_PIXELS, ratio
+
+
+def dedupe_print_images(
+    occurrences: List[PrintOccurrence],
+    results: List[FrameExtractionResult],
+    threshold: float = PRINT_DEDUP_THRESHOLD,
+) -> int:
+    """
+    Agrupa prints visualmente idênticos (mesma tela poucos segundos depois) em uma
+    única imagem: a ocorrência repetida passa a apontar para o arquivo do primeiro
+    print do grupo e o python-docx grava uma só parte de imagem (deduplicada por SHA1).
+    Prints com mesmo timestamp e descrição compartilham o arquivo; quando ele é
+    removido, todas as ocorrências que apontam para ele são remapeadas.
+
+    A miniatura perceptual de FINGERPRINT_THUMB_SIZE (da imagem em 1/4 da resolução)
+    filtra os candidatos de forma vetorizada; a decisão final é de
+    _print_images_match(), em resolução total. Retorna a quantidade de bytes de
+    imagem economizados no DOCX.
+    """
+    if threshold < 0:
+        return 0
+    extracted = {result.token for result in results if result.ok}
+    candidates = [occ for occ in occurrences if occ.token in extracted and occ.image_path.exists()]
+    if len(candidates) < 2:
+        return 0
+
+    started = time.perf_counter()
+    representatives: List[PrintOccurrence] = []
+    rep_thumbs: List[Any] = []
+    removed: Dict[Path, Path] = {}  # arquivo removido -> arquivo do representante
+    duplicates = 0
+    bytes_saved = 0
+    for occurrence in candidates:
+        if occurrence.image_path in removed:
+            occurrence.image_path = removed[occurrence.image_path]
+            duplicates += 1
+            continue
+        image = cv2.imread(str(occurrence.image_path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if image is None:
+            continue
+        thumb = cv2.resize(image, FINGERPRINT_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+
+        match = -1
+        ratio = 1.0
+        if rep_thumbs:
+            coarse = _changed_pixel_ratio(np.stack(rep_thumbs), thumb[np.newaxis])
+            for candidate in np.argsort(coarse):
+                if coarse[candidate] > SCENE_CHANGE_PIXEL_RATIO:
+                    break
+                same, ratio = _print_images_match(
+                    representatives[candidate].image_path, occurrence.image_path, threshold,
+                )
+                if same:
+                    match = int(candidate)
+                    break
+
+        if match >= 0:
+            original = representatives[match]
+            if occurrence.image_path == original.image_path:
+                # Mesmo timestamp e descrição: o arquivo já é compartilhado
+                duplicates += 1
+                continue
+            size = occurrence.image_path.stat().st_size
+            # Bytes idênticos já seriam compartilhados pelo python-docx
+            if occurrence.image_path.read_bytes() != original.image_path.read_bytes():
+                bytes_saved += size
+            occurrence.image_path.unlink()
+            removed[occurrence.image_path] = original.image_path
+            occurrence.image_path = original.image_path
+            duplicates += 1
+            print(
+                f"[DEBUG] Print {occurrence.timestamp} reutiliza a imagem de {original.timestamp} "
+                f"(diferença {ratio * 100:.3f}%)"
+            )
+            continue
+
+        representatives.append(occurrence)
+        rep_thumbs.append(thumb)
+
+    # Ocorrências fora dos candidatos também podem apontar para um arquivo removido
+    for occurrence in occurrences:
+        if occurrence.image_path in removed:
+            occurrence.image_path = removed[occurrence.image_path]
+    missing = [occ for occ in occurrences if occ.token in extracted and not occ.image_path.exists()]
+    if missing:
+        print(
+            f"[AVISO] Deduplicação de prints: {len(missing)} print(s) sem arquivo de imagem "
+            f"({', '.join(occ.timestamp for occ in missing)})"
+        )
+
+    if duplicates:
+        print(
+            f"[OK] Deduplicação de prints: {duplicates} print(s) reaproveitado(s), "
+            f"{len(representatives)} imagem(ns) distinta(s), {bytes_saved / 1024:.1f} KB economizados "
+            f"({(time.perf_counter() - started) * 1000:.0f} ms)"
+        )
+    return bytes_saved
+
+
+def _print_frame_extraction_report(
+    results: List[FrameExtractionResult],
+    options: Optional[FrameExtractionOptions] = None,
+) -> None:
+    if not results:
+        return
+    counts: Dict[str, int] = {}
+    total_ms = 0.0
+    for result in results:
+        counts[result.method] = counts.get(result.method, 0) + 1
+        total_ms += result.elapsed_ms
+        selection = ''
+        if result.selection is not None:
+            selection = (
+                f", melhor frame {result.selection.offset:+d} entre {result.selection.candidates} "
+                f"candidato(s), pontuação {result.selection.score_ms:.1f} ms"
+            )
+        print(
+            f"[DEBUG] Print {result.timestamp} -> frame {result.frame_index} "
+            f"({result.method}, {result.elapsed_ms:.1f} ms{selection}): {result.image_path.name}"
+        )
+    summary = ", ".join(f"{method}={count}" for method, count in sorted(counts.items()))
+    print(f"[OK] {len(results)} print(s) extraído(s) em {total_ms / 1000:.2f}s ({summary})")
+
+    cache = get_frame_cache() if options is None or options.use_cache else None
+    if cache is not None:
+        hits = counts.get('cache', 0)
+        misses = len(results) - hits - counts.get('placeholder', 0)
+        print(
+            f"[OK] Cache de frames: {hits} acerto(s), {misses} falta(s) "
+            f"({cache.size_bytes() / (1024 * 1024):.1f} MB em {cache.root})"
+        )
+
+
+_COORD_EXTRACT_PATTERN = re.compile(r"\{([^{}]+)\}\s*$")
+_COORD_PAIR_PATTERN = re.compile(r"(x|y)\s*=\s*(-?\d+)", re.IGNORECASE)
+
+
+def _print_occurrence_from_match(match: re.Match, index: int) -> Tuple[PrintOccurrence, str]:
+    """Cria a ocorrência de um [PRINT DO VÍDEO ...] e devolve o texto que o substitui."""
+    ts_str = (match.group('ts') or '').strip()
+    raw_desc = (match.group('desc') or '').strip()
+    prefix = match.group('prefix') or ''
+
+    coords: Optional[Tuple[int, int]] = None
+    coords_text = match.group('coords')
+    if coords_text:
+        pairs = {k.lower(): int(v) for k, v in _COORD_PAIR_PATTERN.findall(coords_text)}
+        if 'x' in pairs and 'y' in pairs:
+            coords = (pairs['x'], pairs['y'])
+    else:
+        coord_match = _COORD_EXTRACT_PATTERN.search(raw_desc)
+        if coord_match:
+            coords_text = coord_match.group(1)
+            raw_desc = raw_desc[:coord_match.start()].strip()
+            pairs = {k.lower(): int(v) for k, v in _COORD_PAIR_PATTERN.findall(coords_text)}
+            if 'x' in pairs and 'y' in pairs:
+                coords = (pairs['x'], pairs['y'])
+
+    desc = raw_desc
+    ts_for_file = ts_str.replace(":", "-")
+    safe_desc = re.sub(r"[^a-zA-Z0-9_-]+", "-", desc)[:80].strip("-") or "print"
+    filename = f"frame_{ts_for_file}_{safe_desc}.jpg".lower()
+    img_path = ASSETS_DIR / filename
+    token = f"PRINT_SLOT_{index}_TOKEN"
+    occurrence = PrintOccurrence(
+        token=token,
+        timestamp=ts_str,
+        description=desc,
+        image_path=img_path,
+        coords=coords,
+    )
+    replacement = token
+    if prefix:
+        replacement = f"{prefix}{token}"
+    return occurrence, replacement
+
+
+def replace_print_placeholders(md_text: str) -> Tuple[str, List[PrintOccurrence]]:
+    occurrences: List[PrintOccurrence] = []
+
+    def repl(match: re.Match) -> str:
+        occurrence, replacement = _print_occurrence_from_match(match, len(occurrences) + 1)
+        occurrences.append(occurrence)
+        return replacement
+
+    new_md = PRINT_PATTERN.sub(repl, md_text)
+    return new_md, occurrences
+
+
+def _create_diagram_placeholder(output_path: Path) -> bool:
+    width, height = 1280, 720
+    try:
+        import numpy as np  # type: ignore
+    except Exception as exc:  # noqa: BLE001
+        print(f"[AVISO] Falha ao importar numpy para placeholder de diagrama: {exc}")
+        return False
+
+    img = np.full((height, width, 3), 255, dtype='uint8')
+    cv2.rectangle(img, (40, 40), (width - 40, height - 40), (200, 200, 200), thickness=4)
+    cv2.putText(img, 'Diagrama não renderizado', (60, height // 2 - 30), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (50, 50, 50), 3, cv2.LINE_AA)
+    cv2.putText(img, 'Verifique a conexão ou gere manualmente', (60, height // 2 + 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (90, 90, 90), 2, cv2.LINE_AA)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    max_export_width = 1200
+    max_export_height = 720
+    current_height, current_width = img.shape[:2]
+    export_scale = min(1.0, max_export_width / max(current_width, 1), max_export_height / max(current_height, 1))
+    if export_scale < 1.0:
+        new_size = (max(1, int(current_width * export_scale)), max(1, int(current_height * export_scale)))
+        img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+
+    return _write_image_bgr(img, output_path)
+
+
+def _build_print_figure(soup: BeautifulSoup, occurrence: PrintOccurrence) -> Tag:
+    figure = soup.new_tag("figure", attrs={"class": "video-print"})
+    img = soup.new_tag("img", src=f"assets/prints/{occurrence.image_path.name}", alt=occurrence.description, loading="lazy")
+    figure.append(img)
+    caption = soup.new_tag("figcaption")
+    caption.string = occurrence.description
+    figure.append(caption)
+    return figure
+
+
+def inject_print_figures(soup: BeautifulSoup, occurrences: List[PrintOccurrence]) -> None:
+    if not occurrences:
+        return
+
+    token_map: Dict[str, PrintOccurrence] = {occ.token: occ for occ in occurrences}
+    for text_node in list(soup.find_all(string=PRINT_TOKEN_PATTERN)):
+        text_value = str(text_node)
+        matches = list(PRINT_TOKEN_PATTERN.finditer(text_value))
+        if not matches:
+            continue
+
+        fragments: List[Any] = []
+        last = 0
+        for match in matches:
+            if match.start() > last:
+                fragments.append(text_value[last:match.start()])
+            token = match.group(0)
+            occurrence = token_map.get(token)
+            if occurrence is None:
+                fragments.append(token)
+            else:
+                figure_tag = _build_print_figure(soup, occurrence)
+                fragments.append(figure_tag)
+            last = match.end()
+        if last < len(text_value):
+            fragments.append(text_value[last:])
+
+        for fragment in fragments:
+            if isinstance(fragment, str):
+                if fragment:
+                    text_node.insert_before(fragment)
+            else:
+                text_node.insert_before(fragment)
+        text_node.extract()
+
+
+# Engine "ast": monta a árvore direto do ElementTree do Python-Markdown, sem serializar
+# para HTML e reinterpretar com BeautifulSoup. Os nós expõem apenas o subconjunto da API
+# de bs4.Tag usado pelo renderizador DOCX (name, children, get, find, find_all, get_text).
+MARKDOWN_EXTENSIONS = ['extra', 'fenced_code', 'tables', 'sane_lists', 'toc', 'nl2br']
+DOCX_ENGINE = "html"
+DOCX_ENGINES = ("html", "ast")
+
+_CHARREF_PATTERN = re.compile(r'&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);', re.I)
+_HTML_VOID_ELEMENTS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr',
+})
+
+
+class MdElement:
+    __slots__ = ('name', 'attrs', 'children', 'parent')
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None, parent: Optional['MdElement'] = None):
+        self.name = name
+        self.attrs: Dict[str, Any] = {}
+        for key, value in (attrs or {}).items():
+            key = key.lower()
+            # Igual ao bs4: "class" vira lista de classes
+            self.attrs[key] = (value or '').split() if key == 'class' else (value if value is not None else '')
+        self.children: List[Any] = []
+        self.parent = parent
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.attrs.get(key, default)
+
+    def append(self, node: Any) -> None:
+        if isinstance(node, str):
+            if not node:
+                return
+            if self.children and isinstance(self.children[-1], str):
+                self.children[-1] += node
+                return
+        else:
+            node.parent = self
+        self.children.append(node)
+
+    def _iter_elements(self):
+        for child in self.children:
+            if isinstance(child, MdElement):
+                yield child
+                yield from child._iter_elements()
+
+    def find(self, name: str) -> Optional['MdElement']:
+        for element in self._iter_elements():
+            if element.name == name:
+                return element
+        return None
+
+    def find_all(self, names, recursive: bool = True) -> List['MdElement']:
+        wanted = {names} if isinstance(names, str) else set(names)
+        if recursive:
+            return [element for element in self._iter_elements() if element.name in wanted]
+        return [child for child in self.children if isinstance(child, MdElement) and child.name in wanted]
+
+    def _strings(self):
+        for child in self.children:
+            if isinstance(child, str):
+                yield child
+            else:
+                yield from child._strings()
+
+    def get_text(self, separator: str = '', strip: bool = False) -> str:
+        if strip:
+            return separator.join(part for part in (text.strip() for text in self._strings()) if part)
+        return separator.join(self._strings())
+
+    @property
+    def text(self) -> str:
+        return self.get_text()
+
+    def decompose(self) -> None:
+        if self.parent is not None:
+            self.parent.children = [child for child in self.parent.children if child is not self]
+            self.parent = None
+
+
+_ELEMENT_TYPES = (Tag, MdElement)
+
+
+def _unescape_markdown_text(text: str) -> str:
+    """Equivale a serializar (escape só de '&' soltos) e reler com html.parser."""
+    if '&' not in text:
+        return text
+    return _CHARREF_PATTERN.sub(lambda match: unescape(match.group(0)), text)
+
+
+class _RawHtmlTreeBuilder(HTMLParser):
+    """Repassa ao _MarkdownTreeBuilder as tags dos trechos HTML guardados no htmlStash."""
+
+    def __init__(self, builder: '_MarkdownTreeBuilder'):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.builder.start(tag, dict(attrs), void=True)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.feed_text(data, escaped=False)
+
+
+class _MarkdownTreeBuilder:
+    """Percorre o ElementTree do Markdown resolvendo htmlStash, entidades e prints inline.
+
+    As tags do HTML bruto chegam uma a uma pelo htmlStash (ex.: <figure> e </figure> em
+    placeholders separados), por isso a árvore é montada como um fluxo de eventos
+    start/end/data, com as mesmas regras do tree builder html.parser do bs4.
+    """
+
+    def __init__(self, md: Markdown, occurrences: List[PrintOccurrence]):
+        self.md = md
+        self.raw_html = md.postprocessors['raw_html'] if 'raw_html' in md.postprocessors else None
+        self.token_map: Dict[str, PrintOccurrence] = {occ.token: occ for occ in occurrences}
+        self.backlink_text: Optional[str] = None
+        for extension in md.registeredExtensions:
+            if isinstance(extension, FootnoteExtension):
+                self.backlink_text = extension.getConfig("BACKLINK_TEXT")
+        self.document = MdElement("[document]")
+        self.stack: List[MdElement] = [self.document]
+        self.pending: List[str] = []
+
+    def start(self, name: str, attrs: Dict[str, Any], void: bool = False) -> None:
+        self.flush()
+        element = MdElement(name, attrs)
+        self.stack[-1].append(element)
+        if not void and name not in _HTML_VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def end(self, name: str) -> None:
+        self.flush()
+        for depth in range(len(self.stack) - 1, 0, -1):
+            if self.stack[depth].name == name:
+                del self.stack[depth:]
+                return
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+        # Como o bs4: texto só de espaços vira um único "\n" ou " " (exceto dentro de <pre>)
+        if not text.strip(' \n\t\f\r') and not any(element.name in ('pre', 'textarea') for element in self.stack):
+            text = '\n' if '\n' in text else ' '
+        parent = self.stack[-1]
+        if self.token_map and "PRINT_SLOT_" in text:
+            last = 0
+            for match in PRINT_TOKEN_PATTERN.finditer(text):
+                occurrence = self.token_map.get(match.group(0))
+                if occurrence is None:
+                    continue
+                parent.append(text[last:match.start()])
+                parent.append(_build_print_figure_element(occurrence))
+                last = match.end()
+            text = text[last:]
+        parent.append(text)
+
+    def _stash_html(self, index: int) -> Optional[str]:
+        if self.raw_html is None or index >= self.md.htmlStash.html_counter:
+            return None
+        return self.raw_html.stash_to_string(self.md.htmlStash.rawHtmlBlocks[index])
+
+    def feed_html(self, html: str) -> None:
+        parser = _RawHtmlTreeBuilder(self)
+        parser.feed(html)
+        parser.close()
+
+    def feed_text(self, text: Optional[str], escaped: bool = True) -> None:
+        if not text:
+            return
+        if md_util.STX in text:
+            last = 0
+            for match in md_util.HTML_PLACEHOLDER_RE.finditer(text):
+                html = self._stash_html(int(match.group(1)))
+                if html is None:
+                    continue
+                self.feed_text(text[last:match.start()], escaped)
+                self.feed_html(html)
+                last = match.end()
+            if last:
+                self.feed_text(text[last:], escaped)
+                return
+            text = text.replace(md_util.AMP_SUBSTITUTE, '&').replace(FN_NBSP_PLACEHOLDER, '\xa0')
+            if self.backlink_text is not None:
+                text = text.replace(FN_BACKLINK_TEXT, self.backlink_text)
+        self.pending.append(_unescape_markdown_text(text) if escaped else text)
+
+    def _block_placeholder_html(self, element) -> Optional[str]:
+        # Mesmo critério do RawHtmlPostprocessor: <p>{placeholder}</p> com HTML de bloco perde o <p>
+        if element.tag != 'p' or element.attrib or len(element) or not element.text:
+            return None
+        match = md_util.HTML_PLACEHOLDER_RE.fullmatch(element.text)
+        if not match:
+            return None
+        html = self._stash_html(int(match.group(1)))
+        if html is None or not self.raw_html.isblocklevel(html):
+            return None
+        return html
+
+    def feed_element(self, element, tail: Optional[str] = None) -> None:
+        if isinstance(element.tag, str):  # comentários/PIs do ElementTree não viram nós
+            html = self._block_placeholder_html(element)
+            if html is not None:
+                self.feed_html(html)
+            else:
+                self.start(element.tag, {key: _unescape_markdown_text(str(value)) for key, value in element.attrib.items()})
+                self.feed_text(element.text)
+                for child in element:
+                    self.feed_element(child)
+                self.end(element.tag)
+        self.feed_text(element.tail if tail is None else tail)
+
+    def build(self, root) -> MdElement:
+        # Markdown.convert() aplica strip() na saída serializada
+        self.feed_text((root.text or '').lstrip())
+        children = list(root)
+        for index, child in enumerate(children):
+            self.feed_element(child, (child.tail or '').rstrip() if index == len(children) - 1 else None)
+        self.flush()
+        return self.document
+
+
+def _build_print_figure_element(occurrence: PrintOccurrence) -> MdElement:
+    """Equivalente de _build_print_figure() para a engine ast."""
+    figure = MdElement("figure", {"class": "video-print"})
+    figure.append(MdElement("img", {
+        "src": f"assets/prints/{occurrence.image_path.name}",
+        "alt": occurrence.description,
+        "loading": "lazy",
+    }))
+    caption = MdElement("figcaption")
+    caption.append(occurrence.description)
+    figure.append(caption)
+    return figure
+
+
+def markdown_to_docx_tree(md_text: str, occurrences: List[PrintOccurrence]) -> MdElement:
+    """Markdown -> árvore de nós para build_docx(), sem o HTML intermediário.
+
+    Executa as mesmas etapas de Markdown.convert() até o ElementTree e converte os nós
+    diretamente; os tokens PRINT_SLOT_N_TOKEN viram figuras no momento em que o texto é
+    lido, dispensando a varredura de inject_print_figures().
+    """
+    if not md_text.strip():
+        return MdElement("[document]")
+
+    md = Markdown(extensions=MARKDOWN_EXTENSIONS)
+    lines = md_text.split("\n")
+    for preprocessor in md.preprocessors:
+        lines = preprocessor.run(lines)
+    root = md.parser.parseDocument(lines).getroot()
+    for treeprocessor in md.treeprocessors:
+        new_root = treeprocessor.run(root)
+        if new_root is not None:
+            root = new_root
+
+    return _MarkdownTreeBuilder(md, occurrences).build(root)
+
+
+def resolve_docx_engine(engine: Optional[str] = None) -> str:
+    engine = (engine or os.environ.get("DOCX_ENGINE") or DOCX_ENGINE).strip().lower()
+    if engine not in DOCX_ENGINES:
+        print(f"[AVISO] DOCX_ENGINE inválido: {engine!r}. Usando {DOCX_ENGINE}.")
+        engine = DOCX_ENGINE
+    return engine
+
+
+def build_docx_tree(md_text: str, occurrences: List[PrintOccurrence], engine: str = DOCX_ENGINE):
+    """Árvore de entrada de build_docx() pela engine escolhida ("html" ou "ast")."""
+    if engine == "ast":
+        return markdown_to_docx_tree(md_text, occurrences)
+    html_body_raw = markdown(md_text, extensions=MARKDOWN_EXTENSIONS)
+    soup = BeautifulSoup(html_body_raw, 'html.parser')
+    inject_print_figures(soup, occurrences)
+    return soup
+
+
+class DiagramCache(FrameCache):
+    """
+    Cache em disco dos diagramas Mermaid renderizados, endereçado pelo código.
+
+    A chave combina o hash do código normalizado (quebras de linha, espaços no fim
+    e linhas em branco não contam), a versão dos renderizadores, o tamanho de saída
+    e o renderizador que gerou o PNG. As duas entradas são procuradas antes de
+    qualquer requisição, a do Kroki primeiro e depois a desenhada localmente.
+    Placeholders não entram no cache.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        super().__init__(root, max_bytes)
+        self.diagram_hits = 0
+        self.diagram_misses = 0
+
+    @staticmethod
+    def normalize_source(code: str) -> str:
+        lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        return '\n'.join(line.rstrip() for line in lines if line.strip())
+
+    @staticmethod
+    def diagram_key(code: str, renderer: str) -> str:
+        source_hash = hashlib.sha256(DiagramCache.normalize_source(code).encode('utf-8')).hexdigest()
+        signature = (
+            f"{renderer}|v={MERMAID_RENDER_VERSION}|"
+            f"size={MERMAID_LOCAL_MAX_WIDTH}x{MERMAID_LOCAL_MAX_HEIGHT}"
+        )
+        return FrameCache.make_key(source_hash, 0, signature)
+
+    def restore(self, key: str, out_path: Path) -> bool:
+        """Copia o PNG em cache para out_path; False se não houver entrada."""
+        entry = self._entry_path(key, '.png')
+        try:
+            shutil.copyfile(entry, out_path)
+            os.utime(entry, None)  # marca como usado recentemente (LRU)
+        except OSError:
+            return False
+        return True
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.diagram_hits += 1
+            else:
+                self.diagram_misses += 1
+
+
+_DIAGRAM_CACHE: Optional[DiagramCache] = None
+
+
+def get_diagram_cache() -> Optional[DiagramCache]:
+    """Cache de diagramas Mermaid; None quando desativado (DIAGRAM_CACHE_MAX_MB=0)."""
+    global _DIAGRAM_CACHE
+    max_mb = _env_int("DIAGRAM_CACHE_MAX_MB", DIAGRAM_CACHE_MAX_MB)
+    if max_mb <= 0:
+        return None
+    if _DIAGRAM_CACHE is None:
+        _DIAGRAM_CACHE = DiagramCache(DIAGRAM_CACHE_DIR, max_mb * 1024 * 1024)
+    return _DIAGRAM_CACHE
+
+
+def _render_mermaid_diagram(code: str, output_path: Path, cache: Optional[DiagramCache] = None) -> bool:
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    kroki_key = DiagramCache.diagram_key(code, 'kroki') if cache is not None else ''
+    local_key = DiagramCache.diagram_key(code, 'local') if cache is not None else ''
+    if cache is not None:
+        # Qualquer versão em cache evita a rede; a do Kroki tem preferência
+        if cache.restore(kroki_key, output_path):
+            cache.record(hit=True)
+            return True
+        if cache.restore(local_key, output_path):
+            cache.record(hit=True)
+            print("[OK] Diagrama Mermaid local reaproveitado do cache.")
+            return True
+    url = "https://kroki.io/mermaid/png"
+    headers = {'Accept': 'image/png', 'Content-Type': 'application/json; charset=utf-8'}
+    try:
+        response = requests.post(url, json={'diagram_source': code}, headers=headers, timeout=20)
+        if response.status_code == 200:
+            output_path.write_bytes(response.content)
+            dimensions = _read_image_header_size(io.BytesIO(response.content))
+            if dimensions:
+                register_image_dimensions(output_path, *dimensions)
+            if cache is not None:
+                cache.store(kroki_key, output_path)
+                cache.record(hit=False)
+            return True
+        preview = response.text[:200] if response.content else ''
+        if preview:
+            print(f"[AVISO] Kroki retornou status {response.status_code}: {preview}")
+        else:
+            print(f"[AVISO] Kroki retornou status {response.status_code} para diagrama Mermaid.")
+    except Exception as error:  # noqa: BLE001
+        print(f"[AVISO] Falha ao renderizar diagrama Mermaid via Kroki: {error}")
+    if _render_mermaid_locally(code, output_path):
+        print("[OK] Diagrama Mermaid renderizado localmente.")
+        if cache is not None:
+            cache.store(local_key, output_path)
+            cache.record(hit=False)
+        return True
+    if cache is not None:
+        cache.record(hit=False)
+    print("[AVISO] Usando placeholder para diagrama Mermaid.")
+    return _create_diagram_placeholder(output_path)
+
+
+def replace_mermaid_blocks(md_text: str) -> Tuple[str, List[Path]]:
+    generated_paths: List[Path] = []
+
+    def repl(match: re.Match) -> str:
+        code = match.group(1)  # Grupo 1 agora contém o código do diagrama
+        if code is None:
+            return ''
+        diagram_code = code.strip()
+        if not diagram_code:
+            return ''
+        diagram_index = len(generated_paths) + 1
+        filename = f"diagram_{diagram_index:02d}.png"
+        output_path = DIAGRAMS_DIR / filename
+        success = _render_mermaid_diagram(diagram_code, output_path, get_diagram_cache())
+        if success:
+            print(f"[OK] Diagrama Mermaid #{diagram_index} salvo em: {output_path}")
+        generated_paths.append(output_path)
+        return _mermaid_figure_html(filename)
+
+    new_md = MERMAID_BLOCK_PATTERN.sub(repl, md_text)
+    return new_md, generated_paths
+
+
+def _mermaid_figure_html(filename: str) -> str:
+    caption = "Diagrama de fluxo do processo"
+    escaped_caption = escape(caption)
+    return (
+        f'<figure class="process-diagram">'
+        f'<img src="assets/diagrams/{filename}" alt="{escaped_caption}" loading="lazy"/>'
+        f'<figcaption>{escaped_caption}</figcaption>'
+        '</figure>'
+    )
+
+
+@dataclass
+class MermaidBlock:
+    index: int
+    code: str
+    output_path: Path
+
+
+@dataclass
+class PreprocessedMarkdown:
+    text: str
+    occurrences: List[PrintOccurrence]
+    mermaid_blocks: List[MermaidBlock]
+    inline_artifacts: List[str]  # src de cada marcador <<...>> convertido em figura
+    empty: bool  # documento sem conteúdo após a limpeza
+    elapsed_ms: float
+
+
+# Início de cada construção tratada pelo pré-processador; o padrão completo só é
+# testado nessas posições (as regex de prefixo opcional custam caro em cada caractere)
+_PREPROCESS_TRIGGER_PATTERN = re.compile(r"```mermaid|\[PRINT DO V[ÍI]DEO|!\[|<<", re.IGNORECASE)
+
+
+def _print_prefix_start(text: str, pos: int, floor: int) -> int:
+    """Início do marcador de lista que precede o print (grupo 'prefix' de PRINT_PATTERN) ou pos."""
+    cursor = pos
+    while cursor > floor and text[cursor - 1].isspace():
+        cursor -= 1
+    if cursor <= floor or text[cursor - 1] not in '-*':
+        return pos
+    cursor -= 1
+    while cursor > floor and text[cursor - 1] in ' \t':
+        cursor -= 1
+    if cursor == 0 or text[cursor - 1] == '\n':
+        return cursor
+    return pos
+
+
+def preprocess_markdown(md_text: str, inline_artifact_markers: bool = False) -> PreprocessedMarkdown:
+    """
+    Prepara o Markdown para a conversão: limpeza de caracteres, indentação de listas
+    aninhadas e, em uma única varredura, prints (PRINT_SLOT_N_TOKEN), blocos mermaid
+    (figura com o caminho do diagrama, renderizado depois por render_mermaid_blocks)
+    e marcadores <<...>>. Equivale à sequência clean_text() ->
+    _normalize_nested_list_markdown() -> _replace_inline_artifact_markers() ->
+    replace_print_placeholders() -> replace_mermaid_blocks(), exceto que prints e
+    marcadores dentro de um bloco mermaid ficam intactos no código do diagrama.
+    """
+    started = time.perf_counter()
+    text = _normalize_nested_list_markdown(clean_text(md_text))
+    occurrences: List[PrintOccurrence] = []
+    mermaid_blocks: List[MermaidBlock] = []
+    inline_artifacts: List[str] = []
+    empty = not text.strip()
+
+    parts: List[str] = []
+    emitted = 0  # texto até aqui já foi copiado para parts
+    pos = 0
+    while not empty:
+        trigger = _PREPROCESS_TRIGGER_PATTERN.search(text, pos)
+        if trigger is None:
+            break
+        start = trigger.start()
+        head = text[start]
+        match = None
+        replacement = ''
+        if head == '`':
+            match = MERMAID_BLOCK_PATTERN.match(text, start)
+            if match is not None:
+                diagram_code = match.group(1).strip()
+                if diagram_code:
+                    index = len(mermaid_blocks) + 1
+                    filename = f"diagram_{index:02d}.png"
+                    mermaid_blocks.append(MermaidBlock(index=index, code=diagram_code, output_path=DIAGRAMS_DIR / filename))
+                    replacement = _mermaid_figure_html(filename)
+        elif head == '[':
+            start = _print_prefix_start(text, start, emitted)
+            match = PRINT_PATTERN.match(text, start)
+            if match is None and start != trigger.start():
+                start = trigger.start()
+                match = PRINT_PATTERN.match(text, start)
+            if match is not None:
+                occurrence, replacement = _print_occurrence_from_match(match, len(occurrences) + 1)
+                occurrences.append(occurrence)
+        elif inline_artifact_markers:
+            pattern = INLINE_ARTIFACT_WITH_TITLE_PATTERN if head == '!' else INLINE_ARTIFACT_PATTERN
+            match = pattern.match(text, start)
+            if match is not None:
+                src = (match.group('src') or '').strip()
+                if src:
+                    title = match.group('title') if head == '!' else None
+                    inline_artifacts.append(src)
+                    replacement = _build_inline_artifact_figure_html(src, title=(title or '').strip() or None)
+                else:
+                    replacement = match.group(0)
+
+        if match is None:
+            pos = trigger.start() + 1
+            continue
+        parts.append(text[emitted:start])
+        parts.append(replacement)
+        emitted = pos = match.end()
+
+    if parts:
+        parts.append(text[emitted:])
+        text = ''.join(parts)
+    return PreprocessedMarkdown(
+        text=text,
+        occurrences=occurrences,
+        mermaid_blocks=mermaid_blocks,
+        inline_artifacts=inline_artifacts,
+        empty=empty,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def render_mermaid_blocks(blocks: List[MermaidBlock], cache: Optional[DiagramCache] = None) -> List[Path]:
+    """Renderiza os diagramas encontrados por preprocess_markdown(), reaproveitando o cache."""
+    generated_paths: List[Path] = []
+    hits_before = cache.diagram_hits if cache is not None else 0
+    misses_before = cache.diagram_misses if cache is not None else 0
+    for block in blocks:
+        if _render_mermaid_diagram(block.code, block.output_path, cache):
+            print(f"[OK] Diagrama Mermaid #{block.index} salvo em: {block.output_path}")
+        generated_paths.append(block.output_path)
+    if cache is not None and blocks:
+        hits = cache.diagram_hits - hits_before
+        misses = cache.diagram_misses - misses_before
+        print(
+            f"[OK] Cache de diagramas: {hits} acerto(s), {misses} falta(s) "
+            f"({hits / max(hits + misses, 1):.0%} de acerto, "
+            f"{cache.size_bytes() / (1024 * 1024):.1f} MB em {cache.root})"
+        )
+    return generated_paths
+
+
+def _parse_node_token(token: str) -> Tuple[str, str, str]:
+    """
+    Parseia um token de nó Mermaid e extrai: node_id, label, shape.
+    
+    Exemplos:
+        - "Start([Início])" -> ('Start', 'Início', 'circle')
+        - "Config[Carregar Configurações]" -> ('Config', 'Carregar Configurações', 'rect')
+        - "Classify[Classificar Transações <br/>(Regex no Histórico)]" -> ('Classify', 'Classificar Transações (Regex no Histórico)', 'rect')
+    """
+    token = token.strip()
+    if not token:
+        return '', '', 'rect'
+
+    # Lista de delimitadores ordenados do mais específico para o menos específico
+    # O formato é: (start_delim, end_delim, shape_name)
+    shapes = [
+        ('([', '])', 'circle'),   # Stadium shape - usado para início/fim
+        ('[[', ']]', 'rect'),     # Subroutine
+        ('{{', '}}', 'circle'),   # Hexagon
+        ('((', '))', 'circle'),   # Circle
+        ('{', '}', 'diamond'),    # Diamond/Decision
+        ('[', ']', 'rect'),       # Rectangle
+        ('(', ')', 'round'),      # Rounded rectangle
+    ]
+    
     node_id = token
     label = token
     shape = 'rect'
@@ -943,9 +3619,7 @@ def _draw_mermaid_structure(structure: dict, output_path: Path) -> bool:
     width = int(margin_x * 2 + box_w + column_spacing * max(0, column_count - 1))
     height = int(margin_y * 2 + box_h + row_spacing * max(0, max_nodes - 1) + header_gap)
 
-    max_width = 1550
-    max_height = 1000
-    scale_factor = min(1.0, max_width / max(width, 1), max_height / max(height, 1))
+    scale_factor = min(1.0, MERMAID_LOCAL_MAX_WIDTH / max(width, 1), MERMAID_LOCAL_MAX_HEIGHT / max(height, 1))
 
     if scale_factor < 1.0:
         box_w = int(box_w * scale_factor)
@@ -1081,19 +3755,478 @@ def _render_mermaid_locally(code: str, output_path: Path) -> bool:
         return False
 
 
-def build_docx(
-    soup: BeautifulSoup,
+class DocxFragmentCache(FrameCache):
+    """
+    Cache em disco do DOCX renderizado por seção '##', endereçado pelo conteúdo.
+
+    Cada seção guarda o WordprocessingML dos seus elementos do corpo (.frag) e as
+    imagens que eles referenciam (.img, pelo SHA-1); o DOCX completo (.docx) fica sob
+    a combinação das chaves das seções com cabeçalho/rodapé. A remoção segue a mesma
+    política LRU e orçamento de disco do FrameCache.
+    """
+
+    def read(self, key: str, suffix: str) -> Optional[bytes]:
+        entry = self._entry_path(key, suffix)
+        try:
+            data = entry.read_bytes()
+            os.utime(entry, None)  # marca como usado recentemente (LRU)
+        except OSError:
+            return None
+        return data
+
+    def copy_to(self, key: str, suffix: str, destination: BinaryIO) -> Optional[int]:
+        """Copia a entrada para destination em blocos; None se não existir."""
+        entry = self._entry_path(key, suffix)
+        try:
+            with entry.open('rb') as source:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+                written = source.tell()
+            os.utime(entry, None)
+        except OSError:
+            return None
+        return written
+
+    def contains(self, key: str, suffix: str) -> bool:
+        return self._entry_path(key, suffix).exists()
+
+    def temp_path(self, key: str, suffix: str) -> Path:
+        """Arquivo temporário ao lado da entrada, para gravar aos poucos e depois commit_temp()."""
+        entry = self._entry_path(key, suffix)
+        return entry.with_name(f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def write(self, key: str, suffix: str, data: bytes) -> None:
+        tmp_path = self.temp_path(key, suffix)
+        try:
+            tmp_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+        except OSError as error:
+            print(f"[AVISO] Falha ao gravar no cache do DOCX ({tmp_path}): {error}")
+            return
+        self.commit_temp(key, suffix, tmp_path)
+
+    def commit_temp(self, key: str, suffix: str, tmp_path: Path) -> None:
+        """Publica um arquivo já gravado em temp_path() como a entrada (key, suffix)."""
+        entry = self._entry_path(key, suffix)
+        try:
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, entry)
+        except OSError as error:
+            print(f"[AVISO] Falha ao gravar no cache do DOCX ({entry}): {error}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return
+        self._record_size(size)
+
+
+_DOCX_CACHE: Optional[DocxFragmentCache] = None
+
+
+def get_docx_cache() -> Optional[DocxFragmentCache]:
+    """Cache de seções do DOCX; None quando desativado (DOCX_CACHE_MAX_MB=0)."""
+    global _DOCX_CACHE
+    max_mb = _env_int("DOCX_CACHE_MAX_MB", DOCX_CACHE_MAX_MB)
+    if max_mb <= 0:
+        return None
+    if _DOCX_CACHE is None:
+        _DOCX_CACHE = DocxFragmentCache(DOCX_CACHE_DIR, max_mb * 1024 * 1024)
+    return _DOCX_CACHE
+
+
+_ASSET_DIGESTS: Dict[Tuple[str, int, int], str] = {}
+
+
+def _asset_digest(path: Optional[Path]) -> str:
+    """SHA-1 do arquivo (prints são recopiados do cache a cada execução: mtime não basta)."""
+    if path is None:
+        return "-"
+    try:
+        stat = path.stat()
+    except OSError:
+        return "-"
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    digest = _ASSET_DIGESTS.get(memo_key)
+    if digest is None:
+        try:
+            digest = hashlib.sha1(path.read_bytes()).hexdigest()
+        except OSError:
+            return "-"
+        _ASSET_DIGESTS[memo_key] = digest
+    return digest
+
+
+def _update_node_hash(hasher, node) -> None:
+    if isinstance(node, str):
+        hasher.update(b'\x00T')
+        hasher.update(node.encode('utf-8', errors='surrogatepass'))
+        return
+    if not isinstance(node, _ELEMENT_TYPES):
+        return
+    name = (node.name or '').lower()
+    hasher.update(f"\x00<{name} {sorted(node.attrs.items())!r}>".encode('utf-8', errors='surrogatepass'))
+    if name == 'img':
+        # A seção muda se a imagem referenciada mudar, mesmo com o Markdown igual
+        hasher.update(_asset_digest(_resolve_asset_path(node.get('src', ''))).encode('ascii'))
+    for child in node.children:
+        _update_node_hash(hasher, child)
+    hasher.update(b'\x00>')
+
+
+def split_docx_sections(nodes) -> List[List[Any]]:
+    """Agrupa os nós de topo em seções: cada <h2> abre uma nova (o que vem antes é a primeira)."""
+    sections: List[List[Any]] = [[]]
+    for node in nodes:
+        if isinstance(node, _ELEMENT_TYPES) and (node.name or '').lower() == 'h2' and sections[-1]:
+            sections.append([])
+        sections[-1].append(node)
+    return [section for section in sections if section]
+
+
+def _docx_section_key(nodes, content_width_inches: float) -> str:
+    hasher = hashlib.sha256(f"{DOCX_RENDER_VERSION}|{content_width_inches:.6f}".encode('utf-8'))
+    for node in nodes:
+        _update_node_hash(hasher, node)
+    return hasher.hexdigest()
+
+
+def _docx_layout_signature(
     metadata: dict,
     logo_path: Optional[Path],
     separator_path: Optional[Path],
     footer_banner_path: Optional[Path],
-    output_path: Optional[Path] = None,
-) -> Optional[bytes]:
+) -> str:
+    """Assinatura do que vai fora das seções: metadados do cabeçalho/rodapé e imagens do layout."""
+    payload = json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str)
+    digests = '|'.join(_asset_digest(path) for path in (logo_path, separator_path, footer_banner_path))
+    return f"{DOCX_RENDER_VERSION}|{PAGE_WIDTH_MM}x{PAGE_HEIGHT_MM}|{payload}|{digests}"
+
+
+def _body_content_elements(doc: Document) -> List[Any]:
+    return [element for element in doc.element.body if element.tag != qn('w:sectPr')]
+
+
+def _store_docx_fragment(
+    doc: Document,
+    elements: List[Any],
+    key: str,
+    cache: DocxFragmentCache,
+    figures: int,
+) -> None:
+    images: Dict[str, str] = {}
+    for element in elements:
+        for blip in element.iter(qn('a:blip')):
+            rel_id = blip.get(qn('r:embed'))
+            if not rel_id or rel_id in images:
+                continue
+            image_part = doc.part.related_parts.get(rel_id)
+            if image_part is None:
+                return
+            images[rel_id] = image_part.sha1
+            if not cache.contains(image_part.sha1, '.img'):
+                cache.write(image_part.sha1, '.img', image_part.blob)
+    payload = {
+        "elements": [etree.tostring(element, encoding='unicode') for element in elements],
+        "images": images,
+        "figures": figures,
+    }
+    cache.write(key, '.frag', json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+
+def _renumber_shape(doc_pr, shape_id: int) -> None:
+    """Troca o id de <wp:docPr>, acompanhando o nome padrão "Picture N" do python-docx."""
+    if doc_pr.get('name') == f"Picture {doc_pr.get('id')}":
+        doc_pr.set('name', f"Picture {shape_id}")
+    doc_pr.set('id', str(shape_id))
+
+
+def _splice_docx_fragment(doc: Document, key: str, cache: DocxFragmentCache) -> bool:
+    """Insere no corpo os elementos de uma seção em cache, religando imagens e ids de desenho."""
+    raw = cache.read(key, '.frag')
+    if raw is None:
+        return False
+    try:
+        payload = json.loads(raw.decode('utf-8'))
+        blobs = {rel_id: cache.read(sha1, '.img') for rel_id, sha1 in payload["images"].items()}
+        if any(blob is None for blob in blobs.values()):
+            return False
+        elements = [parse_xml(xml) for xml in payload["elements"]]
+        figures = int(payload["figures"])
+    except Exception as error:  # noqa: BLE001
+        print(f"[AVISO] Seção do DOCX em cache inválida ({key[:12]}): {error}")
+        return False
+
+    # Mesma ordem de get_or_add_image() da renderização: os rIds saem iguais aos de um build completo
+    rel_ids = {old_id: doc.part.get_or_add_image(io.BytesIO(blob))[0] for old_id, blob in blobs.items()}
+    next_shape_id = doc.part.next_id
+    body = doc.element.body
+    sect_pr = body.find(qn('w:sectPr'))
+    for element in elements:
+        for blip in element.iter(qn('a:blip')):
+            rel_id = blip.get(qn('r:embed'))
+            if rel_id in rel_ids:
+                blip.set(qn('r:embed'), rel_ids[rel_id])
+        for doc_pr in element.iter(qn('wp:docPr')):
+            _renumber_shape(doc_pr, next_shape_id)
+            next_shape_id += 1
+        if sect_pr is not None:
+            sect_pr.addprevious(element)
+        else:
+            body.append(element)
+    doc._figure_counter = getattr(doc, '_figure_counter', 0) + figures  # type: ignore[attr-defined]
+    return True
+
+
+def _add_docx_sections(
+    doc: Document,
+    nodes: List[Any],
+    content_width_inches: float,
+    cache: Optional[DocxFragmentCache],
+    section_keys: List[str],
+    on_section: Optional[Callable[[], None]] = None,
+) -> int:
+    """Renderiza seção a seção, reaproveitando do cache as que não mudaram. Devolve os acertos."""
+    hits = 0
+    for index, section_nodes in enumerate(split_docx_sections(nodes)):
+        key = None
+        figures_before = getattr(doc, '_figure_counter', 0)
+        if cache is not None:
+            # As legendas "Figura NN" são numeradas no documento todo: a numeração inicial entra na chave
+            key = hashlib.sha256(f"{section_keys[index]}|figura {figures_before}".encode('ascii')).hexdigest()
+        if key is not None and _splice_docx_fragment(doc, key, cache):
+            hits += 1
+        else:
+            rendered_before = len(_body_content_elements(doc))
+            _add_html_content(doc, section_nodes, content_width_inches)
+            if key is not None:
+                figures = getattr(doc, '_figure_counter', 0) - figures_before
+                _store_docx_fragment(doc, _body_content_elements(doc)[rendered_before:], key, cache, figures)
+        if on_section is not None:
+            on_section()
+    return hits
+
+
+def _docx_content_width_inches() -> float:
+    return (Mm(PAGE_WIDTH_MM) - Mm(PAGE_MARGIN_LEFT_MM) - Mm(PAGE_MARGIN_RIGHT_MM)) / 914400
+
+
+def _docx_cache_keys(
+    nodes: List[Any],
+    metadata: dict,
+    logo_path: Optional[Path],
+    separator_path: Optional[Path],
+    footer_banner_path: Optional[Path],
+) -> Tuple[List[str], str]:
+    """Chaves das seções e do documento inteiro no DocxFragmentCache."""
+    content_width_inches = _docx_content_width_inches()
+    section_keys = [_docx_section_key(section, content_width_inches) for section in split_docx_sections(nodes)]
+    layout_signature = _docx_layout_signature(metadata, logo_path, separator_path, footer_banner_path)
+    document_key = hashlib.sha256('|'.join([layout_signature] + section_keys).encode('utf-8')).hexdigest()
+    return section_keys, document_key
+
+
+def _add_docx_style(doc: Document, name: str, style_id: str, style_type, base_name: Optional[str] = None):
+    style = doc.styles.add_style(name, style_type)
+    # IDs ASCII: o Word descarta acentos ao gerar IDs e estranha os que os mantêm
+    style.style_id = style_id
+    if base_name:
+        style.base_style = doc.styles[base_name]
+    return style
+
+
+def _set_style_font(
+    style,
+    name: Optional[str] = None,
+    size: Optional[float] = None,
+    color: Optional[RGBColor] = None,
+    bold: Optional[bool] = None,
+    underline: Optional[bool] = None,
+) -> None:
+    font = style.font
+    if name:
+        font.name = name
+        # Fontes de tema (ex.: Cambria dos títulos) têm precedência sobre o nome explícito
+        r_fonts = style.element.rPr.rFonts
+        for attr in ('w:asciiTheme', 'w:hAnsiTheme'):
+            r_fonts.attrib.pop(qn(attr), None)
+    if size is not None:
+        font.size = Pt(size)
+    if color is not None:
+        font.color.rgb = color
+    if bold is not None:
+        font.bold = bold
+    if underline is not None:
+        font.underline = underline
+
+
+def _set_style_paragraph(
+    style,
+    space_before: Optional[float] = None,
+    space_after: Optional[float] = None,
+    line_spacing: Optional[float] = None,
+    left_indent: Optional[float] = None,
+    right_indent: Optional[float] = None,
+    first_line_indent: Optional[float] = None,
+    alignment=None,
+) -> None:
+    paragraph_format = style.paragraph_format
+    if space_before is not None:
+        paragraph_format.space_before = Pt(space_before)
+    if space_after is not None:
+        paragraph_format.space_after = Pt(space_after)
+    if line_spacing is not None:
+        paragraph_format.line_spacing = line_spacing
+    if left_indent is not None:
+        paragraph_format.left_indent = Pt(left_indent)
+    if right_indent is not None:
+        paragraph_format.right_indent = Pt(right_indent)
+    if first_line_indent is not None:
+        paragraph_format.first_line_indent = Pt(first_line_indent)
+    if alignment is not None:
+        paragraph_format.alignment = alignment
+
+
+def _list_style_name(kind: str, level: int) -> str:
+    """Estilo do nível da lista; níveis além de LIST_STYLE_LEVELS reutilizam o mais profundo."""
+    return f"Captura {kind} {min(level, LIST_STYLE_LEVELS - 1) + 1}"
+
+
+def _define_docx_styles(doc: Document) -> None:
+    """Cria os estilos nomeados do corpo para que parágrafos e runs só referenciem o estilo.
+
+    Todos são definidos aqui, de uma vez: seções reaproveitadas do cache de fragmentos
+    citam os IDs dos estilos e precisam encontrá-los em qualquer documento novo.
+    """
+    paragraph_type = WD_STYLE_TYPE.PARAGRAPH
+    code_color = RGBColor(45, 45, 45)
+    styles: Dict[str, Any] = {}
+
+    for level, (size, space_before) in {2: (13, 10), 3: (12, 7), 4: (11, 7)}.items():
+        heading = doc.styles[f'Heading {level}']
+        _set_style_font(heading, 'Calibri', size, bold=True)
+        _set_style_paragraph(heading, space_before=space_before, space_after=4, alignment=WD_ALIGN_PARAGRAPH.LEFT)
+        styles[heading.name] = heading
+
+    try:
+        caption = doc.styles['Caption']
+    except KeyError:
+        caption = None
+    if caption is not None:
+        _set_style_font(caption, 'Calibri', 9)
+        _set_style_paragraph(
+            caption,
+            space_before=1,
+            space_after=6,
+            left_indent=0,
+            first_line_indent=0,
+            alignment=WD_ALIGN_PARAGRAPH.CENTER,
+        )
+        styles[caption.name] = caption
+
+    code = _add_docx_style(doc, 'Captura Código', 'CapturaCodigo', paragraph_type, 'Normal')
+    _set_style_font(code, 'Consolas', 9.5, code_color)
+    _set_style_paragraph(code, space_before=4, space_after=8, line_spacing=1.05, left_indent=12, right_indent=6)
+    _add_paragraph_shading(code, 'F5F5F5')
+
+    inline_code = _add_docx_style(doc, 'Captura Código Inline', 'CapturaCodigoInline', WD_STYLE_TYPE.CHARACTER)
+    _set_style_font(inline_code, 'Consolas', 9.5, code_color)
+
+    link = _add_docx_style(doc, 'Captura Link', 'CapturaLink', WD_STYLE_TYPE.CHARACTER)
+    _set_style_font(link, color=RGBColor(5, 99, 193), underline=True)
+
+    figure = _add_docx_style(doc, 'Captura Figura', 'CapturaFigura', paragraph_type, 'Normal')
+    _set_style_paragraph(
+        figure,
+        space_before=6,
+        space_after=2,
+        left_indent=0,
+        first_line_indent=0,
+        alignment=WD_ALIGN_PARAGRAPH.CENTER,
+    )
+
+    table_cell = _add_docx_style(doc, 'Captura Tabela', 'CapturaTabela', paragraph_type, 'Normal')
+    _set_style_paragraph(table_cell, space_before=1, space_after=1, line_spacing=1.08)
+    table_header = _add_docx_style(doc, 'Captura Tabela Cabeçalho', 'CapturaTabelaCabecalho', paragraph_type, 'Captura Tabela')
+    _set_style_font(table_header, bold=True)
+
+    quote = _add_docx_style(doc, 'Captura Citação', 'CapturaCitacao', paragraph_type, 'Normal')
+    _set_style_paragraph(quote, space_after=6, line_spacing=1.12, left_indent=18)
+
+    rule = _add_docx_style(doc, 'Captura Separador', 'CapturaSeparador', paragraph_type, 'Normal')
+    _set_style_paragraph(rule, space_before=6, space_after=6)
+    _add_paragraph_bottom_border(rule, 'D0D0D0')
+
+    list_spacer = _add_docx_style(doc, 'Captura Espaçador Lista', 'CapturaEspacadorLista', paragraph_type, 'Normal')
+    _set_style_paragraph(list_spacer, space_before=0, space_after=2)
+
+    for level in range(LIST_STYLE_LEVELS):
+        indent = LIST_BASE_INDENT_PT + level * LIST_INDENT_STEP_PT
+        for kind, style_id, base_name in (
+            ('Lista', 'CapturaLista', 'List Bullet'),
+            ('Lista Numerada', 'CapturaListaNumerada', 'Normal'),
+        ):
+            item = _add_docx_style(doc, _list_style_name(kind, level), f'{style_id}{level + 1}', paragraph_type, base_name)
+            _set_style_paragraph(
+                item,
+                space_before=2,
+                space_after=4 if level == 0 else 2,
+                line_spacing=1.12,
+                left_indent=indent,
+                first_line_indent=0,
+            )
+            styles[item.name] = item
+        continuation = _add_docx_style(
+            doc,
+            _list_style_name('Lista Continuação', level),
+            f'CapturaListaContinuacao{level + 1}',
+            paragraph_type,
+            'Normal',
+        )
+        _set_style_paragraph(
+            continuation,
+            space_before=1,
+            space_after=3,
+            line_spacing=1.12,
+            left_indent=indent + 10,
+            first_line_indent=0,
+        )
+        styles[continuation.name] = continuation
+
+    for style in (code, inline_code, link, figure, table_cell, table_header, quote, rule, list_spacer):
+        styles[style.name] = style
+    # Consultar doc.styles[nome] percorre o XML de estilos; os parágrafos usam este índice
+    setattr(doc, '_captura_styles', styles)
+
+
+def _docx_style(doc: Document, name: str):
+    styles = getattr(doc, '_captura_styles', None) or {}
+    style = styles.get(name)
+    return style if style is not None else doc.styles[name]
+
+
+def _add_styled_paragraph(doc: Document, style_name: str, text: str = ''):
+    """Parágrafo com o estilo já aplicado pelo ID.
+
+    Atribuir ``paragraph.style`` faz o python-docx varrer todos os estilos atrás do padrão
+    a cada chamada, o que domina o tempo de build_docx() em documentos grandes.
+    """
+    paragraph = doc.add_paragraph(text)
+    paragraph._p.style = _docx_style(doc, style_name).style_id
+    return paragraph
+
+
+def _new_document(
+    metadata: dict,
+    logo_path: Optional[Path],
+    separator_path: Optional[Path],
+    footer_banner_path: Optional[Path],
+) -> Optional[Document]:
+    """Documento vazio com estilos, página A4 e cabeçalho/rodapé configurados."""
     try:
         doc = Document()
     except Exception as error:
         print(f"[AVISO] Falha ao inicializar documento DOCX: {error}")
-        return False
+        return None
 
     normal_style = doc.styles['Normal']
     normal_style.font.name = 'Calibri'
@@ -1105,14 +4238,15 @@ def build_docx(
         normal_paragraph.line_spacing = 1.18
     except Exception:
         pass
+    _define_docx_styles(doc)
 
     section = doc.sections[0]
-    section.page_height = Mm(297)
-    section.page_width = Mm(210)
-    section.left_margin = Mm(20)
-    section.right_margin = Mm(20)
-    section.top_margin = Mm(18)
-    section.bottom_margin = Mm(18)
+    section.page_height = Mm(PAGE_HEIGHT_MM)
+    section.page_width = Mm(PAGE_WIDTH_MM)
+    section.left_margin = Mm(PAGE_MARGIN_LEFT_MM)
+    section.right_margin = Mm(PAGE_MARGIN_RIGHT_MM)
+    section.top_margin = Mm(PAGE_MARGIN_TOP_MM)
+    section.bottom_margin = Mm(PAGE_MARGIN_BOTTOM_MM)
 
     _configure_header(section, metadata, logo_path, separator_path)
     _configure_footer(section, metadata, footer_banner_path)
@@ -1120,11 +4254,46 @@ def build_docx(
     if doc.paragraphs:
         first_para = doc.paragraphs[0]._element
         first_para.getparent().remove(first_para)
+    return doc
+
 
-    content_width = section.page_width - section.left_margin - section.right_margin
-    content_width_inches = content_width / 914400
+def build_docx(
+    soup: BeautifulSoup,
+    metadata: dict,
+    logo_path: Optional[Path],
+    separator_path: Optional[Path],
+    footer_banner_path: Optional[Path],
+    output_path: Optional[Path] = None,
+    fragment_cache: Optional[DocxFragmentCache] = None,
+) -> Optional[bytes]:
+    content_width_inches = _docx_content_width_inches()
+    nodes = list(soup.children)
+    section_keys: List[str] = []
+    document_key: Optional[str] = None
+    if fragment_cache is not None:
+        section_keys, document_key = _docx_cache_keys(nodes, metadata, logo_path, separator_path, footer_banner_path)
+        cached_docx = fragment_cache.read(document_key, '.docx')
+        if cached_docx is not None:
+            print(f"[OK] DOCX inalterado ({len(section_keys)} seção(ões)): reaproveitado do cache sem renderizar")
+            if output_path:
+                try:
+                    output_path.write_bytes(cached_docx)
+                except Exception as error:
+                    print(f"[AVISO] Falha ao salvar DOCX: {error}")
+            return cached_docx
+
+    doc = _new_document(metadata, logo_path, separator_path, footer_banner_path)
+    if doc is None:
+        return None
 
-    _add_html_content(doc, list(soup.children), content_width_inches)
+    if fragment_cache is not None:
+        hits = _add_docx_sections(doc, nodes, content_width_inches, fragment_cache, section_keys)
+        print(
+            f"[OK] DOCX: {hits}/{len(section_keys)} seção(ões) reaproveitada(s) do cache, "
+            f"{len(section_keys) - hits} renderizada(s)"
+        )
+    else:
+        _add_html_content(doc, nodes, content_width_inches)
 
     from io import BytesIO
     buf = BytesIO()
@@ -1134,6 +4303,9 @@ def build_docx(
     except Exception as error:
         print(f"[AVISO] Falha ao gerar DOCX: {error}")
         return None
+
+    if fragment_cache is not None and document_key:
+        fragment_cache.write(document_key, '.docx', docx_bytes)
     
     if output_path:
         try:
@@ -1144,6 +4316,301 @@ def build_docx(
     return docx_bytes
 
 
+_SPOOLED_IMAGE_PART_CLASS: Optional[type] = None
+
+
+def _spooled_image_part_class() -> type:
+    """
+    ImagePart cujo conteúdo já foi gravado em disco pelo StreamingDocxWriter.
+
+    Criada sob demanda: depende de internos do python-docx (ImagePart, _blob, sha1).
+    Levanta ImportError/AttributeError numa versão incompatível, e write_docx_streaming()
+    volta para o save() normal.
+    """
+    global _SPOOLED_IMAGE_PART_CLASS
+    if _SPOOLED_IMAGE_PART_CLASS is None:
+        from docx.parts.image import ImagePart  # type: ignore
+
+        for attribute in ('blob', 'sha1', 'partname'):
+            if not hasattr(ImagePart, attribute):
+                raise AttributeError(f"ImagePart.{attribute} ausente nesta versão do python-docx")
+
+        class _SpooledImagePart(ImagePart):
+            spool_path: Path
+            spool_sha1: str
+
+            @property
+            def blob(self) -> bytes:
+                return self.spool_path.read_bytes()
+
+            @property
+            def sha1(self) -> str:
+                # Usado pelo python-docx para reaproveitar imagens repetidas sem reler o arquivo
+                return self.spool_sha1
+
+        _SPOOLED_IMAGE_PART_CLASS = _SpooledImagePart
+    return _SPOOLED_IMAGE_PART_CLASS
+
+
+_CONTENT_TYPES_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/content-types"
+_CONTENT_TYPE_RELATIONSHIPS = "application/vnd.openxmlformats-package.relationships+xml"
+_CONTENT_TYPE_XML = "application/xml"
+# Pares (extensão, tipo) gravados como <Default> no [Content_Types].xml; as demais
+# partes viram <Override>. Mesmo critério do PackageWriter do python-docx.
+_DEFAULT_CONTENT_TYPES = frozenset({
+    ("bin", "application/vnd.openxmlformats-officedocument.spreadsheetml.printerSettings"),
+    ("bmp", "image/bmp"),
+    ("emf", "image/x-emf"),
+    ("fntdata", "application/x-fontdata"),
+    ("gif", "image/gif"),
+    ("jpe", "image/jpeg"),
+    ("jpeg", "image/jpeg"),
+    ("jpg", "image/jpeg"),
+    ("png", "image/png"),
+    ("rels", _CONTENT_TYPE_RELATIONSHIPS),
+    ("tif", "image/tiff"),
+    ("tiff", "image/tiff"),
+    ("wdp", "image/vnd.ms-photo"),
+    ("wmf", "image/x-wmf"),
+    ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    ("xml", _CONTENT_TYPE_XML),
+})
+
+
+def _serialize_part_xml(element) -> bytes:
+    return etree.tostring(element, encoding='UTF-8', standalone=True)
+
+
+def _content_types_xml(parts) -> bytes:
+    """[Content_Types].xml do pacote, byte a byte igual ao gerado pelo doc.save()."""
+    defaults = {"rels": _CONTENT_TYPE_RELATIONSHIPS, "xml": _CONTENT_TYPE_XML}
+    overrides: Dict[str, str] = {}
+    for part in parts:
+        extension = part.partname.ext.lower()
+        if (extension, part.content_type) in _DEFAULT_CONTENT_TYPES:
+            defaults[extension] = part.content_type
+        else:
+            overrides[str(part.partname)] = part.content_type
+    types = etree.Element(f"{{{_CONTENT_TYPES_NAMESPACE}}}Types", nsmap={None: _CONTENT_TYPES_NAMESPACE})
+    for extension in sorted(defaults):
+        default = etree.SubElement(types, f"{{{_CONTENT_TYPES_NAMESPACE}}}Default")
+        default.set("Extension", extension)
+        default.set("ContentType", defaults[extension])
+    for partname in sorted(overrides):
+        override = etree.SubElement(types, f"{{{_CONTENT_TYPES_NAMESPACE}}}Override")
+        override.set("PartName", partname)
+        override.set("ContentType", overrides[partname])
+    return _serialize_part_xml(types)
+
+
+class _CountingWriter:
+    """
+    Conta os bytes repassados ao destino (que pode não suportar tell(), como o stdout em
+    pipe) e, se houver, grava a mesma saída em copy (entrada do cache do DOCX).
+    """
+
+    def __init__(self, destination: BinaryIO, copy: Optional[BinaryIO] = None) -> None:
+        self.destination = destination
+        self.copy = copy
+        self.written = 0
+
+    def write(self, data: bytes) -> int:
+        self.destination.write(data)
+        if self.copy is not None:
+            self.copy.write(data)
+        self.written += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.destination.flush()
+        if self.copy is not None:
+            self.copy.flush()
+
+
+_XMLNS_DECLARATION_PATTERN = re.compile(r' xmlns:(\w+)="([^"]*)"')
+_STREAM_BODY_MARKER = "captura-stream-body"
+
+
+class StreamingDocxWriter:
+    """
+    Grava o DOCX sem manter o documento inteiro em memória.
+
+    A cada seção renderizada os elementos do corpo são serializados em um arquivo
+    temporário e removidos da árvore do python-docx, e as imagens novas vão para disco.
+    No fim o pacote é escrito direto no destino com zipfile: document.xml montado a partir
+    do arquivo temporário, imagens lidas do disco e as demais partes (estilos, cabeçalho
+    e rodapé de _configure_header/_configure_footer) como o python-docx as gerou.
+    """
+
+    def __init__(self, doc: Document) -> None:
+        self.doc = doc
+        self.spooled_image_part = _spooled_image_part_class()
+        self.body_spool = tempfile.TemporaryFile()
+        self.media_dir = tempfile.TemporaryDirectory(prefix="captura_docx_media_")
+        self.root_namespaces = {prefix: uri for prefix, uri in doc.element.nsmap.items() if prefix}
+        self.next_shape_id = 1
+        self.peak_body_elements = 0
+
+    def _serialize(self, element) -> bytes:
+        xml = etree.tostring(element, encoding='unicode')
+        # Declarações de namespace já presentes em <w:document> ficam só na raiz, como no save()
+        start_tag_end = xml.index('>')
+        start_tag = _XMLNS_DECLARATION_PATTERN.sub(
+            lambda match: '' if self.root_namespaces.get(match.group(1)) == match.group(2) else match.group(0),
+            xml[:start_tag_end],
+        )
+        return (start_tag + xml[start_tag_end:]).encode('utf-8')
+
+    def flush_body(self) -> None:
+        body = self.doc.element.body
+        elements = _body_content_elements(self.doc)
+        self.peak_body_elements = max(self.peak_body_elements, len(elements))
+        for element in elements:
+            # next_id do python-docx só enxerga o que ainda está na árvore: numera aqui, em ordem
+            for doc_pr in element.iter(qn('wp:docPr')):
+                _renumber_shape(doc_pr, self.next_shape_id)
+                self.next_shape_id += 1
+            self.body_spool.write(self._serialize(element))
+            body.remove(element)
+        self._spool_images()
+
+    def _spool_images(self) -> None:
+        for image_part in self.doc.part.package.image_parts:
+            if isinstance(image_part, self.spooled_image_part):
+                continue
+            blob = image_part.blob
+            spool_path = Path(self.media_dir.name) / image_part.partname.filename
+            spool_path.write_bytes(blob)
+            sha1 = hashlib.sha1(blob).hexdigest()
+            image_part.__class__ = self.spooled_image_part
+            image_part.spool_path = spool_path
+            image_part.spool_sha1 = sha1
+            image_part._blob = None
+            image_part._image = None
+
+    def write(self, destination: BinaryIO, copy: Optional[BinaryIO] = None) -> int:
+        self.flush_body()
+        body = self.doc.element.body
+        marker = etree.Comment(_STREAM_BODY_MARKER)
+        body.insert(0, marker)
+        head, tail = _serialize_part_xml(self.doc.element).split(f"<!--{_STREAM_BODY_MARKER}-->".encode('ascii'))
+        body.remove(marker)
+
+        package = self.doc.part.package
+        parts = list(package.parts)
+        for part in parts:
+            part.before_marshal()
+        counter = _CountingWriter(destination, copy)
+        with zipfile.ZipFile(counter, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            # Mesma composição do PackageWriter do python-docx, parte a parte
+            archive.writestr('[Content_Types].xml', _content_types_xml(parts))
+            archive.writestr('_rels/.rels', package.rels.xml)
+            for part in parts:
+                member = part.partname.membername
+                if part is self.doc.part:
+                    size = len(head) + self.body_spool.tell() + len(tail)
+                    with archive.open(member, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as stream:
+                        stream.write(head)
+                        self.body_spool.seek(0)
+                        shutil.copyfileobj(self.body_spool, stream, 1024 * 1024)
+                        stream.write(tail)
+                elif isinstance(part, self.spooled_image_part):
+                    archive.write(part.spool_path, member)
+                else:
+                    archive.writestr(member, part.blob)
+                if len(part.rels):
+                    archive.writestr(part.partname.rels_uri.membername, part.rels.xml)
+        return counter.written
+
+    def close(self) -> None:
+        self.body_spool.close()
+        self.media_dir.cleanup()
+
+
+def write_docx_streaming(
+    soup: BeautifulSoup,
+    metadata: dict,
+    logo_path: Optional[Path],
+    separator_path: Optional[Path],
+    footer_banner_path: Optional[Path],
+    destination: BinaryIO,
+    fragment_cache: Optional[DocxFragmentCache] = None,
+) -> Optional[int]:
+    """
+    Variante de build_docx() que escreve o pacote direto em destination. Devolve os bytes gravados.
+
+    O pacote gerado também vai para o cache do DOCX (mesma chave de documento de
+    build_docx), gravado em paralelo num arquivo temporário, então um DOCX inalterado
+    é reaproveitado nas duas rotas.
+    """
+    try:
+        _spooled_image_part_class()
+    except (ImportError, AttributeError) as error:
+        print(f"[AVISO] Streaming do DOCX indisponível nesta versão do python-docx ({error}); usando o save() normal")
+        docx_bytes = build_docx(
+            soup, metadata, logo_path, separator_path, footer_banner_path, fragment_cache=fragment_cache,
+        )
+        if docx_bytes is None:
+            return None
+        destination.write(docx_bytes)
+        return len(docx_bytes)
+
+    content_width_inches = _docx_content_width_inches()
+    nodes = list(soup.children)
+    section_keys: List[str] = []
+    document_key: Optional[str] = None
+    if fragment_cache is not None:
+        section_keys, document_key = _docx_cache_keys(nodes, metadata, logo_path, separator_path, footer_banner_path)
+        written = fragment_cache.copy_to(document_key, '.docx', destination)
+        if written is not None:
+            print(f"[OK] DOCX inalterado ({len(section_keys)} seção(ões)): reaproveitado do cache sem renderizar")
+            return written
+
+    doc = _new_document(metadata, logo_path, separator_path, footer_banner_path)
+    if doc is None:
+        return None
+
+    writer = StreamingDocxWriter(doc)
+    cache_copy: Optional[BinaryIO] = None
+    cache_copy_path: Optional[Path] = None
+    try:
+        hits = _add_docx_sections(
+            doc, nodes, content_width_inches, fragment_cache, section_keys, on_section=writer.flush_body,
+        )
+        if fragment_cache is not None and document_key:
+            print(
+                f"[OK] DOCX: {hits}/{len(section_keys)} seção(ões) reaproveitada(s) do cache, "
+                f"{len(section_keys) - hits} renderizada(s)"
+            )
+            cache_copy_path = fragment_cache.temp_path(document_key, '.docx')
+            try:
+                cache_copy_path.parent.mkdir(parents=True, exist_ok=True)
+                cache_copy = cache_copy_path.open('wb')
+            except OSError as error:
+                print(f"[AVISO] DOCX em streaming não será guardado no cache: {error}")
+                cache_copy_path = None
+        written = writer.write(destination, cache_copy)
+        print(f"[DEBUG] DOCX em streaming: no máximo {writer.peak_body_elements} elemento(s) do corpo em memória")
+        if cache_copy is not None and cache_copy_path is not None:
+            cache_copy.close()
+            cache_copy = None
+            fragment_cache.commit_temp(document_key, '.docx', cache_copy_path)
+            cache_copy_path = None
+        return written
+    except Exception as error:
+        print(f"[AVISO] Falha ao gerar DOCX em streaming: {error}")
+        return None
+    finally:
+        writer.close()
+        if cache_copy is not None:
+            cache_copy.close()
+        if cache_copy_path is not None:
+            try:
+                cache_copy_path.unlink()
+            except OSError:
+                pass
+
+
 def _add_field(paragraph, field_code: str, font_size: float = 10) -> None:
     run = paragraph.add_run()
     fld_char = OxmlElement('w:fldChar')
@@ -1183,11 +4650,30 @@ def _parse_cli_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Converte Markdown em DOCX com suporte a prints, Mermaid e layout corporativo.",
     )
+    parser.add_argument(
+        "--benchmark",
+        choices=list(BENCHMARKS),
+        help="Executa um benchmark interno com documentos sintéticos e sai (não gera DOCX).",
+    )
+    parser.add_argument(
+        "--benchmark-size",
+        type=int,
+        default=2000,
+        help="Tamanho do documento sintético do benchmark (seções ou itens; padrão: 2000).",
+    )
     parser.add_argument(
         "--md-file",
         type=str,
         help="Caminho do arquivo .md de origem. Quando omitido, lê o Markdown via stdin.",
     )
+    parser.add_argument(
+        "--docx-engine",
+        choices=list(DOCX_ENGINES),
+        help=(
+            "Como o Markdown chega ao DOCX: 'html' (HTML intermediário + BeautifulSoup) ou 'ast' "
+            "(árvore do Markdown direto, com prints resolvidos inline). Padrão: DOCX_ENGINE ou html."
+        ),
+    )
     parser.add_argument(
         "--inline-artifact-markers",
         action="store_true",
@@ -1206,6 +4692,129 @@ def _parse_cli_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
         type=str,
         help="Pasta base opcional para resolver caminhos relativos de imagem (incluindo <<...>>).",
     )
+    parser.add_argument(
+        "--frame-workers",
+        type=int,
+        help=(
+            "Número de processos para extrair prints em paralelo (padrão: FRAME_EXTRACTION_WORKERS "
+            f"ou a quantidade de CPUs, no máximo {FRAME_PARALLEL_DEFAULT_MAX_WORKERS}). Use 1 para extração serial; "
+            f"com menos de {FRAME_PARALLEL_MIN_PRINTS} prints a extração é sempre serial."
+        ),
+    )
+    parser.add_argument(
+        "--no-frame-cache",
+        action="store_true",
+        help="Ignora o cache persistente de frames (CAPTURA_CACHE_DIR, limite em FRAME_CACHE_MAX_MB).",
+    )
+    parser.add_argument(
+        "--streaming-docx",
+        action="store_true",
+        help=(
+            "Escreve o DOCX direto no stdout seção a seção, com imagens lidas do disco, sem manter o "
+            "documento inteiro em memória (também via DOCX_STREAMING=1). Indicado para documentos muito grandes."
+        ),
+    )
+    parser.add_argument(
+        "--no-docx-cache",
+        action="store_true",
+        help=(
+            "Renderiza o DOCX inteiro sem o cache de seções '##' (CAPTURA_CACHE_DIR/docx, "
+            "limite em DOCX_CACHE_MAX_MB; 0 desativa)."
+        ),
+    )
+    parser.add_argument(
+        "--no-diagram-cache",
+        action="store_true",
+        help=(
+            "Renderiza todos os diagramas Mermaid de novo, sem o cache por código "
+            "(CAPTURA_CACHE_DIR/diagrams, limite em DIAGRAM_CACHE_MAX_MB; 0 desativa)."
+        ),
+    )
+    parser.add_argument(
+        "--no-seek-index",
+        action="store_true",
+        help="Não usa o índice de keyframes/PTS do vídeo; posiciona os prints pelo FPS nominal.",
+    )
+    parser.add_argument(
+        "--best-frame-window",
+        type=float,
+        help=(
+            "Janela (segundos) em torno de cada timestamp para escolher o frame mais nítido e "
+            "estável (padrão: BEST_FRAME_WINDOW_SECONDS ou 0 = frame exato)."
+        ),
+    )
+    parser.add_argument(
+        "--best-frame-samples",
+        type=int,
+        help="Quantidade de candidatos avaliados por janela (padrão: BEST_FRAME_SAMPLES ou 7).",
+    )
+    parser.add_argument(
+        "--video-fingerprints",
+        action="store_true",
+        help=(
+            "Analisa o vídeo uma vez (impressões digitais por segundo e mudanças de cena, em cache) "
+            "e pula a janela do melhor frame em trechos estáveis. Também via VIDEO_FINGERPRINTS=1."
+        ),
+    )
+    parser.add_argument(
+        "--print-dedup-threshold",
+        type=float,
+        help=(
+            "Fração de pixels alterados (ex.: 0.001) tolerada para dois prints compartilharem a "
+            "mesma imagem no DOCX; 0 só junta prints idênticos e mudanças localizadas (texto) "
+            "nunca são toleradas; negativo desativa (padrão: PRINT_DEDUP_THRESHOLD = 0)."
+        ),
+    )
+    parser.add_argument(
+        "--print-dpi",
+        type=int,
+        help=(
+            "Resolução dos prints na largura exibida no DOCX (ex.: 150 ou 200); reduz o tamanho "
+            "do documento. Padrão: PRINT_DPI ou 0 (limite fixo de 1400 px)."
+        ),
+    )
+    parser.add_argument(
+        "--print-codec",
+        choices=["auto", "jpeg"],
+        help=(
+            "Formato dos prints: 'auto' grava PNG-8 quando a tela (cores chapadas, texto) "
+            "fica menor que em JPEG; 'jpeg' sempre JPEG (padrão: PRINT_CODEC ou auto)."
+        ),
+    )
+    parser.add_argument(
+        "--video-proxy",
+        action="store_true",
+        help=(
+            "Extrai os prints de um proxy MJPEG só-intra na resolução dos prints, criado uma vez "
+            "por vídeo (seek barato nas revisões). Também via VIDEO_PROXY=1."
+        ),
+    )
+    parser.add_argument(
+        "--final-export",
+        action="store_true",
+        help="Exportação final: ignora o proxy (inclusive VIDEO_PROXY=1) e lê o vídeo original.",
+    )
+    parser.add_argument(
+        "--print-roi-scale",
+        type=float,
+        help=(
+            "Prints com coordenadas {x=..,y=..} são recortados em torno do clique, mantendo esta "
+            "fração da área útil (ex.: 0.5); 0 usa o frame inteiro (padrão: PRINT_ROI_SCALE ou 0)."
+        ),
+    )
+    parser.add_argument(
+        "--no-print-roi-highlight",
+        action="store_true",
+        help="Não desenha o marcador no ponto clicado dos prints recortados por coordenadas.",
+    )
+    parser.add_argument(
+        "--crop-mode",
+        choices=["auto", "fixed"],
+        help=(
+            "Recorte dos prints: 'auto' detecta barras e overlays por vídeo; 'fixed' usa as "
+            "constantes CROP_* do layout do Teams (padrão: CROP_MODE ou fixed)."
+        ),
+    )
     return parser.parse_args(argv)
 
 
@@ -1219,6 +4828,7 @@ def _normalize_inline_whitespace(text: str) -> str:
 
 
 def _add_paragraph_shading(paragraph, fill_hex: str) -> None:
+    """Aplica o fundo a um parágrafo ou a um estilo de parágrafo (ambos expõem o pPr)."""
     p_pr = paragraph._element.get_or_add_pPr()
     shd = OxmlElement('w:shd')
     shd.set(qn('w:val'), 'clear')
@@ -1261,7 +4871,7 @@ def _extract_code_block_text(code_text: str) -> str:
 
 
 def _is_multiline_code_tag(node) -> bool:
-    if not isinstance(node, Tag) or (node.name or '').lower() != 'code':
+    if not isinstance(node, _ELEMENT_TYPES) or (node.name or '').lower() != 'code':
         return False
     code_text = node.get_text() or ''
     if '\n' in code_text:
@@ -1271,12 +4881,12 @@ def _is_multiline_code_tag(node) -> bool:
 
 def _has_meaningful_flow_nodes(nodes) -> bool:
     for node in nodes:
-        if isinstance(node, NavigableString):
+        if isinstance(node, str):
             if _normalize_inline_whitespace(str(node)).strip():
                 return True
             continue
 
-        if not isinstance(node, Tag):
+        if not isinstance(node, _ELEMENT_TYPES):
             continue
 
         node_name = (node.name or '').lower()
@@ -1304,110 +4914,106 @@ def _remove_paragraph(paragraph) -> None:
 
 
 def _new_body_paragraph(doc: Document):
-    paragraph = doc.add_paragraph()
-    paragraph.style = doc.styles['Normal']
-    paragraph.paragraph_format.space_before = Pt(0)
-    paragraph.paragraph_format.space_after = Pt(6)
-    paragraph.paragraph_format.line_spacing = 1.18
-    return paragraph
+    # Espaçamento do corpo vem do estilo Normal configurado em _new_document
+    return doc.add_paragraph()
 
 
-def _new_list_continuation_paragraph(doc: Document, left_indent_pt: float):
-    paragraph = doc.add_paragraph()
-    paragraph.style = doc.styles['Normal']
-    paragraph.paragraph_format.left_indent = Pt(left_indent_pt)
-    paragraph.paragraph_format.first_line_indent = Pt(0)
-    paragraph.paragraph_format.space_before = Pt(1)
-    paragraph.paragraph_format.space_after = Pt(3)
-    paragraph.paragraph_format.line_spacing = 1.12
+def _new_list_continuation_paragraph(doc: Document, level: int):
+    paragraph = _add_styled_paragraph(doc, _list_style_name('Lista Continuação', level))
+    if level >= LIST_STYLE_LEVELS:
+        paragraph.paragraph_format.left_indent = Pt(LIST_BASE_INDENT_PT + level * LIST_INDENT_STEP_PT + 10)
     return paragraph
 
 
+def _close_paragraph_runs(runs: '_RunBuilder') -> None:
+    """Emite o texto pendente e descarta o parágrafo se ele ficou sem conteúdo visível."""
+    runs.flush()
+    if not runs.has_content:
+        _remove_paragraph(runs.paragraph)
+
+
 def _add_mixed_paragraph_with_code_blocks(doc: Document, paragraph_tag: Tag, content_width_inches: float) -> None:
     nodes = list(paragraph_tag.children)
-    current_paragraph = _new_body_paragraph(doc)
+    current_runs: Optional[_RunBuilder] = _RunBuilder(doc, _new_body_paragraph(doc))
 
     for idx, node in enumerate(nodes):
         prev_is_code = idx > 0 and _is_multiline_code_tag(nodes[idx - 1])
         next_is_code = idx + 1 < len(nodes) and _is_multiline_code_tag(nodes[idx + 1])
 
-        if isinstance(node, Tag) and (node.name or '').lower() == 'br' and (prev_is_code or next_is_code):
+        if isinstance(node, _ELEMENT_TYPES) and (node.name or '').lower() == 'br' and (prev_is_code or next_is_code):
             continue
 
-        if isinstance(node, NavigableString) and not _normalize_inline_whitespace(str(node)).strip() and (prev_is_code or next_is_code):
+        if isinstance(node, str) and not _normalize_inline_whitespace(str(node)).strip() and (prev_is_code or next_is_code):
             continue
 
         if _is_multiline_code_tag(node):
-            if current_paragraph is not None and not current_paragraph.text.strip():
-                _remove_paragraph(current_paragraph)
-            current_paragraph = None
+            if current_runs is not None:
+                _close_paragraph_runs(current_runs)
+            current_runs = None
             _add_code_block(doc, node.get_text(), left_indent_pt=12, right_indent_pt=6)
 
             if _has_meaningful_flow_nodes(nodes[idx + 1:]):
-                current_paragraph = _new_body_paragraph(doc)
+                current_runs = _RunBuilder(doc, _new_body_paragraph(doc))
             continue
 
-        if current_paragraph is None:
-            current_paragraph = _new_body_paragraph(doc)
+        if current_runs is None:
+            current_runs = _RunBuilder(doc, _new_body_paragraph(doc))
 
-        _add_runs(doc, current_paragraph, node, content_width_inches)
+        _add_runs(doc, current_runs, node, content_width_inches)
 
-    if current_paragraph is not None and not current_paragraph.text.strip():
-        _remove_paragraph(current_paragraph)
+    if current_runs is not None:
+        _close_paragraph_runs(current_runs)
 
 
 def _add_list_paragraph_with_code_blocks(
     doc: Document,
-    list_paragraph,
+    list_runs: '_RunBuilder',
     paragraph_tag: Tag,
     content_width_inches: float,
     level: int,
-    base_indent: int,
-    indent_step: int,
 ) -> None:
     nodes = list(paragraph_tag.children)
-    continuation_indent = base_indent + level * indent_step + 10
-    code_indent = continuation_indent + 2
-    current_paragraph = list_paragraph
+    code_indent = LIST_BASE_INDENT_PT + level * LIST_INDENT_STEP_PT + 12
+    current_runs: Optional[_RunBuilder] = list_runs
 
     for idx, node in enumerate(nodes):
         prev_is_code = idx > 0 and _is_multiline_code_tag(nodes[idx - 1])
         next_is_code = idx + 1 < len(nodes) and _is_multiline_code_tag(nodes[idx + 1])
 
-        if isinstance(node, Tag) and (node.name or '').lower() == 'br' and (prev_is_code or next_is_code):
+        if isinstance(node, _ELEMENT_TYPES) and (node.name or '').lower() == 'br' and (prev_is_code or next_is_code):
             continue
 
-        if isinstance(node, NavigableString) and not _normalize_inline_whitespace(str(node)).strip() and (prev_is_code or next_is_code):
+        if isinstance(node, str) and not _normalize_inline_whitespace(str(node)).strip() and (prev_is_code or next_is_code):
             continue
 
         if _is_multiline_code_tag(node):
-            if current_paragraph is not None and current_paragraph is not list_paragraph and not current_paragraph.text.strip():
-                _remove_paragraph(current_paragraph)
-            current_paragraph = None
+            if current_runs is not None and current_runs is not list_runs:
+                _close_paragraph_runs(current_runs)
+            current_runs = None
             _add_code_block(doc, node.get_text(), left_indent_pt=code_indent, right_indent_pt=4)
 
             if _has_meaningful_flow_nodes(nodes[idx + 1:]):
-                current_paragraph = _new_list_continuation_paragraph(doc, continuation_indent)
+                current_runs = _RunBuilder(doc, _new_list_continuation_paragraph(doc, level))
             continue
 
-        if current_paragraph is None:
-            current_paragraph = _new_list_continuation_paragraph(doc, continuation_indent)
+        if current_runs is None:
+            current_runs = _RunBuilder(doc, _new_list_continuation_paragraph(doc, level))
 
-        _add_runs(doc, current_paragraph, node, content_width_inches)
+        _add_runs(doc, current_runs, node, content_width_inches)
 
-    if current_paragraph is not None and current_paragraph is not list_paragraph and not current_paragraph.text.strip():
-        _remove_paragraph(current_paragraph)
+    if current_runs is not None and current_runs is not list_runs:
+        _close_paragraph_runs(current_runs)
 
 
 def _is_code_only_paragraph(paragraph_tag: Tag) -> bool:
     children = [
         child for child in paragraph_tag.children
-        if not (isinstance(child, NavigableString) and not str(child).strip())
+        if not (isinstance(child, str) and not str(child).strip())
     ]
     if len(children) != 1:
         return False
     code_tag = children[0]
-    if not isinstance(code_tag, Tag) or (code_tag.name or '').lower() != 'code':
+    if not isinstance(code_tag, _ELEMENT_TYPES) or (code_tag.name or '').lower() != 'code':
         return False
     code_text = code_tag.get_text() or ''
     if '\n' in code_text:
@@ -1420,14 +5026,12 @@ def _add_code_block(doc: Document, code_text: str, left_indent_pt: float = 12, r
     if not cleaned:
         return
 
-    paragraph = doc.add_paragraph()
-    paragraph.style = doc.styles['Normal']
-    paragraph.paragraph_format.left_indent = Pt(left_indent_pt)
-    paragraph.paragraph_format.right_indent = Pt(right_indent_pt)
-    paragraph.paragraph_format.space_before = Pt(4)
-    paragraph.paragraph_format.space_after = Pt(8)
-    paragraph.paragraph_format.line_spacing = 1.05
-    _add_paragraph_shading(paragraph, 'F5F5F5')
+    # Fonte, fundo e espaçamento vêm de "Captura Código"; só recuos diferentes ficam no parágrafo
+    paragraph = _add_styled_paragraph(doc, 'Captura Código')
+    if left_indent_pt != 12:
+        paragraph.paragraph_format.left_indent = Pt(left_indent_pt)
+    if right_indent_pt != 6:
+        paragraph.paragraph_format.right_indent = Pt(right_indent_pt)
 
     if language:
         lang_run = paragraph.add_run(language.upper())
@@ -1437,28 +5041,25 @@ def _add_code_block(doc: Document, code_text: str, left_indent_pt: float = 12, r
         lang_run.font.color.rgb = RGBColor(105, 105, 105)
         paragraph.add_run().add_break()
 
-    run = paragraph.add_run(cleaned.replace('\t', '    '))
-    run.font.name = 'Consolas'
-    run.font.size = Pt(9.5)
-    run.font.color.rgb = RGBColor(45, 45, 45)
+    paragraph.add_run(cleaned.replace('\t', '    '))
 
 
-def _add_horizontal_rule(doc: Document) -> None:
-    paragraph = doc.add_paragraph()
-    paragraph.paragraph_format.space_before = Pt(6)
-    paragraph.paragraph_format.space_after = Pt(6)
-
+def _add_paragraph_bottom_border(paragraph, color_hex: str) -> None:
     p_pr = paragraph._element.get_or_add_pPr()
     p_bdr = OxmlElement('w:pBdr')
     bottom = OxmlElement('w:bottom')
     bottom.set(qn('w:val'), 'single')
     bottom.set(qn('w:sz'), '4')
     bottom.set(qn('w:space'), '1')
-    bottom.set(qn('w:color'), 'D0D0D0')
+    bottom.set(qn('w:color'), color_hex)
     p_bdr.append(bottom)
     p_pr.append(p_bdr)
 
 
+def _add_horizontal_rule(doc: Document) -> None:
+    _add_styled_paragraph(doc, 'Captura Separador')
+
+
 def _resolve_asset_path(src: str) -> Optional[Path]:
     if not src:
         return None
@@ -1529,53 +5130,17 @@ def _parse_length_from_attr(value: Optional[str]) -> Optional[float]:
     return inches
 
 
-def _get_image_dimensions(img_path: Path) -> Optional[Tuple[int, int]]:
-    try:
-        img = cv2.imread(str(img_path))
-        if img is not None:
-            height, width = img.shape[:2]
-            return width, height
-        # Fallback: parse dimensions from file headers to handle Unicode path issues
-        data = img_path.read_bytes()
-        # PNG header
-        if len(data) >= 24 and data[:8] == b'\x89PNG\r\n\x1a\n':
-            # IHDR chunk starts at byte 8+8
-            width = int.from_bytes(data[16:20], 'big')
-            height = int.from_bytes(data[20:24], 'big')
-            if width > 0 and height > 0:
-                return width, height
-        # JPEG header (scan for SOF0/2 markers)
-        i = 0
-        while i + 9 < len(data) and data[i] == 0xFF:
-            if data[i + 1] in (0xC0, 0xC2):
-                # SOF marker length is at i+2..i+3
-                h = int.from_bytes(data[i + 5:i + 7], 'big')
-                w = int.from_bytes(data[i + 7:i + 9], 'big')
-                if w > 0 and h > 0:
-                    return w, h
-                break
-            if data[i + 1] == 0xDA:  # SOS
-                break
-            seg_len = int.from_bytes(data[i + 2:i + 4], 'big')
-            if seg_len <= 0:
-                break
-            i += 2 + seg_len
-    except Exception as error:  # noqa: BLE001
-        print(f"[AVISO] Não foi possível ler dimensões da imagem {img_path}: {error}")
-    return None
-
-
-def _add_image_to_paragraph(paragraph, img_tag: Tag, content_width_inches: float) -> None:
+def _add_image_to_paragraph(paragraph, img_tag: Tag, content_width_inches: float) -> bool:
     src = img_tag.get('src', '')
     img_path = _resolve_asset_path(src)
     if not img_path:
         print(f"[AVISO] Imagem não encontrada para inserção no DOCX: {src}")
-        return
+        return False
 
     width_inches = _parse_length_from_attr(img_tag.get('width'))
     height_inches = _parse_length_from_attr(img_tag.get('height'))
 
-    max_width_inches = max(content_width_inches - 0.4, 1.0)
+    max_width_inches = max(content_width_inches - FIGURE_SIDE_MARGIN_INCHES, 1.0)
     resolved_path = None
     try:
         resolved_path = img_path.resolve()
@@ -1640,18 +5205,80 @@ def _add_image_to_paragraph(paragraph, img_tag: Tag, content_width_inches: float
     except Exception as error:
         print(f"[AVISO] Falha ao inserir imagem no DOCX ({img_path}): {error}")
         paragraph._element.remove(run._r)
+        return False
+    return True
+
+
+class _RunBuilder:
+    """Acumula o texto inline de um parágrafo e emite um run por trecho de mesma formatação.
+
+    O Markdown (com nl2br) quebra uma frase em vários nós de texto; sem o buffer cada nó
+    virava um ``w:r`` próprio, repetindo a mesma formatação. Quebras de linha entram no
+    run pendente (o python-docx as grava como ``w:br``).
+
+    ``content_segments`` conta os trechos com texto visível recebidos até agora: para saber
+    se um filho acrescentou conteúdo basta comparar o contador antes e depois, sem reler
+    ``paragraph.text``, que percorre todos os runs a cada chamada.
+    """
+
+    def __init__(self, doc: Document, paragraph) -> None:
+        self.doc = doc
+        self.paragraph = paragraph
+        # Último caractere do último run do parágrafo ('' sem runs ou após uma imagem)
+        self.tail = ''
+        self.content_segments = 0
+        self._pending: List[str] = []
+        self._state: Tuple[bool, bool, Optional[str]] = (False, False, None)
+
+    @property
+    def has_content(self) -> bool:
+        return self.content_segments > 0
+
+    def add_text(self, text: str, bold: bool = False, italic: bool = False, style_name: Optional[str] = None) -> None:
+        state = (bold, italic, style_name)
+        if self._pending and state != self._state:
+            self.flush()
+        self._state = state
+        self._pending.append(text)
+        if not text.isspace():
+            self.content_segments += 1
+        self.tail = text[-1]
+
+    def add_break(self) -> None:
+        if not self._pending:
+            self._state = (False, False, None)
+        self._pending.append('\n')
+        self.tail = '\n'
+
+    def add_image(self, img_tag, content_width_inches: float) -> None:
+        self.flush()
+        if _add_image_to_paragraph(self.paragraph, img_tag, content_width_inches):
+            self.tail = ''
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        bold, italic, style_name = self._state
+        run = self.paragraph.add_run(''.join(self._pending))
+        if style_name:
+            run._r.style = _docx_style(self.doc, style_name).style_id
+        if bold:
+            run.bold = True
+        if italic:
+            run.italic = True
+        self._pending = []
 
 
 def _add_runs(
     doc: Document,
-    paragraph,
+    runs: _RunBuilder,
     node,
     content_width_inches: float,
     bold: bool = False,
     italic: bool = False,
     code_context: bool = False,
 ) -> None:
-    if isinstance(node, NavigableString):
+    if isinstance(node, str):
         raw_text = str(node)
         if not raw_text:
             return
@@ -1664,31 +5291,18 @@ def _add_runs(
             text = _normalize_inline_whitespace(raw_text)
             if not text:
                 return
-            if text == ' ':
-                if not paragraph.runs:
-                    return
-                previous = paragraph.runs[-1].text or ''
-                if not previous or previous[-1].isspace():
-                    return
-
-        run = paragraph.add_run(text)
-        run.bold = bold
-        run.italic = italic
-        if code_context:
-            run.font.name = 'Consolas'
-            run.font.size = Pt(9.5)
-            run.font.color.rgb = RGBColor(45, 45, 45)
-        else:
-            run.font.name = 'Calibri'
-            run.font.size = Pt(11)
+            if text == ' ' and (not runs.tail or runs.tail.isspace()):
+                return
+
+        runs.add_text(text, bold, italic, 'Captura Código Inline' if code_context else None)
         return
 
-    if not isinstance(node, Tag):
+    if not isinstance(node, _ELEMENT_TYPES):
         return
 
     name = (node.name or '').lower()
     if name == 'br':
-        paragraph.add_run().add_break()
+        runs.add_break()
         return
 
     if name == 'figure':
@@ -1696,7 +5310,7 @@ def _add_runs(
         return
 
     if name == 'img':
-        _add_image_to_paragraph(paragraph, node, content_width_inches)
+        runs.add_image(node, content_width_inches)
         return
 
     if name in {'ul', 'ol'}:
@@ -1708,20 +5322,15 @@ def _add_runs(
         if '\n' in code_text:
             cleaned = _extract_code_block_text(code_text)
             if cleaned:
-                if paragraph.runs:
-                    previous_text = paragraph.runs[-1].text or ''
-                    if previous_text and not previous_text.endswith('\n'):
-                        paragraph.add_run().add_break()
-                run = paragraph.add_run(cleaned.replace('\t', '    '))
-                run.font.name = 'Consolas'
-                run.font.size = Pt(9.5)
-                run.font.color.rgb = RGBColor(45, 45, 45)
-                paragraph.add_run().add_break()
+                if runs.tail and runs.tail != '\n':
+                    runs.add_break()
+                runs.add_text(cleaned.replace('\t', '    '), style_name='Captura Código Inline')
+                runs.add_break()
             return
         for child in node.children:
             _add_runs(
                 doc,
-                paragraph,
+                runs,
                 child,
                 content_width_inches,
                 bold=bold,
@@ -1733,13 +5342,7 @@ def _add_runs(
     if name == 'a':
         link_text = node.get_text(' ', strip=True)
         if link_text:
-            run = paragraph.add_run(link_text)
-            run.bold = bold
-            run.italic = italic
-            run.underline = True
-            run.font.name = 'Calibri'
-            run.font.size = Pt(11)
-            run.font.color.rgb = RGBColor(5, 99, 193)
+            runs.add_text(link_text, bold, italic, 'Captura Link')
         return
 
     next_bold = bold or name in {'strong', 'b'}
@@ -1748,7 +5351,7 @@ def _add_runs(
     for child in node.children:
         _add_runs(
             doc,
-            paragraph,
+            runs,
             child,
             content_width_inches,
             bold=next_bold,
@@ -1758,89 +5361,63 @@ def _add_runs(
 
 
 def _add_list(doc: Document, list_tag: Tag, ordered: bool, content_width_inches: float, level: int = 0) -> None:
-    style_name = 'Normal' if ordered else 'List Bullet'
-    base_indent = 22
-    indent_step = 16
+    style_name = _list_style_name('Lista Numerada' if ordered else 'Lista', level)
 
     for item_index, item in enumerate(list_tag.find_all('li', recursive=False), start=1):
-        meaningful_children = [child for child in item.children if not (isinstance(child, NavigableString) and not str(child).strip())]
-        if len(meaningful_children) == 1 and isinstance(meaningful_children[0], Tag) and (meaningful_children[0].name or '').lower() == 'figure':
+        meaningful_children = [child for child in item.children if not (isinstance(child, str) and not str(child).strip())]
+        if len(meaningful_children) == 1 and isinstance(meaningful_children[0], _ELEMENT_TYPES) and (meaningful_children[0].name or '').lower() == 'figure':
             _add_figure(doc, meaningful_children[0], content_width_inches)
             continue
 
-        paragraph = doc.add_paragraph(style=style_name)
+        paragraph = _add_styled_paragraph(doc, style_name)
+        if level >= LIST_STYLE_LEVELS:
+            paragraph.paragraph_format.left_indent = Pt(LIST_BASE_INDENT_PT + level * LIST_INDENT_STEP_PT)
+        runs = _RunBuilder(doc, paragraph)
         has_inline_content = False
 
         if ordered:
-            marker_run = paragraph.add_run(f"{item_index}. ")
-            marker_run.font.name = 'Calibri'
-            marker_run.font.size = Pt(11)
-
-        paragraph.paragraph_format.left_indent = Pt(base_indent + level * indent_step)
-        paragraph.paragraph_format.first_line_indent = Pt(0)
-        paragraph.paragraph_format.space_before = Pt(2)
-        paragraph.paragraph_format.space_after = Pt(4 if level == 0 else 2)
-        paragraph.paragraph_format.line_spacing = 1.12
+            runs.add_text(f"{item_index}. ")
 
         for child in item.children:
-            if isinstance(child, NavigableString):
-                before_text = paragraph.text
-                _add_runs(doc, paragraph, child, content_width_inches)
-                if paragraph.text != before_text:
-                    text_delta = paragraph.text[len(before_text):]
-                    if _normalize_inline_whitespace(text_delta).strip():
-                        has_inline_content = True
-                continue
-
-            if not isinstance(child, Tag):
+            if isinstance(child, _ELEMENT_TYPES):
+                child_name = (child.name or '').lower()
+                if child_name in {'ul', 'ol'}:
+                    _add_list(doc, child, ordered=(child_name == 'ol'), content_width_inches=content_width_inches, level=level + 1)
+                    continue
+                if child_name == 'p':
+                    if any(_is_multiline_code_tag(grandchild) for grandchild in child.children):
+                        _add_list_paragraph_with_code_blocks(
+                            doc,
+                            runs,
+                            child,
+                            content_width_inches,
+                            level,
+                        )
+                        has_inline_content = has_inline_content or runs.has_content
+                        continue
+                    if has_inline_content:
+                        runs.add_break()
+            elif not isinstance(child, str):
                 continue
 
-            child_name = (child.name or '').lower()
-            if child_name in {'ul', 'ol'}:
-                _add_list(doc, child, ordered=(child_name == 'ol'), content_width_inches=content_width_inches, level=level + 1)
-            elif child_name == 'p':
-                if any(_is_multiline_code_tag(grandchild) for grandchild in child.children):
-                    _add_list_paragraph_with_code_blocks(
-                        doc,
-                        paragraph,
-                        child,
-                        content_width_inches,
-                        level,
-                        base_indent,
-                        indent_step,
-                    )
-                    has_inline_content = has_inline_content or bool(paragraph.text.strip())
-                else:
-                    if has_inline_content:
-                        paragraph.add_run().add_break()
-                    before_text = paragraph.text
-                    _add_runs(doc, paragraph, child, content_width_inches)
-                    if paragraph.text != before_text:
-                        text_delta = paragraph.text[len(before_text):]
-                        if _normalize_inline_whitespace(text_delta).strip():
-                            has_inline_content = True
-            else:
-                before_text = paragraph.text
-                _add_runs(doc, paragraph, child, content_width_inches)
-                if paragraph.text != before_text:
-                    text_delta = paragraph.text[len(before_text):]
-                    if _normalize_inline_whitespace(text_delta).strip():
-                        has_inline_content = True
+            before_segments = runs.content_segments
+            _add_runs(doc, runs, child, content_width_inches)
+            if runs.content_segments != before_segments:
+                has_inline_content = True
 
+        runs.flush()
         if ordered:
             if not has_inline_content:
                 parent = paragraph._element.getparent()
                 if parent is not None:
                     parent.remove(paragraph._element)
-        elif not paragraph.text.strip():
+        elif not runs.has_content:
             parent = paragraph._element.getparent()
             if parent is not None:
                 parent.remove(paragraph._element)
 
     if level == 0:
-        spacer = doc.add_paragraph()
-        spacer.paragraph_format.space_before = Pt(0)
-        spacer.paragraph_format.space_after = Pt(2)
+        _add_styled_paragraph(doc, 'Captura Espaçador Lista')
 
 
 def _add_figure(doc: Document, figure_tag: Tag, content_width_inches: float) -> None:
@@ -1853,17 +5430,11 @@ def _add_figure(doc: Document, figure_tag: Tag, content_width_inches: float) ->
         print(f"[AVISO] Figura não encontrada para inserção no DOCX: {src}")
         return
 
-    paragraph = doc.add_paragraph()
-    paragraph.style = doc.styles['Normal']
-    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    paragraph.paragraph_format.left_indent = Pt(0)
-    paragraph.paragraph_format.first_line_indent = Pt(0)
-    paragraph.paragraph_format.space_before = Pt(6)
-    paragraph.paragraph_format.space_after = Pt(2)
+    paragraph = _add_styled_paragraph(doc, 'Captura Figura')
     run = paragraph.add_run()
     width_inches = _parse_length_from_attr(img.get('width'))
     height_inches = _parse_length_from_attr(img.get('height'))
-    max_width_inches = max(content_width_inches - 0.4, 1.0)
+    max_width_inches = max(content_width_inches - FIGURE_SIDE_MARGIN_INCHES, 1.0)
     resolved_path = None
     try:
         resolved_path = img_path.resolve()
@@ -1941,32 +5512,16 @@ def _add_figure(doc: Document, figure_tag: Tag, content_width_inches: float) ->
         doc._figure_counter += 1  # type: ignore[attr-defined]
         caption_prefix = f"Figura {doc._figure_counter:02d} – "  # type: ignore[attr-defined]
 
-        caption_para = doc.add_paragraph()
-        try:
-            caption_para.style = doc.styles['Caption']
-        except KeyError:
-            caption_para.style = doc.styles['Normal']
-        caption_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        caption_para.paragraph_format.left_indent = Pt(0)
-        caption_para.paragraph_format.first_line_indent = Pt(0)
-        caption_para.paragraph_format.space_before = Pt(1)
-        caption_para.paragraph_format.space_after = Pt(6)
-
-        caption_run_label = caption_para.add_run(caption_prefix)
-        caption_run_label.bold = True
-        caption_run_label.font.name = 'Calibri'
-        caption_run_label.font.size = Pt(9)
-
-        caption_run_text = caption_para.add_run(caption_text)
-        caption_run_text.italic = True
-        caption_run_text.font.name = 'Calibri'
-        caption_run_text.font.size = Pt(9)
+        caption_para = _add_styled_paragraph(doc, 'Caption')
+        caption_para.add_run(caption_prefix).bold = True
+        caption_para.add_run(caption_text).italic = True
 
 
-def _add_table_from_tag(doc: Document, table_tag: Tag, content_width_inches: float) -> None:
+def _table_rows(table_tag: Tag) -> Optional[Tuple[List[List[Any]], int, set]]:
+    """Células de cada linha, número de colunas e linhas de cabeçalho (com algum ``th``)."""
     rows = table_tag.find_all('tr')
     if not rows:
-        return
+        return None
 
     parsed_rows = []
     max_cols = 0
@@ -1976,53 +5531,83 @@ def _add_table_from_tag(doc: Document, table_tag: Tag, content_width_inches: flo
         max_cols = max(max_cols, len(cells))
 
     if max_cols == 0:
-        return
+        return None
 
     header_rows = {
         idx
         for idx, cells in enumerate(parsed_rows)
         if any((cell.name or '').lower() == 'th' for cell in cells)
     }
+    return parsed_rows, max_cols, header_rows
 
-    docx_table = doc.add_table(rows=len(parsed_rows), cols=max_cols)
-    docx_table.style = 'Table Grid'
-    docx_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    docx_table.autofit = True
 
-    column_width = Inches(max((content_width_inches - 0.2) / max_cols, 1.0))
-    for col in docx_table.columns:
-        for cell in col.cells:
-            cell.width = column_width
-            cell.vertical_alignment = WD_ALIGN_VERTICAL.TOP
+def _add_table_from_tag(doc: Document, table_tag: Tag, content_width_inches: float) -> None:
+    """Monta o ``w:tbl`` numa passada, copiando ``tcPr``/``pPr`` de modelos por tipo de célula.
 
+    Equivale a doc.add_table() + largura/alinhamento por coluna + doc_table.cell(r, c), mas sem
+    os acessos por índice do python-docx, que reprocessam a grade a cada célula.
+    """
+    parsed = _table_rows(table_tag)
+    if parsed is None:
+        return
+    parsed_rows, max_cols, header_rows = parsed
+
+    # Mesma grade que doc.add_table(): largura útil da última seção dividida entre as colunas
+    section = doc.sections[-1]
+    grid_width = Emu((section.page_width - section.left_margin - section.right_margin) // max_cols).twips
+    cell_width = Inches(max((content_width_inches - 0.2) / max_cols, 1.0)).twips
+    table_style_id = _docx_style(doc, 'Table Grid').style_id
+    grid_cols = f'<w:gridCol w:w="{grid_width}"/>' * max_cols
+    tbl = parse_xml(
+        f'<w:tbl {nsdecls("w")}><w:tblPr>'
+        f'<w:tblStyle w:val="{table_style_id}"/><w:tblW w:type="auto" w:w="0"/>'
+        '<w:jc w:val="center"/><w:tblLayout w:type="autofit"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+        'w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+        f'</w:tblPr><w:tblGrid>{grid_cols}</w:tblGrid>'
+        '<w:tr><w:tc>'
+        f'<w:tcPr><w:tcW w:type="dxa" w:w="{cell_width}"/><w:vAlign w:val="top"/></w:tcPr>'
+        f'<w:tcPr><w:tcW w:type="dxa" w:w="{cell_width}"/><w:vAlign w:val="top"/>'
+        '<w:shd w:val="clear" w:color="auto" w:fill="EAF2FB"/></w:tcPr>'
+        f'<w:pPr><w:pStyle w:val="{_docx_style(doc, "Captura Tabela").style_id}"/></w:pPr>'
+        f'<w:pPr><w:pStyle w:val="{_docx_style(doc, "Captura Tabela Cabeçalho").style_id}"/></w:pPr>'
+        '</w:tc></w:tr></w:tbl>'
+    )
+    # Os modelos nascem dentro da própria tabela (mesmo documento lxml, sem xmlns repetido)
+    template_row = tbl[-1]
+    cell_tc_pr, header_tc_pr, cell_p_pr, header_p_pr = list(template_row[0])
+    tbl.remove(template_row)
+    # Inserida antes de preencher: figuras e listas dentro de células continuam saindo logo após a tabela
+    doc.element.body._insert_tbl(tbl)
+
+    tr_tag, tc_tag, p_tag = qn('w:tr'), qn('w:tc'), qn('w:p')
     for r_idx, cells in enumerate(parsed_rows):
+        tr = etree.SubElement(tbl, tr_tag)
         for c_idx in range(max_cols):
-            cell = docx_table.cell(r_idx, c_idx)
-            paragraph = cell.paragraphs[0]
-            paragraph.text = ''
-            paragraph.paragraph_format.space_before = Pt(1)
-            paragraph.paragraph_format.space_after = Pt(1)
-            paragraph.paragraph_format.line_spacing = 1.08
-            if c_idx < len(cells):
-                content = cells[c_idx]
-                is_header = (content.name or '').lower() == 'th' or r_idx in header_rows
-                if is_header:
-                    _set_cell_background(cell, 'EAF2FB')
-                _add_runs(doc, paragraph, content, content_width_inches, bold=is_header)
+            tc = etree.SubElement(tr, tc_tag)
+            content = cells[c_idx] if c_idx < len(cells) else None
+            is_header = content is not None and ((content.name or '').lower() == 'th' or r_idx in header_rows)
+            # Negrito do cabeçalho vem do estilo, não de cada run
+            tc.append(deepcopy(header_tc_pr if is_header else cell_tc_pr))
+            p = etree.SubElement(tc, p_tag)
+            p.append(deepcopy(header_p_pr if is_header else cell_p_pr))
+            if content is not None:
+                cell_runs = _RunBuilder(doc, Paragraph(p, doc))
+                _add_runs(doc, cell_runs, content, content_width_inches)
+                cell_runs.flush()
 
     doc.add_paragraph()
 
 
 def _add_html_content(doc: Document, nodes, content_width_inches: float) -> None:
     for child in nodes:
-        if isinstance(child, NavigableString):
+        if isinstance(child, str):
             text = _normalize_inline_whitespace(str(child)).strip()
             if text:
-                paragraph = doc.add_paragraph(text)
-                paragraph.paragraph_format.space_after = Pt(6)
+                doc.add_paragraph(text)
             continue
 
-        if not isinstance(child, Tag):
+        if not isinstance(child, _ELEMENT_TYPES):
             continue
 
         name = (child.name or '').lower()
@@ -2044,10 +5629,9 @@ def _add_html_content(doc: Document, nodes, content_width_inches: float) -> None
                 _add_mixed_paragraph_with_code_blocks(doc, child, content_width_inches)
                 continue
 
-            paragraph = _new_body_paragraph(doc)
-            _add_runs(doc, paragraph, child, content_width_inches)
-            if not paragraph.text.strip():
-                _remove_paragraph(paragraph)
+            runs = _RunBuilder(doc, _new_body_paragraph(doc))
+            _add_runs(doc, runs, child, content_width_inches)
+            _close_paragraph_runs(runs)
             continue
 
         if name in {'h2', 'h3', 'h4', 'h5', 'h6'}:
@@ -2055,19 +5639,8 @@ def _add_html_content(doc: Document, nodes, content_width_inches: float) -> None
             if not heading_text:
                 continue
             level = int(name[1])
-            paragraph = doc.add_paragraph()
-            heading_style_name = f'Heading {min(level, 4)}'
-            try:
-                paragraph.style = doc.styles[heading_style_name]
-            except KeyError:
-                paragraph.style = doc.styles['Normal']
-            paragraph.paragraph_format.space_before = Pt(10 if level == 2 else 7)
-            paragraph.paragraph_format.space_after = Pt(4)
-            paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-            run = paragraph.add_run(heading_text)
-            run.bold = True
-            run.font.name = 'Calibri'
-            run.font.size = Pt({2: 13, 3: 12, 4: 11, 5: 11, 6: 11}.get(level, 11))
+            # h5/h6 usam Heading 4: mesmo tamanho e espaçamento, definidos em _define_docx_styles
+            _add_styled_paragraph(doc, f'Heading {min(level, 4)}', heading_text)
             continue
 
         if name == 'ul':
@@ -2087,11 +5660,9 @@ def _add_html_content(doc: Document, nodes, content_width_inches: float) -> None
             continue
 
         if name == 'blockquote':
-            paragraph = doc.add_paragraph()
-            paragraph.paragraph_format.left_indent = Pt(18)
-            paragraph.paragraph_format.line_spacing = 1.12
-            paragraph.paragraph_format.space_after = Pt(6)
-            _add_runs(doc, paragraph, child, content_width_inches)
+            runs = _RunBuilder(doc, _add_styled_paragraph(doc, 'Captura Citação'))
+            _add_runs(doc, runs, child, content_width_inches)
+            runs.flush()
             continue
 
         if name == 'hr':
@@ -2296,6 +5867,11 @@ def main(
     inline_artifact_markers: bool = False,
     asset_paths_from_md: bool = False,
     asset_base_dir: Optional[Path] = None,
+    frame_options: Optional[FrameExtractionOptions] = None,
+    docx_engine: Optional[str] = None,
+    use_docx_cache: bool = True,
+    streaming_docx: Optional[bool] = None,
+    use_diagram_cache: bool = True,
 ) -> int:
     ensure_dirs()
     # Redireciona stdout textual para stderr para evitar poluir o fluxo binário do DOCX
@@ -2321,9 +5897,8 @@ def main(
         md_bytes = sys.stdin.buffer.read()
         md_text = md_bytes.decode('utf-8', errors='replace')  # Substituir caracteres inválidos
 
-    md_text = clean_text(md_text)
-    md_text = _normalize_nested_list_markdown(md_text)
-    if not md_text.strip():
+    prepared = preprocess_markdown(md_text, inline_artifact_markers)
+    if prepared.empty:
         if md_source_path is not None:
             print(f"[ERRO] Arquivo MD vazio: {md_source_path}")
         else:
@@ -2350,32 +5925,40 @@ def main(
     resolve_from_md = asset_paths_from_md or (inline_artifact_markers and md_source_path is not None)
     _configure_asset_search_roots(md_source_path, resolve_from_md, asset_base_dir)
 
-    if inline_artifact_markers:
-        md_text = _replace_inline_artifact_markers(md_text)
-    
+    print(
+        f"[DEBUG] Markdown pré-processado em {prepared.elapsed_ms:.1f} ms: {len(prepared.occurrences)} print(s), "
+        f"{len(prepared.mermaid_blocks)} diagrama(s), {len(prepared.inline_artifacts)} artefato(s) inline"
+    )
+
     # Vídeo é opcional - se não existir, prints não serão extraídos
     video_available = VIDEO_FILE.exists() if _VIDEO_ENV else False
 
-    md_processed, occurrences = replace_print_placeholders(md_text)
-    md_processed, mermaid_paths = replace_mermaid_blocks(md_processed)
+    md_processed, occurrences = prepared.text, prepared.occurrences
+    mermaid_paths = render_mermaid_blocks(
+        prepared.mermaid_blocks,
+        get_diagram_cache() if use_diagram_cache else None,
+    )
 
     # Extrai frames apenas se vídeo disponível
     if video_available:
-        for occurrence in occurrences:
-            seconds = parse_timestamp_to_seconds(occurrence.timestamp)
-            ok = extract_frame(VIDEO_FILE, seconds, occurrence.image_path, coords=occurrence.coords)
-            if not ok:
-                print(f"[AVISO] Falha ao capturar {occurrence.timestamp}. Placeholder gerado.")
+        frame_options = frame_options or build_frame_extraction_options()
+        extraction_results = extract_print_frames(VIDEO_FILE, occurrences, frame_options)
+        for result in extraction_results:
+            if not result.ok:
+                print(f"[AVISO] Falha ao capturar {result.timestamp}. Placeholder gerado.")
+        _print_frame_extraction_report(extraction_results, frame_options)
+        dedupe_print_images(occurrences, extraction_results, frame_options.dedup_threshold)
     elif occurrences:
         print(f"[AVISO] Vídeo não disponível. {len(occurrences)} placeholder(s) de print não serão preenchidos com imagens.")
 
     if mermaid_paths:
         print(f"[OK] {len(mermaid_paths)} diagrama(s) Mermaid disponível(is) em: {DIAGRAMS_DIR}")
 
-    # Converte markdown para HTML intermediário e monta BeautifulSoup para processar no DOCX
-    html_body_raw = markdown(md_processed, extensions=['extra', 'fenced_code', 'tables', 'sane_lists', 'toc', 'nl2br'])
-    soup = BeautifulSoup(html_body_raw, 'html.parser')
-    inject_print_figures(soup, occurrences)
+    # Engine "html": markdown -> HTML -> BeautifulSoup; engine "ast": árvore direta do Markdown
+    docx_engine = resolve_docx_engine(docx_engine)
+    tree_started = time.perf_counter()
+    soup = build_docx_tree(md_processed, occurrences, docx_engine)
+    print(f"[DEBUG] Árvore do documento (engine {docx_engine}) montada em {(time.perf_counter() - tree_started) * 1000:.1f} ms")
 
     first_h1 = soup.find('h1')
     title_text = "Documento"
@@ -2402,6 +5985,26 @@ def main(
     print(f"[DEBUG] Separator: {separator_path}")
     print(f"[DEBUG] Footer banner: {footer_banner_path}")
 
+    if streaming_docx is None:
+        streaming_docx = _env_int("DOCX_STREAMING", 0) > 0
+    if streaming_docx:
+        # Pacote escrito direto no stdout original, sem BytesIO intermediário
+        written = write_docx_streaming(
+            soup,
+            metadata=metadata,
+            logo_path=logo_path,
+            separator_path=separator_path,
+            footer_banner_path=footer_banner_path,
+            destination=orig_out_buffer,
+            fragment_cache=get_docx_cache() if use_docx_cache else None,
+        )
+        if written is None:
+            print('[AVISO] Falha ao gerar DOCX automaticamente.')
+            return 1
+        orig_out_buffer.flush()
+        print(f"[OK] Documento DOCX gerado em streaming ({written} bytes)")
+        return 0
+
     docx_bytes = build_docx(
         soup,
         metadata=metadata,
@@ -2409,6 +6012,7 @@ def main(
         separator_path=separator_path,
         footer_banner_path=footer_banner_path,
         output_path=None,  # Não salvar em arquivo
+        fragment_cache=get_docx_cache() if use_docx_cache else None,
     )
     if docx_bytes is None:
         print('[AVISO] Falha ao gerar DOCX automaticamente.')
@@ -2425,8 +6029,573 @@ def main(
     return 0
 
 
+def _synthetic_markdown(sections: int) -> str:
+    """Documento sintético no formato gerado pela IA (prints, listas aninhadas, mermaid, tabelas)."""
+    parts = ["# IT.FIN.01 - Documento sintético\n\n"]
+    for i in range(sections):
+        parts.append(
+            f"## Etapa {i + 1}\n\n"
+            f"1. Abrir o sistema [PRINT DO VÍDEO - 00:{(i // 60) % 60:02d}:{i % 60:02d}: tela {i}] {{x=100, y=200}}\n"
+            f"  - Conferir o campo **Empresa** e o código `FIN-{i}` <<imgs/campo_{i}.png>>\n"
+            f"  - Registrar a evidência ![Evidência {i}] <<imgs/evidencia_{i}.png>>\n"
+            "2. Validar a ação e a informação exibida\x07 na tela\n"
+            f"3. {'Descrição detalhada do procedimento operacional. ' * 8}\n\n"
+            "```mermaid\n"
+            f"flowchart TD\n    A([Início {i}]) --> B{{Validar}}\n    B --> C[Concluir]\n"
+            "```\n\n"
+            "| Campo | Valor |\n|---|---|\n"
+            f"| Conta | {1000 + i} |\n| Status | Conciliado |\n\n"
+        )
+    return ''.join(parts)
+
+
+def _best_of(runs: int, func) -> Tuple[float, Any]:
+    best = float('inf')
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def _benchmark_preprocess(sections: int) -> int:
+    """Compara preprocess_markdown() com a sequência anterior de passadas sobre o texto."""
+    md_text = _synthetic_markdown(sections)
+
+    def legacy_chain() -> Tuple[str, List[PrintOccurrence]]:
+        text = ''.join(c for c in md_text if ord(c) >= 32 or c in '\n\t\r')
+        text = unicodedata.normalize('NFC', text)
+        text = text.encode('utf-8', errors='replace').decode('utf-8')
+        text = _normalize_nested_list_markdown(text)
+        text = _replace_inline_artifact_markers(text)
+        text, occurrences = replace_print_placeholders(text)
+        counter = iter(range(1, sections + 2))
+        text = MERMAID_BLOCK_PATTERN.sub(
+            lambda match: _mermaid_figure_html(f"diagram_{next(counter):02d}.png"), text,
+        )
+        return text, occurrences
+
+    legacy_ms, (legacy_text, legacy_occurrences) = _best_of(3, legacy_chain)
+    single_ms, prepared = _best_of(3, lambda: preprocess_markdown(md_text, inline_artifact_markers=True))
+    same = legacy_text == prepared.text and legacy_occurrences == prepared.occurrences
+    print(
+        f"[BENCH] preprocess: {sections} seção(ões), {len(md_text) / 1024:.0f} KB | "
+        f"passadas separadas {legacy_ms:.1f} ms | passada única {single_ms:.1f} ms | "
+        f"{legacy_ms / max(single_ms, 1e-6):.1f}x | saída idêntica: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+def _benchmark_docx_engine(sections: int) -> int:
+    """Compara as engines html e ast (árvore, build_docx() completo, pico de memória e document.xml)."""
+    global ASSET_SEARCH_ROOTS
+    prepared = preprocess_markdown(_synthetic_markdown(sections), inline_artifact_markers=True)
+    metadata = load_metadata("Documento sintético")
+    # Imagens sintéticas não existem: sem raízes de busca (evita rglob) e sem os avisos de arquivo ausente
+    ASSET_SEARCH_ROOTS = []
+    results: Dict[str, Tuple[float, float, int, bytes]] = {}
+    for engine in DOCX_ENGINES:
+        ASSET_RESOLVE_CACHE.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tree_ms, tree = _best_of(3, lambda: build_docx_tree(prepared.text, prepared.occurrences, engine))
+            started = time.perf_counter()
+            docx_bytes = build_docx(tree, metadata, None, None, None)
+            total_ms = tree_ms + (time.perf_counter() - started) * 1000
+            del tree
+            tracemalloc.start()
+            build_docx_tree(prepared.text, prepared.occurrences, engine)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        with zipfile.ZipFile(io.BytesIO(docx_bytes or b'')) as archive:
+            results[engine] = (tree_ms, total_ms, peak, archive.read('word/document.xml'))
+
+    for engine, (tree_ms, total_ms, peak, _) in results.items():
+        print(
+            f"[BENCH] docx-engine {engine}: {sections} seção(ões) | árvore {tree_ms:.0f} ms "
+            f"(pico {peak / 2**20:.1f} MB) | total com build_docx {total_ms:.0f} ms"
+        )
+    same = results["html"][3] == results["ast"][3]
+    print(
+        f"[BENCH] docx-engine: árvore {results['html'][0] / max(results['ast'][0], 1e-6):.1f}x mais rápida, "
+        f"pico {results['html'][2] / max(results['ast'][2], 1):.1f}x menor | "
+        f"document.xml idêntico: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+def _benchmark_docx_cache(sections: int) -> int:
+    """Revisão de uma linha com o cache de seções: build frio, incremental e sem mudanças."""
+    global ASSET_SEARCH_ROOTS
+    md_text = _synthetic_markdown(sections)
+    revised_text = md_text.replace("Validar a ação e a informação exibida", "Validar a ação revisada", 1)
+    metadata = load_metadata("Documento sintético")
+    ASSET_SEARCH_ROOTS = []
+
+    def parse(text: str) -> BeautifulSoup:
+        prepared = preprocess_markdown(text, inline_artifact_markers=True)
+        return build_docx_tree(prepared.text, prepared.occurrences)
+
+    def build(text: str, cache: Optional[DocxFragmentCache]) -> bytes:
+        return build_docx(parse(text), metadata, None, None, None, fragment_cache=cache) or b''
+
+    def document_xml(docx_bytes: bytes) -> bytes:
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+            return archive.read('word/document.xml')
+
+    with tempfile.TemporaryDirectory(prefix="captura_docx_bench_") as tmp_dir:
+        cache = DocxFragmentCache(Path(tmp_dir), 1 << 40)
+        with contextlib.redirect_stdout(io.StringIO()):
+            full_ms, _ = _best_of(1, lambda: build(md_text, None))
+            cold_ms, _ = _best_of(1, lambda: build(md_text, cache))
+            incremental_ms, incremental = _best_of(1, lambda: build(revised_text, cache))
+            unchanged_ms, unchanged = _best_of(1, lambda: build(revised_text, cache))
+            # Markdown -> HTML -> árvore roda em toda execução (as chaves das seções saem da árvore)
+            parse_ms, _ = _best_of(3, lambda: parse(revised_text))
+            reference = build(revised_text, None)
+
+    same = document_xml(incremental) == document_xml(reference) and unchanged == incremental
+    print(
+        f"[BENCH] docx-cache: {sections} seção(ões) | sem cache {full_ms:.0f} ms | frio {cold_ms:.0f} ms | "
+        f"1 linha alterada {incremental_ms:.0f} ms ({full_ms / max(incremental_ms, 1e-6):.1f}x) | "
+        f"inalterado {unchanged_ms:.0f} ms | Markdown->árvore (em toda execução) {parse_ms:.0f} ms | "
+        f"document.xml idêntico ao build completo: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+def _benchmark_docx_streaming(sections: int) -> int:
+    """Pico de memória do build_docx() em memória contra o StreamingDocxWriter, com um print por seção."""
+    global ASSET_SEARCH_ROOTS
+    metadata = load_metadata("Documento sintético")
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory(prefix="captura_stream_bench_") as tmp_dir:
+        work_dir = Path(tmp_dir)
+        (work_dir / "imgs").mkdir()
+        parts = []
+        for i in range(sections):
+            noise = rng.integers(0, 256, size=(400, 640, 3), dtype=np.uint8)
+            cv2.imwrite(str(work_dir / "imgs" / f"print_{i}.jpg"), noise, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+            parts.append(
+                f"## Etapa {i + 1}\n\n{'Texto do procedimento. ' * 20}\n\n"
+                f"![Tela {i}](imgs/print_{i}.jpg)\n\n- Item A {i}\n- Item B {i}\n\n"
+            )
+        tree_text = ''.join(parts)
+        ASSET_SEARCH_ROOTS = [work_dir]
+        ASSET_RESOLVE_CACHE.clear()
+        image_mb = sum(path.stat().st_size for path in (work_dir / "imgs").iterdir()) / 2**20
+
+        def measure(func) -> Tuple[float, int]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                tracemalloc.start()
+                started = time.perf_counter()
+                func()
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            return elapsed_ms, peak
+
+        def in_memory() -> None:
+            docx_bytes = build_docx(build_docx_tree(tree_text, []), metadata, None, None, None)
+            (work_dir / "memoria.docx").write_bytes(docx_bytes or b'')
+
+        def streaming() -> None:
+            with (work_dir / "streaming.docx").open('wb') as destination:
+                write_docx_streaming(build_docx_tree(tree_text, []), metadata, None, None, None, destination)
+
+        memory_ms, memory_peak = measure(in_memory)
+        stream_ms, stream_peak = measure(streaming)
+        with zipfile.ZipFile(work_dir / "memoria.docx") as left, zipfile.ZipFile(work_dir / "streaming.docx") as right:
+            same = sorted(left.namelist()) == sorted(right.namelist()) and all(
+                left.read(name) == right.read(name) for name in left.namelist()
+            )
+
+    print(
+        f"[BENCH] docx-streaming: {sections} seção(ões), {image_mb:.0f} MB de imagens | "
+        f"em memória {memory_ms:.0f} ms, pico {memory_peak / 2**20:.1f} MB | "
+        f"streaming {stream_ms:.0f} ms, pico {stream_peak / 2**20:.1f} MB | partes idênticas: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+def _synthetic_list_markdown(items: int) -> str:
+    """Lista numerada de passos RPA, cada um com fragmentos inline e sublistas em dois níveis."""
+    parts = ["## Procedimento\n\n"]
+    for i in range(items):
+        parts.append(
+            f"{i + 1}. Abrir a tela **{i}** e conferir o campo `FIN-{i}` com *atenção*  \n"
+            f"   o valor deve bater com o extrato\n"
+            f"   - Validar o [registro {i}](https://exemplo.local/{i}) e o **status**\n"
+            f"     - Anotar o código `C{i}` na planilha\n"
+        )
+    return ''.join(parts)
+
+
+def _synthetic_long_item_markdown(fragments: int) -> str:
+    """Um único item de lista com `fragments` trechos inline de formatação alternada."""
+    body = ' '.join(f"**campo {i}** valor `{i}` *obs*" for i in range(fragments))
+    return f"## Procedimento\n\n- {body}\n"
+
+
+def _benchmark_docx_lists(items: int) -> int:
+    """Escalonamento do renderizador de listas: tempo por item (listas aninhadas) e por fragmento inline."""
+    content_width_inches = _docx_content_width_inches()
+    ratios = []
+    for label, make_markdown in (('itens', _synthetic_list_markdown), ('fragmentos', _synthetic_long_item_markdown)):
+        per_unit = []
+        for size in (max(items // 4, 1), max(items // 2, 1), items):
+            tree = build_docx_tree(preprocess_markdown(make_markdown(size)).text, [])
+            nodes = list(tree.children)
+            # Document() e os estilos ficam fora da medição
+            docs = []
+            for _ in range(3):
+                doc = Document()
+                _define_docx_styles(doc)
+                docs.append(doc)
+            pending = iter(docs)
+            render_ms, _ = _best_of(3, lambda: _add_html_content(next(pending), nodes, content_width_inches))
+            per_unit.append(render_ms * 1000 / size)
+            print(f"[BENCH] docx-lists: {size} {label} | {render_ms:.0f} ms | {per_unit[-1]:.0f} µs por unidade")
+        ratios.append(per_unit[-1] / max(per_unit[0], 1e-6))
+        print(f"[BENCH] docx-lists: {label} | custo por unidade {ratios[-1]:.2f}x de 1/4 para o tamanho cheio")
+    # Linear: o custo por unidade não cresce com o tamanho (folga para ruído de medição)
+    linear = all(ratio < 1.5 for ratio in ratios)
+    print(f"[BENCH] docx-lists: escala linear: {'sim' if linear else 'NÃO'}")
+    return 0 if linear else 1
+
+
+def _synthetic_table_markdown(rows: int) -> str:
+    """Matriz de exceções: cabeçalho e `rows` linhas de 5 colunas, com negrito, código e link."""
+    parts = ["## Exceções\n\n", "| Código | Descrição | Ação | Responsável | Status |\n", "|---|---|---|---|---|\n"]
+    for i in range(rows):
+        parts.append(
+            f"| `EX-{i:04d}` | Divergência de **valor** na conta {1000 + i} | Reprocessar o "
+            f"[lançamento](https://exemplo.local/{i}) | Analista *{i % 7}* | {'Aberto' if i % 3 else 'Fechado'} |\n"
+        )
+    return ''.join(parts)
+
+
+def _benchmark_docx_table(rows: int) -> int:
+    """Compara a tabela montada numa passada com o caminho célula a célula via python-docx."""
+    content_width_inches = _docx_content_width_inches()
+    tree = build_docx_tree(preprocess_markdown(_synthetic_table_markdown(rows)).text, [])
+    table_tag = tree.find('table')
+
+    def cell_by_cell(doc: Document) -> None:
+        parsed_rows, max_cols, header_rows = _table_rows(table_tag)
+        docx_table = doc.add_table(rows=len(parsed_rows), cols=max_cols)
+        docx_table.style = 'Table Grid'
+        docx_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        docx_table.autofit = True
+        column_width = Inches(max((content_width_inches - 0.2) / max_cols, 1.0))
+        for col in docx_table.columns:
+            for cell in col.cells:
+                cell.width = column_width
+                cell.vertical_alignment = WD_ALIGN_VERTICAL.TOP
+        for r_idx, cells in enumerate(parsed_rows):
+            for c_idx in range(max_cols):
+                cell = docx_table.cell(r_idx, c_idx)
+                paragraph = cell.paragraphs[0]
+                paragraph.text = ''
+                paragraph._p.style = _docx_style(doc, 'Captura Tabela').style_id
+                if c_idx < len(cells):
+                    content = cells[c_idx]
+                    if (content.name or '').lower() == 'th' or r_idx in header_rows:
+                        paragraph._p.style = _docx_style(doc, 'Captura Tabela Cabeçalho').style_id
+                        _set_cell_background(cell, 'EAF2FB')
+                    cell_runs = _RunBuilder(doc, paragraph)
+                    _add_runs(doc, cell_runs, content, content_width_inches)
+                    cell_runs.flush()
+        doc.add_paragraph()
+
+    def body_xml(doc: Document) -> bytes:
+        body = deepcopy(doc.element.body)
+        # paragraph.text = '' deixava um w:r vazio em cada célula; a passada única não o cria
+        for run in body.iter(qn('w:r')):
+            if len(run) == 0:
+                run.getparent().remove(run)
+        return etree.tostring(body)
+
+    timings: Dict[str, float] = {}
+    outputs: Dict[str, bytes] = {}
+    for label, render in (
+        ('célula a célula', cell_by_cell),
+        ('passada única', lambda doc: _add_table_from_tag(doc, table_tag, content_width_inches)),
+    ):
+        # Documentos (página A4, estilos) ficam fora da medição
+        docs = []
+        for _ in range(3):
+            doc = Document()
+            doc.sections[0].page_width = Mm(PAGE_WIDTH_MM)
+            doc.sections[0].left_margin = Mm(PAGE_MARGIN_LEFT_MM)
+            doc.sections[0].right_margin = Mm(PAGE_MARGIN_RIGHT_MM)
+            _define_docx_styles(doc)
+            docs.append(doc)
+        pending = iter(docs)
+        timings[label], _ = _best_of(3, lambda: render(next(pending)))
+        outputs[label] = body_xml(docs[-1])
+
+    legacy_ms, single_ms = timings['célula a célula'], timings['passada única']
+    same = outputs['célula a célula'] == outputs['passada única']
+    print(
+        f"[BENCH] docx-table: {rows} linha(s) x 5 colunas | célula a célula {legacy_ms:.0f} ms | "
+        f"passada única {single_ms:.0f} ms | {legacy_ms / max(single_ms, 1e-6):.1f}x | "
+        f"XML idêntico: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+def _benchmark_print_dedup(size: int) -> int:
+    """
+    Caso de regressão da deduplicação: telas 1080p que diferem só num contador curto
+    (f59 x f89) nunca viram uma imagem só, nem no modo tolerante; a cópia idêntica sim.
+    """
+    height, width = 1080, 1920
+    base = np.full((height, width, 3), 235, dtype=np.uint8)
+    cv2.rectangle(base, (0, 0), (width, 60), (120, 80, 40), thickness=-1)
+    for row in range(12):
+        cv2.putText(
+            base, f"Linha {row + 1} da planilha de conciliação", (80, 140 + row * 60),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (40, 40, 40), 2, cv2.LINE_AA,
+        )
+
+    def frame_with(label: str):
+        frame = base.copy()
+        cv2.putText(frame, label, (1700, 1040), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 2, cv2.LINE_AA)
+        return frame
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for threshold in (PRINT_DEDUP_THRESHOLD, 0.001):
+            folder = Path(temp_dir) / f"t{threshold:g}"
+            folder.mkdir()
+            frames = [('00:00:02', frame_with("f59")), ('00:00:03', frame_with("f89")), ('00:00:04', frame_with("f89"))]
+            occurrences: List[PrintOccurrence] = []
+            results: List[FrameExtractionResult] = []
+            for index, (timestamp, frame) in enumerate(frames):
+                path = folder / f"frame_{index}.jpg"
+                _write_image_bgr(frame, path)
+                token = f"PRINT_SLOT_{index + 1}_TOKEN"
+                occurrences.append(PrintOccurrence(
+                    token=token, timestamp=timestamp, description='', image_path=path, coords=None,
+                ))
+                results.append(FrameExtractionResult(
+                    token=token, timestamp=timestamp, image_path=path, frame_index=index,
+                    ok=True, method='seek', elapsed_ms=0.0,
+                ))
+            dedupe_print_images(occurrences, results, threshold)
+            paths = [occ.image_path.name for occ in occurrences]
+            counter_kept = paths[0] != paths[1]
+            copy_merged = paths[2] == paths[1]
+            print(
+                f"[BENCH] print-dedup: limite {threshold:g} | contador alterado mantido: "
+                f"{'sim' if counter_kept else 'NÃO'} | cópia idêntica reaproveitada: {'sim' if copy_merged else 'NÃO'}"
+            )
+            failures += (not counter_kept) + (not copy_merged)
+    return 0 if failures == 0 else 1
+
+
+def _inline_named_styles(doc: Document) -> None:
+    """
+    Troca as referências aos estilos "Captura ..." por formatação direta em cada parágrafo
+    e run, como o renderizador fazia antes dos estilos nomeados (usado pelo benchmark).
+    Estilos internos do Word (títulos, legenda, listas) continuam referenciados.
+    """
+    from docx.text.run import Run  # type: ignore
+
+    style_by_id = {style.style_id: style for style in doc.styles}
+    normal = doc.styles['Normal']
+
+    def captura_chain(style_id: Optional[str]) -> Tuple[List[Any], Any]:
+        chain: List[Any] = []
+        style = style_by_id.get(style_id) if style_id else None
+        while style is not None and style.name.startswith('Captura'):
+            chain.append(style)
+            style = style.base_style
+        return chain, style
+
+    def first(chain: List[Any], getter: Callable[[Any], Any]) -> Any:
+        for style in chain:
+            value = getter(style)
+            if value is not None:
+                return value
+        return None
+
+    for p in list(doc.element.body.iter(qn('w:p'))):
+        paragraph = Paragraph(p, doc._body)
+        paragraph_chain, base_style = captura_chain(p.style)
+        if paragraph_chain:
+            # O renderizador anterior atribuía o estilo pelo objeto, com a varredura do python-docx
+            paragraph.style = base_style if base_style is not None else normal
+            paragraph_format = paragraph.paragraph_format
+            for attribute in (
+                'alignment', 'space_before', 'space_after', 'line_spacing',
+                'left_indent', 'right_indent', 'first_line_indent',
+            ):
+                if getattr(paragraph_format, attribute) is None:
+                    value = first(paragraph_chain, lambda style: getattr(style.paragraph_format, attribute))
+                    if value is not None:
+                        setattr(paragraph_format, attribute, value)
+            for tag in ('w:pBdr', 'w:shd'):
+                source = first(
+                    paragraph_chain,
+                    lambda style: style.element.pPr.find(qn(tag)) if style.element.pPr is not None else None,
+                )
+                p_pr = p.get_or_add_pPr()
+                if source is not None and p_pr.find(qn(tag)) is None:
+                    p_pr.append(deepcopy(source))
+
+        for r in list(p.iter(qn('w:r'))):
+            run_chain, _ = captura_chain(r.style)
+            chain = run_chain + paragraph_chain
+            if not chain:
+                continue
+            run = Run(r, paragraph)
+            if run_chain:
+                run.style = None
+            font = run.font
+            for attribute in ('name', 'size', 'bold', 'italic', 'underline'):
+                if getattr(font, attribute) is None:
+                    value = first(chain, lambda style: getattr(style.font, attribute))
+                    if value is not None:
+                        setattr(font, attribute, value)
+            if font.color.rgb is None:
+                color = first(chain, lambda style: style.font.color.rgb)
+                if color is not None:
+                    font.color.rgb = color
+
+
+def _docx_effective_formatting(docx_bytes: bytes) -> List[Tuple[Any, ...]]:
+    """Formatação efetiva (cadeia de estilos + direta) de cada parágrafo e run do corpo."""
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+        body = etree.fromstring(archive.read('word/document.xml')).find(qn('w:body'))
+        styles = etree.fromstring(archive.read('word/styles.xml'))
+    styles_by_id: Dict[str, Any] = {}
+    default_paragraph_style: Optional[str] = None
+    for style in styles.iter(qn('w:style')):
+        styles_by_id[style.get(qn('w:styleId'))] = style
+        if style.get(qn('w:type')) == 'paragraph' and style.get(qn('w:default')) in ('1', 'true'):
+            default_paragraph_style = style.get(qn('w:styleId'))
+    ignored = {qn('w:pStyle'), qn('w:rStyle'), qn('w:rPr')}
+
+    def merge(props: Dict[str, Dict[str, Any]], container) -> None:
+        if container is None:
+            return
+        for child in container:
+            if child.tag in ignored:
+                continue
+            entry = props.setdefault(child.tag, {})
+            entry.update(child.attrib)
+            if len(child):
+                entry['#'] = etree.tostring(child, method='c14n')
+
+    def style_props(style_id: Optional[str], tag: str) -> Dict[str, Dict[str, Any]]:
+        chain = []
+        while style_id in styles_by_id and len(chain) < 20:
+            style = styles_by_id[style_id]
+            chain.append(style)
+            based_on = style.find(qn('w:basedOn'))
+            style_id = based_on.get(qn('w:val')) if based_on is not None else None
+        props: Dict[str, Dict[str, Any]] = {}
+        for style in reversed(chain):
+            merge(props, style.find(qn(tag)))
+        return props
+
+    def frozen(props: Dict[str, Dict[str, Any]]) -> Tuple[Any, ...]:
+        return tuple(sorted((tag, tuple(sorted(attrs.items()))) for tag, attrs in props.items()))
+
+    paragraphs = []
+    for p in body.iter(qn('w:p')):
+        p_pr = p.find(qn('w:pPr'))
+        p_style = p_pr.find(qn('w:pStyle')) if p_pr is not None else None
+        style_id = p_style.get(qn('w:val')) if p_style is not None else default_paragraph_style
+        paragraph_props = style_props(style_id, 'w:pPr')
+        merge(paragraph_props, p_pr)
+        runs = []
+        for r in p.iter(qn('w:r')):
+            r_pr = r.find(qn('w:rPr'))
+            run_props = style_props(style_id, 'w:rPr')
+            r_style = r_pr.find(qn('w:rStyle')) if r_pr is not None else None
+            if r_style is not None:
+                for tag, attrs in style_props(r_style.get(qn('w:val')), 'w:rPr').items():
+                    run_props.setdefault(tag, {}).update(attrs)
+            merge(run_props, r_pr)
+            runs.append((''.join(t.text or '' for t in r.iter(qn('w:t'))), frozen(run_props)))
+        paragraphs.append((frozen(paragraph_props), tuple(runs)))
+    return paragraphs
+
+
+def _benchmark_docx_build(sections: int) -> int:
+    """Compara os estilos nomeados com a formatação direta em cada parágrafo e run (caminho anterior)."""
+    global ASSET_SEARCH_ROOTS
+    prepared = preprocess_markdown(_synthetic_markdown(sections), inline_artifact_markers=True)
+    metadata = load_metadata("Documento sintético")
+    ASSET_SEARCH_ROOTS = []
+    ASSET_RESOLVE_CACHE.clear()
+    tree = build_docx_tree(prepared.text, prepared.occurrences)
+    content_width_inches = _docx_content_width_inches()
+    nodes = list(tree.children)
+
+    def build(direct_formatting: bool) -> bytes:
+        doc = _new_document(metadata, None, None, None)
+        _add_html_content(doc, nodes, content_width_inches)
+        if direct_formatting:
+            _inline_named_styles(doc)
+        buf = io.BytesIO()
+        doc.save(buf)
+        return buf.getvalue()
+
+    timings: Dict[str, float] = {}
+    outputs: Dict[str, bytes] = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for label, direct_formatting in (('formatação direta', True), ('estilos nomeados', False)):
+            timings[label], outputs[label] = _best_of(3, lambda: build(direct_formatting))
+
+    summaries = []
+    for label, docx_bytes in outputs.items():
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+            document_xml = archive.read('word/document.xml')
+        counts = {
+            tag: document_xml.count(f"<w:{tag}>".encode()) + document_xml.count(f"<w:{tag} ".encode())
+            for tag in ('p', 'r', 'rPr', 'pPr')
+        }
+        summaries.append(
+            f"{label} {timings[label]:.0f} ms, document.xml {len(document_xml) / 1024:.0f} KB, "
+            + ', '.join(f"w:{tag} {count}" for tag, count in counts.items())
+        )
+    same = (
+        _docx_effective_formatting(outputs['formatação direta'])
+        == _docx_effective_formatting(outputs['estilos nomeados'])
+    )
+    direct_ms, named_ms = timings['formatação direta'], timings['estilos nomeados']
+    print(
+        f"[BENCH] docx-build: {sections} seção(ões) | " + ' | '.join(summaries)
+        + f" | {direct_ms / max(named_ms, 1e-6):.1f}x | formatação efetiva idêntica: {'sim' if same else 'NÃO'}"
+    )
+    return 0 if same else 1
+
+
+BENCHMARKS = {
+    "preprocess": _benchmark_preprocess,
+    "docx-engine": _benchmark_docx_engine,
+    "docx-cache": _benchmark_docx_cache,
+    "docx-streaming": _benchmark_docx_streaming,
+    "docx-build": _benchmark_docx_build,
+    "docx-lists": _benchmark_docx_lists,
+    "docx-table": _benchmark_docx_table,
+    "print-dedup": _benchmark_print_dedup,
+}
+
+
+def run_benchmark(name: str, size: int) -> int:
+    print(f"[BENCH] Executando '{name}' com tamanho {size}")
+    return BENCHMARKS[name](size)
+
+
 if __name__ == "__main__":
     args = _parse_cli_args()
+    if args.benchmark:
+        sys.exit(run_benchmark(args.benchmark, args.benchmark_size))
     md_file_path = Path(args.md_file) if args.md_file else None
     asset_base_dir_path = Path(args.asset_base_dir) if args.asset_base_dir else None
     sys.exit(
@@ -2435,5 +6604,24 @@ if __name__ == "__main__":
             inline_artifact_markers=args.inline_artifact_markers,
             asset_paths_from_md=args.asset_paths_from_md,
             asset_base_dir=asset_base_dir_path,
+            frame_options=build_frame_extraction_options(
+                workers=args.frame_workers,
+                use_cache=not args.no_frame_cache,
+                use_seek_index=not args.no_seek_index,
+                best_frame_window=args.best_frame_window,
+                best_frame_samples=args.best_frame_samples,
+                use_fingerprints=True if args.video_fingerprints else None,
+                crop_mode=args.crop_mode,
+                dedup_threshold=args.print_dedup_threshold,
+                print_dpi=args.print_dpi,
+                print_codec=args.print_codec,
+                use_proxy=False if args.final_export else (True if args.video_proxy else None),
+                roi_scale=args.print_roi_scale,
+                roi_highlight=False if args.no_print_roi_highlight else None,
+            ),
+            docx_engine=args.docx_engine,
+            use_docx_cache=not args.no_docx_cache,
+            streaming_docx=True if args.streaming_docx else None,
+            use_diagram_cache=not args.no_diagram_cache,
         )
     )
@@ -2,11 +2,13 @@ import os
 import re
 import json
 import sys
+import hashlib
 from pathlib import Path
 from typing import Optional, Callable, List, Tuple
 import base64
 import tempfile
 import shutil
+import threading
 import streamlit as st
 import streamlit.components.v1 as components
 from google import genai
@@ -17,6 +19,8 @@ from google.genai import errors as genai_errors
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from Captura.utils.models import models as internal_models
+from Captura.utils.file_index import FileIndex, build_file_index
+from Captura.utils.video_hash import video_content_hash
 from Captura.utils.layout_config import LayoutConfig, show_layout_config_modal
 import subprocess
 import sys
@@ -39,6 +43,12 @@ _RELEVANT_MODEL_PREFIXES = ("gemini-",)
 _EXCLUDED_MODEL_SUFFIXES = ("-tts",)
 _EXCLUDED_MODEL_SUBSTRINGS = ("tts", "imagen", "embedding", "aqa", "retrieval", "veo")
 INLINE_ARTIFACT_SRC_PATTERN = re.compile(r"<<\s*(?P<src>[^<>\r\n]+?)\s*>>")
+# Upload do vídeo gravado em disco em blocos, sem manter o arquivo inteiro em memória
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_DIR = Path(tempfile.gettempdir()) / "captura_uploads"
+# Fallback por bytes para a IA (vídeo inteiro em memória): desativado por padrão.
+# Ative com VIDEO_BYTES_FALLBACK_MAX_MB=<limite em MB>.
+VIDEO_BYTES_FALLBACK_MAX_MB = 0
 
 
 def _fetch_available_models(api_key: str) -> list[str]:
@@ -124,6 +134,8 @@ def _init_session_state():
         st.session_state.layout_load_attempts = 0
     if "last_video_path" not in st.session_state:
         st.session_state.last_video_path = ""
+    if "last_video_content_hash" not in st.session_state:
+        st.session_state.last_video_content_hash = ""
     if "selected_gemini_model" not in st.session_state:
         st.session_state.selected_gemini_model = ""
     if "inline_artifact_markers_enabled" not in st.session_state:
@@ -470,6 +482,49 @@ def _detect_mime(filename: str, fallback: str = "application/octet-stream") -> s
     return fallback
 
 
+def _stream_upload_to_disk(uploaded_file, suffix: str) -> Tuple[Path, int, str]:
+    """Grava o upload em disco em blocos de UPLOAD_CHUNK_BYTES calculando o SHA-256.
+    O arquivo final é nomeado pelo hash: reenviar o mesmo vídeo reaproveita o arquivo
+    (e os caches do conversor). Retorna (caminho, tamanho em bytes, sha256)."""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        uploaded_file.seek(0)
+    except Exception:
+        pass
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".part", delete=False) as tmp:
+        tmp_path = Path(tmp.name)
+        try:
+            while True:
+                chunk = uploaded_file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                tmp.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        except Exception:
+            tmp.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+    sha256 = digest.hexdigest()
+    target = UPLOAD_DIR / f"{sha256}{suffix.lower()}"
+    if target.exists() and target.stat().st_size == size:
+        tmp_path.unlink(missing_ok=True)
+    else:
+        os.replace(tmp_path, target)
+    return target, size, sha256
+
+
+def _video_bytes_fallback_limit_mb() -> float:
+    """Limite (MB) do envio do vídeo por bytes à IA; 0 desativa o fallback em memória."""
+    raw = (os.environ.get("VIDEO_BYTES_FALLBACK_MAX_MB") or "").strip()
+    try:
+        return float(raw) if raw else float(VIDEO_BYTES_FALLBACK_MAX_MB)
+    except ValueError:
+        return float(VIDEO_BYTES_FALLBACK_MAX_MB)
+
+
 def _safe_extract_text(resp) -> str:
     """Extract aggregated text from a non-streaming Gemini response."""
     try:
@@ -612,15 +667,23 @@ def run_generation(api_key: str,
                 progress(f"Falha ao usar URI do vídeo, tentando fallback por bytes…: {e}")
             video_part = None
     if video_part is None:
-        # Fallback: enviar bytes (pode falhar com vídeos grandes)
-        if not video_bytes:
-            # Como último recurso, tente ler do path
+        # Fallback: enviar bytes (vídeo inteiro em memória). Opcional e limitado por
+        # VIDEO_BYTES_FALLBACK_MAX_MB para não estourar a memória com vídeos grandes.
+        limit_mb = _video_bytes_fallback_limit_mb()
+        if not video_bytes and video_path and limit_mb > 0:
             try:
-                video_bytes = Path(video_path).read_bytes() if video_path else None
+                file_mb = Path(video_path).stat().st_size / (1024 * 1024)
+                if file_mb <= limit_mb:
+                    video_bytes = Path(video_path).read_bytes()
+                elif progress:
+                    progress(f"Vídeo de {file_mb:.0f} MB excede o limite do envio por bytes ({limit_mb:.0f} MB).")
             except Exception:
                 video_bytes = None
         if not video_bytes:
-            raise RuntimeError("Não foi possível preparar o vídeo para a IA.")
+            raise RuntimeError(
+                "Não foi possível enviar o vídeo para a IA pela Files API. O envio por bytes está "
+                "desativado ou o vídeo excede VIDEO_BYTES_FALLBACK_MAX_MB."
+            )
         video_part = types.Part.from_bytes(data=video_bytes, mime_type=video_mime)
     parts.append(video_part)
 
@@ -810,11 +873,45 @@ def _extract_inline_artifact_sources(md_text: str) -> List[str]:
     return sources
 
 
-def _infer_inline_artifacts_base_dir(md_text: str) -> Optional[Path]:
-    sources = _extract_inline_artifact_sources(md_text)
-    if not sources:
-        return None
+class _ArtifactDirectoryIndex:
+    """Índice nome de arquivo -> caminhos sob as raízes de busca dos marcadores <<...>>.
+
+    Compartilhado entre sessões (st.cache_resource) e refeito quando o mtime de alguma
+    pasta varrida muda; junto com ele é descartada a memória de pastas base já inferidas.
+    """
+
+    def __init__(self, roots: Tuple[str, ...]):
+        self.roots = roots
+        self.lock = threading.Lock()
+        self.inferred: dict[Tuple[str, ...], Path] = {}
+        self.index: FileIndex = self._build()
+
+    def _build(self) -> FileIndex:
+        index = build_file_index(Path(root) for root in self.roots)
+        print(
+            f"[DEBUG] Índice de artefatos inline: {index.file_count} arquivo(s) em "
+            f"{len(index.dir_mtimes)} pasta(s) ({index.elapsed_ms:.0f} ms)"
+        )
+        if index.truncated:
+            print(
+                f"[AVISO] Índice de artefatos inline truncado em {index.file_count} "
+                "arquivo(s); informe a pasta base manualmente se o marcador não for encontrado."
+            )
+        return index
+
+    def refresh_if_stale(self) -> None:
+        with self.lock:
+            if self.index.is_stale():
+                self.index = self._build()
+                self.inferred = {}
 
+
+@st.cache_resource(show_spinner=False)
+def _get_artifact_directory_index(roots: Tuple[str, ...]) -> _ArtifactDirectoryIndex:
+    return _ArtifactDirectoryIndex(roots)
+
+
+def _inline_artifact_search_roots() -> List[Path]:
     search_roots: List[Path] = []
     current = Path.cwd()
     search_roots.append(current)
@@ -824,49 +921,70 @@ def _infer_inline_artifacts_base_dir(md_text: str) -> Optional[Path]:
             break
         search_roots.append(parent)
         current = parent
+    return search_roots
 
-    # Tentativa direta: uma raiz onde todos os caminhos relativos já existam
-    for root in search_roots:
-        if not root.exists() or not root.is_dir():
-            continue
-        if all((root / Path(src)).exists() for src in sources if not Path(src).is_absolute()):
-            try:
-                return root.resolve()
-            except Exception:
-                return root
 
-    # Tentativa por descoberta: localizar o primeiro arquivo por sufixo do caminho
+def _has_all_inline_artifacts(base: Path, sources: List[str]) -> bool:
+    return all((base / Path(src)).exists() for src in sources if not Path(src).is_absolute())
+
+
+def _infer_base_dir_from_index(index: FileIndex, sources: List[str]) -> Optional[Path]:
     first_src = Path(sources[0])
     suffix_parts = tuple(part for part in first_src.parts if part not in ("", "."))
     if not suffix_parts:
         return None
 
-    filename = suffix_parts[-1]
-    for root in search_roots:
-        if not root.exists() or not root.is_dir():
+    for candidate in index.files_by_name.get(suffix_parts[-1].lower(), []):
+        if not _path_suffix_matches(candidate, suffix_parts):
             continue
-        try:
-            for candidate in root.rglob(filename):
-                if not candidate.is_file():
-                    continue
-                if not _path_suffix_matches(candidate, suffix_parts):
-                    continue
 
-                base_candidate = candidate
-                for _ in range(len(suffix_parts)):
-                    base_candidate = base_candidate.parent
+        base_candidate = candidate
+        for _ in range(len(suffix_parts)):
+            base_candidate = base_candidate.parent
 
-                if all((base_candidate / Path(src)).exists() for src in sources if not Path(src).is_absolute()):
-                    try:
-                        return base_candidate.resolve()
-                    except Exception:
-                        return base_candidate
-        except Exception:
-            continue
+        if _has_all_inline_artifacts(base_candidate, sources):
+            try:
+                return base_candidate.resolve()
+            except Exception:
+                return base_candidate
 
     return None
 
 
+def _infer_inline_artifacts_base_dir(md_text: str) -> Optional[Path]:
+    sources = _extract_inline_artifact_sources(md_text)
+    if not sources:
+        return None
+
+    # Tentativa direta: uma raiz onde todos os caminhos relativos já existam
+    search_roots = [root for root in _inline_artifact_search_roots() if root.is_dir()]
+    for root in search_roots:
+        if _has_all_inline_artifacts(root, sources):
+            try:
+                return root.resolve()
+            except Exception:
+                return root
+    if not search_roots:
+        return None
+
+    # Tentativa por descoberta: índice compartilhado entre sessões, refeito só se alguma pasta mudou
+    index = _get_artifact_directory_index(tuple(str(root) for root in search_roots))
+    index.refresh_if_stale()
+
+    # Mesma lista de marcadores (ex.: revisões do mesmo documento) resolve sem nova busca
+    memo_key = tuple(src.lower() for src in sources)
+    with index.lock:
+        memoized = index.inferred.get(memo_key)
+    if memoized is not None and _has_all_inline_artifacts(memoized, sources):
+        return memoized
+
+    inferred = _infer_base_dir_from_index(index.index, sources)
+    if inferred is not None:
+        with index.lock:
+            index.inferred[memo_key] = inferred
+    return inferred
+
+
 def _resolve_inline_artifacts_base_dir(md_text: str, manual_base_dir: str) -> Tuple[Optional[Path], Optional[str], bool]:
     manual = (manual_base_dir or "").strip()
     if manual:
@@ -1261,7 +1379,6 @@ def main():
         if not video_file and not uploaded_md:
             st.error("Envie um vídeo ou um arquivo .md.")
             return
-        video_bytes = video_file.read() if video_file else None
         video_mime = _detect_mime(video_file.name) if video_file else None
         transcript_bytes = transcript_file.read() if transcript_file else None
         transcript_mime = _detect_mime(transcript_file.name) if transcript_file else None
@@ -1269,34 +1386,45 @@ def main():
         try:
             with st.status("Processando documentação...", state="running") as status:
                 out_dir = _get_output_dir()
-            # 1/3: Preparar vídeo (usar bytes diretamente se upload, ou path se fornecido)
+            # 1/3: Preparar vídeo (upload gravado em disco em blocos, ou path se fornecido)
             status.write("1/3 • Preparando vídeo...")
-            try:
-                size_mb = (len(video_bytes) / (1024*1024)) if video_bytes else 0
-                status.write(f"Tamanho do vídeo: {size_mb:.1f} MB. O upload/processamento pela IA pode levar alguns minutos…")
-            except Exception:
-                size_mb = 0
-            # Preparar vídeo em temp se necessário para extração de prints
+            size_mb = 0
             video_temp_path = None
-            if video_bytes:
-                # Upload: salvar em temp
-                with tempfile.NamedTemporaryFile(suffix=Path(video_file.name).suffix if video_file else ".mp4", delete=False) as tmp:
-                    tmp.write(video_bytes)
-                    video_temp_path = Path(tmp.name)
+            if video_file:
+                try:
+                    video_temp_path, video_size, _ = _stream_upload_to_disk(
+                        video_file, Path(video_file.name).suffix or ".mp4"
+                    )
+                except Exception as up_exc:
+                    status.update(label=f"Falha ao gravar o vídeo enviado: {up_exc}", state="error")
+                    return
+                size_mb = video_size / (1024 * 1024)
+                status.write(f"Tamanho do vídeo: {size_mb:.1f} MB. O upload/processamento pela IA pode levar alguns minutos…")
             elif st.session_state.input_video_path:
                 # Path fornecido: usar diretamente
                 video_temp_path = Path(st.session_state.input_video_path)
                 if not video_temp_path.exists():
                     status.update(label=f"Arquivo de vídeo não encontrado: {video_temp_path}", state="error")
                     return
+                size_mb = video_temp_path.stat().st_size / (1024 * 1024)
             else:
                 if not uploaded_md:
                     status.update(label="Vídeo não fornecido.", state="error")
                     return
 
+            # Hash de conteúdo igual ao do conversor (amostras, não o SHA-256 do upload),
+            # para que app e linha de comando compartilhem as mesmas chaves de cache
+            video_hash = ""
+            if video_temp_path:
+                try:
+                    video_hash = video_content_hash(video_temp_path)
+                except OSError:
+                    video_hash = ""
+
             # Persistir para uso em "Aplicar alterações" (revisão)
             if video_temp_path:
                 st.session_state.last_video_path = str(video_temp_path)
+                st.session_state.last_video_content_hash = video_hash
 
             # 2/3: Obter .md (IA ou arquivo enviado)
             st.session_state.used_uploaded_md = uploaded_md is not None
@@ -1328,7 +1456,6 @@ def main():
                     video_name=video_file.name if video_file else "video.mp4",
                     video_mime=video_mime,
                     video_path=video_temp_path,
-                    video_bytes=video_bytes,
                     video_size_mb=float(size_mb) if size_mb else None,
                     transcript_name=(transcript_file.name if transcript_file else None),
                     transcript_bytes=transcript_bytes,
@@ -1393,6 +1520,9 @@ def main():
             env = os.environ.copy()
             if video_temp_path:
                 env["INPUT_VIDEO_PATH"] = str(video_temp_path)
+                if video_hash:
+                    # Hash já calculado: o conversor não precisa reler o vídeo
+                    env["INPUT_VIDEO_CONTENT_HASH"] = video_hash
             if layout_tmp_dir and layout_tmp_dir.exists():
                 env["LAYOUT_ASSETS_DIR"] = str(layout_tmp_dir)
             # Usar diretório temporário para outputs
@@ -1622,6 +1752,8 @@ def main():
                     status.update(label="Vídeo não encontrado para formatar o DOCX revisado. Gere o documento novamente informando o vídeo.", state="error")
                     return
                 env["INPUT_VIDEO_PATH"] = video_path_for_revision
+                if st.session_state.get("last_video_content_hash") and video_path_for_revision == st.session_state.get("last_video_path"):
+                    env["INPUT_VIDEO_CONTENT_HASH"] = st.session_state.last_video_content_hash
                 if layout_tmp_dir2 and layout_tmp_dir2.exists():
                     env["LAYOUT_ASSETS_DIR"] = str(layout_tmp_dir2)
                 # Usar diretório temporário para outputs
@@ -3,6 +3,17 @@ Utilitários do Captura
 """
 
 from .models import models
-from .layout_config import LayoutConfig, show_layout_config_modal
+from .file_index import FileIndex, build_file_index
+from .video_hash import video_content_hash
 
-__all__ = ['models', 'LayoutConfig', 'show_layout_config_modal']
+__all__ = ['models', 'LayoutConfig', 'show_layout_config_modal', 'FileIndex', 'build_file_index',
+           'video_content_hash']
+
+
+def __getattr__(name):
+    # layout_config depende do Streamlit; importado só quando usado, para que o
+    # conversor (subprocesso) possa usar os demais utilitários sem ele
+    if name in ('LayoutConfig', 'show_layout_config_modal'):
+        from . import layout_config
+        return getattr(layout_config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
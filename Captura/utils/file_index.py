@@ -0,0 +1,94 @@
+"""
+Índice nome de arquivo -> caminhos, montado numa varredura limitada das raízes de busca.
+
+Usado pelo conversor (imagens do Markdown não encontradas no caminho direto) e pelo
+app (pasta base dos marcadores <<...>>). As raízes costumam incluir pais do diretório
+de trabalho, que podem ser a home do usuário ou um compartilhamento de rede, por isso
+a profundidade e o total de arquivos são limitados, pastas ocultas e de dependências
+são ignoradas e links simbólicos não são seguidos.
+"""
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List
+
+FILE_INDEX_MAX_DEPTH = 6
+FILE_INDEX_MAX_FILES = 50000
+FILE_INDEX_SKIP_DIRS: FrozenSet[str] = frozenset({
+    "__pycache__", "node_modules", "venv", "env", "site-packages",
+})
+
+
+@dataclass
+class FileIndex:
+    """Resultado da varredura: arquivos por nome (minúsculo) e mtime de cada pasta lida."""
+
+    files_by_name: Dict[str, List[Path]]
+    dir_mtimes: Dict[str, int]  # pasta varrida -> st_mtime_ns
+    file_count: int
+    truncated: bool
+    elapsed_ms: float
+
+    def is_stale(self) -> bool:
+        """Se alguma pasta varrida mudou (arquivo criado, removido ou renomeado)."""
+        for directory, mtime in self.dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+
+def build_file_index(
+    roots: Iterable[Path],
+    max_depth: int = FILE_INDEX_MAX_DEPTH,
+    max_files: int = FILE_INDEX_MAX_FILES,
+    skip_dirs: FrozenSet[str] = FILE_INDEX_SKIP_DIRS,
+) -> FileIndex:
+    """
+    Varre as raízes em largura. Pastas já lidas por outra raiz (cwd dentro do pai)
+    não são repetidas; a varredura para ao atingir max_files arquivos.
+    """
+    started = time.perf_counter()
+    files_by_name: Dict[str, List[Path]] = {}
+    dir_mtimes: Dict[str, int] = {}
+    file_count = 0
+    truncated = False
+    for root in roots:
+        pending = deque([(str(root), 0)])
+        while pending and not truncated:
+            directory, depth = pending.popleft()
+            directory_key = os.path.normcase(directory)
+            if directory_key in dir_mtimes:
+                continue
+            try:
+                dir_mtimes[directory_key] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as scanner:
+                    entries = list(scanner)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth < max_depth and not entry.name.startswith('.') and entry.name not in skip_dirs:
+                            pending.append((entry.path, depth + 1))
+                    elif entry.is_file():
+                        files_by_name.setdefault(entry.name.lower(), []).append(Path(entry.path))
+                        file_count += 1
+                except OSError:
+                    continue
+                if file_count >= max_files:
+                    truncated = True
+                    break
+        if truncated:
+            break
+    return FileIndex(
+        files_by_name=files_by_name,
+        dir_mtimes=dir_mtimes,
+        file_count=file_count,
+        truncated=truncated,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
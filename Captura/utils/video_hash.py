@@ -0,0 +1,23 @@
+"""
+Hash de conteúdo do vídeo usado como chave dos caches do conversor (frames, índice
+de seek, impressões digitais, proxy, DOCX).
+
+O app e o conversor precisam produzir exatamente o mesmo valor para o mesmo vídeo,
+por isso ambos usam esta função; o app repassa o resultado em INPUT_VIDEO_CONTENT_HASH.
+"""
+import hashlib
+from pathlib import Path
+
+# Para não ler vídeos de vários GB inteiros: tamanho + amostras do início, meio e fim
+VIDEO_HASH_SAMPLE_BYTES = 4 * 1024 * 1024
+
+
+def video_content_hash(video_path: Path) -> str:
+    size = video_path.stat().st_size
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    sample = VIDEO_HASH_SAMPLE_BYTES
+    with video_path.open('rb') as handle:
+        for offset in (0, max(size // 2 - sample // 2, 0), max(size - sample, 0)):
+            handle.seek(offset)
+            digest.update(handle.read(sample))
+    return digest.hexdigest()
@@ -33,7 +33,7 @@ setup(
     install_requires=[
         "streamlit>=1.28.0",
         "google-genai>=0.2.0",
-        "python-docx>=0.8.11",
+        "python-docx>=1.2.0,<1.3",
         "markdown>=3.5.0",
         "beautifulsoup4>=4.12.0",
         "opencv-python>=4.8.0",